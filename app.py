@@ -4,6 +4,7 @@ PrePlay - 预演伙伴
 """
 import sys
 import os
+import re
 from pathlib import Path
 
 # 添加项目根目录到 Python 路径
@@ -13,6 +14,11 @@ if str(project_root) not in sys.path:
 
 import streamlit as st
 from utils.file_handler import parse_uploaded_file
+from config import UPLOAD_CONFIG, UPLOAD_MAX_FILE_MB
+from utils.metrics import start_metrics_server
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
 
 # 页面配置
 st.set_page_config(
@@ -22,6 +28,9 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+# 运行指标端点（每个进程只启动一次）
+start_metrics_server()
+
 # 隐藏侧边栏菜单
 hide_menu_style = """
     <style>
@@ -69,13 +78,13 @@ def validate_uploaded_file(file) -> dict:
     Returns:
         {"valid": True/False, "error": "错误信息"}
     """
-    # 大小检查：5MB = 5 * 1024 * 1024 bytes
-    max_size = 5 * 1024 * 1024
+    # 大小检查：上限由 UPLOAD_MAX_FILE_MB 配置，超过分片大小的文件走分片上传
+    max_size = UPLOAD_CONFIG["max_file_bytes"]
     if file.size > max_size:
         size_mb = file.size / (1024 * 1024)
         return {
             "valid": False,
-            "error": f"文件大小超过 5MB（当前：{size_mb:.2f}MB）"
+            "error": f"文件大小超过 {UPLOAD_MAX_FILE_MB}MB（当前：{size_mb:.2f}MB）"
         }
 
     # 格式检查：只支持 txt 和 docx
@@ -114,6 +123,30 @@ def upload_file_to_knowledge(file_path, file_name) -> tuple:
         return False, None, f"网络错误：{str(e)}"
 
 
+def upload_large_file_to_knowledge(file) -> tuple:
+    """
+    分片上传大文件到知识库
+
+    Args:
+        file: Streamlit 上传的文件对象
+
+    Returns:
+        (success: bool, file_ids: list or None, error: str or None)
+    """
+    try:
+        from services.knowledge_service import get_knowledge_service
+
+        service = get_knowledge_service()
+        result = service.upload_large_document(file, file.name)
+
+        if result["success"]:
+            return True, result["file_ids"], None
+        else:
+            return False, None, result.get("error", "上传失败")
+    except Exception as e:
+        return False, None, f"网络错误：{str(e)}"
+
+
 def refresh_training_history():
     """从数据库刷新训练记录"""
     try:
@@ -148,7 +181,7 @@ def refresh_training_history():
 
         st.session_state.training_history = history
     except Exception as e:
-        print(f"加载训练记录失败: {str(e)}")
+        logger.error("加载训练记录失败: %s", e)
         st.session_state.training_history = []
 
 
@@ -185,7 +218,7 @@ if st.session_state.training_to_delete:
         db = get_db()
         db.delete_session(st.session_state.training_to_delete)
     except Exception as e:
-        print(f"删除会话失败: {str(e)}")
+        logger.error("删除会话失败: %s", e)
 
     # 从 session state 删除
     st.session_state.training_history = [
@@ -195,7 +228,44 @@ if st.session_state.training_to_delete:
     st.session_state.training_to_delete = None
     st.rerun()
 
-if st.session_state.training_history:
+# 按内容搜索训练记录
+search_query = st.text_input(
+    "搜索训练记录",
+    placeholder="🔍 输入关键词搜索历史对话（多个关键词用空格分隔）",
+    label_visibility="collapsed"
+)
+if search_query.strip():
+    import time
+
+    from services.session_service import search_training_history
+
+    search_start = time.perf_counter()
+    try:
+        search_results = search_training_history(search_query)
+    except Exception as e:
+        logger.error("搜索训练记录失败: %s", e)
+        search_results = []
+    st.caption(f"找到 {len(search_results)} 个训练（{(time.perf_counter() - search_start) * 1000:.0f} 毫秒）")
+
+    role_display = {"user": "👤 你", "assistant": "🤖 AI"}
+    for result in search_results:
+        with st.container():
+            col1, col2 = st.columns([4, 1])
+            with col1:
+                st.markdown(f"📄 **训练-{result['session_id'][-6:]}**　<small>🕐 {str(result['created_at'])[:16]}　"
+                            f"命中 {result['hits']} 条消息</small>", unsafe_allow_html=True)
+                for msg in result["messages"]:
+                    display = role_display.get(msg["role"], msg["role"])
+                    if msg["source"]:
+                        display = msg["source"]
+                    text = msg["snippet"] or (msg["content"][:80] + ("..." if len(msg["content"]) > 80 else ""))
+                    st.caption(f"{display}：{text.replace(chr(10), ' ')}")
+            with col2:
+                if st.button("继续", key=f"search_continue_{result['session_id']}", use_container_width=True):
+                    st.session_state.current_training_id = result['session_id']
+                    st.switch_page("pages/1_训练.py")
+        st.divider()
+elif st.session_state.training_history:
     for record in st.session_state.training_history:
         with st.container():
             col1, col2, col3 = st.columns([3, 1, 1])
@@ -233,14 +303,14 @@ def get_knowledge_files_from_api():
         result = service.get_document_list(current_page=1, page_size=100)
 
         if result["success"]:
-            print(f"[DEBUG] 从 API 获取了 {result['total']} 个文件")
+            logger.debug("从 API 获取了 %d 个文件", result["total"])
             return result["files"]
         else:
-            print(f"[DEBUG] API 调用失败: {result.get('error')}")
+            logger.warning("获取文件列表失败: %s", result.get("error"))
             st.error(f"获取文件列表失败: {result.get('error')}")
             return []
     except Exception as e:
-        print(f"[DEBUG] 获取文件列表异常: {str(e)}")
+        logger.exception("获取文件列表异常: %s", e)
         st.error(f"获取文件列表异常: {str(e)}")
         return []
 
@@ -302,10 +372,10 @@ if knowledge_files:
 
         if result["success"]:
             st.success(f"文件已从知识库删除")
-            print(f"[DEBUG] 已从知识库删除: {file_id_to_delete}")
+            logger.info("已从知识库删除", extra={"file_id": file_id_to_delete})
         else:
             st.error(f"删除失败: {result.get('error', '未知错误')}")
-            print(f"[DEBUG] 删除失败: {result}")
+            logger.warning("知识库删除失败: %s", result.get("error"), extra={"file_id": file_id_to_delete})
 
         st.session_state.file_to_delete_kb = None
         st.rerun()
@@ -317,7 +387,7 @@ else:
 st.markdown("#### 📤 上传新文件")
 
 uploaded_files = st.file_uploader(
-    "选择文件（支持 txt, docx，最大 5MB）",
+    f"选择文件（支持 txt, docx，最大 {UPLOAD_MAX_FILE_MB}MB）",
     type=["txt", "docx"],
     accept_multiple_files=True,
     help="上传你的汇报材料，AI 将基于此内容进行训练",
@@ -331,9 +401,10 @@ if uploaded_files:
         if file.name in st.session_state.processed_files:
             continue
 
-        # 检查文件是否已经在知识库中（通过文件名）
+        # 检查文件是否已经在知识库中（通过文件名，分片上传的文件按分片文件名 <主名>_part<序号>.txt 匹配）
+        part_pattern = re.compile(rf"{re.escape(os.path.splitext(file.name)[0])}_part\d+\.txt")
         file_exists = any(
-            f.get("fileName", "") == file.name
+            f.get("fileName", "") == file.name or part_pattern.fullmatch(f.get("fileName", ""))
             for f in knowledge_files
         )
         if file_exists:
@@ -345,6 +416,19 @@ if uploaded_files:
         if not validation_result["valid"]:
             # 校验失败
             st.error(f"文件 {file.name} 校验失败：{validation_result['error']}")
+        elif file.size > UPLOAD_CONFIG["chunk_bytes"]:
+            # 大文件：流式提取并分片上传
+            with st.spinner(f"正在分片上传 {file.name} 到知识库..."):
+                success, file_ids, error = upload_large_file_to_knowledge(file)
+
+                if success:
+                    st.success(f"文件 {file.name} 上传成功！（共 {len(file_ids)} 个分片）")
+                    logger.info("文件分片上传成功", extra={"file_ids": file_ids})
+                    st.session_state.processed_files.add(file.name)
+                    st.session_state.knowledge_file_ids.extend(file_ids)
+                else:
+                    st.error(f"文件 {file.name} 上传失败：{error}")
+                    logger.warning("文件分片上传失败: %s", error)
         else:
             # 上传到知识库
             with st.spinner(f"正在上传 {file.name} 到知识库..."):
@@ -367,14 +451,19 @@ if uploaded_files:
 
                 if success:
                     st.success(f"文件 {file.name} 上传成功！")
-                    print(f"[DEBUG] 文件上传成功: {file_id}")
+                    logger.info("文件上传成功", extra={"file_id": file_id})
                     # 标记为已处理，防止重复上传
                     st.session_state.processed_files.add(file.name)
                     # 添加到知识库文件 IDs 列表
                     st.session_state.knowledge_file_ids.append(file_id)
                 else:
                     st.error(f"文件 {file.name} 上传失败：{error}")
-                    print(f"[DEBUG] 文件上传失败: {error}")
+                    logger.warning("文件上传失败: %s", error)
+
+    # 新文件上传后，在后台为当前知识库预生成开场问题
+    if st.session_state.knowledge_file_ids:
+        from services.opening_service import prepare_opening_questions
+        prepare_opening_questions(st.session_state.knowledge_file_ids)
 
     # 刷新页面以显示新文件
     st.rerun()
@@ -409,6 +498,9 @@ with col2:
         if st.button("🚀 开始训练", type="primary", use_container_width=True):
             st.session_state.training_started = True
             st.session_state.training_file_ids = st.session_state.knowledge_file_ids.copy()
+            # 问题池不足时在后台补充，供后续训练直接开场
+            from services.opening_service import prepare_opening_questions
+            prepare_opening_questions(st.session_state.training_file_ids)
             st.switch_page("pages/1_训练.py")
     else:
         st.button("🚀 开始训练", type="primary", use_container_width=True, disabled=True)
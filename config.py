@@ -4,10 +4,13 @@ PrePlay 配置管理
 从 .env 文件读取所有配置
 """
 import os
-from dotenv import load_dotenv
+from pathlib import Path
 
-# 加载环境变量
-load_dotenv()
+# 加载环境变量（没有 .env 文件时不导入 python-dotenv）
+_env_path = Path(__file__).parent / ".env"
+if _env_path.exists():
+    from dotenv import load_dotenv
+    load_dotenv(_env_path)
 
 
 # ============================================
@@ -75,3 +78,342 @@ CHATDOC_CONFIG = {
     "base_url": CHATDOC_BASE_URL,
     "ws_url": CHATDOC_WS_URL
 }
+
+# ============================================
+# 文档解析缓存配置
+# ============================================
+PARSE_CACHE_ENABLED = os.getenv("PARSE_CACHE_ENABLED", "true").lower() == "true"
+PARSE_CACHE_DIR = os.getenv(
+    "PARSE_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "parsed")
+)
+PARSE_CACHE_MAX_MB = int(os.getenv("PARSE_CACHE_MAX_MB", "200"))
+
+PARSE_CACHE_CONFIG = {
+    "enabled": PARSE_CACHE_ENABLED,
+    "cache_dir": PARSE_CACHE_DIR,
+    "max_bytes": PARSE_CACHE_MAX_MB * 1024 * 1024
+}
+
+# ============================================
+# 文档上传配置
+# ============================================
+UPLOAD_MAX_FILE_MB = int(os.getenv("UPLOAD_MAX_FILE_MB", "100"))
+# 超过该大小的文档会被拆分为多个知识库文件分片上传
+UPLOAD_CHUNK_MB = float(os.getenv("UPLOAD_CHUNK_MB", "4"))
+
+UPLOAD_CONFIG = {
+    "max_file_bytes": UPLOAD_MAX_FILE_MB * 1024 * 1024,
+    "chunk_bytes": int(UPLOAD_CHUNK_MB * 1024 * 1024),
+    "read_block_bytes": 1024 * 1024
+}
+
+# ============================================
+# 知识库文件内容存储配置
+# ============================================
+# 压缩算法：zstd（需安装 zstandard，未安装时自动回退为 zlib）/ zlib / none
+CONTENT_COMPRESSION = os.getenv("CONTENT_COMPRESSION", "zstd").lower()
+CONTENT_COMPRESSION_LEVEL = int(os.getenv("CONTENT_COMPRESSION_LEVEL", "6"))
+
+# ============================================
+# 训练轮次编排配置
+# ============================================
+# 知识库检索的最长等待时间（秒），超时后不带检索结果继续对话
+TURN_RETRIEVAL_TIMEOUT = float(os.getenv("TURN_RETRIEVAL_TIMEOUT", "8"))
+# 推测执行：检索的同时先发起不带知识库上下文的对话，检索及时返回则替换
+TURN_SPECULATIVE = os.getenv("TURN_SPECULATIVE", "false").lower() == "true"
+TURN_MAX_WORKERS = int(os.getenv("TURN_MAX_WORKERS", "16"))
+
+TURN_CONFIG = {
+    "retrieval_timeout": TURN_RETRIEVAL_TIMEOUT,
+    "speculative": TURN_SPECULATIVE,
+    "max_workers": TURN_MAX_WORKERS
+}
+
+# ============================================
+# WebSocket 调用截止时间配置（秒）
+# ============================================
+WS_CONNECT_TIMEOUT = float(os.getenv("WS_CONNECT_TIMEOUT", "10"))
+WS_FIRST_TOKEN_TIMEOUT = float(os.getenv("WS_FIRST_TOKEN_TIMEOUT", "30"))
+WS_TOTAL_TIMEOUT = float(os.getenv("WS_TOTAL_TIMEOUT", "120"))
+
+WS_TIMEOUT_CONFIG = {
+    "connect": WS_CONNECT_TIMEOUT,
+    "first_token": WS_FIRST_TOKEN_TIMEOUT,
+    "total": WS_TOTAL_TIMEOUT
+}
+
+# ============================================
+# 上游服务容错配置（重试、退避、熔断）
+# ============================================
+RESILIENCE_MAX_RETRIES = int(os.getenv("RESILIENCE_MAX_RETRIES", "2"))
+RESILIENCE_BASE_DELAY = float(os.getenv("RESILIENCE_BASE_DELAY", "0.5"))
+RESILIENCE_MAX_DELAY = float(os.getenv("RESILIENCE_MAX_DELAY", "4"))
+# 连续失败达到阈值后熔断，冷却期内直接失败，冷却结束后放行一次试探请求
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+
+RESILIENCE_CONFIG = {
+    "max_retries": RESILIENCE_MAX_RETRIES,
+    "base_delay": RESILIENCE_BASE_DELAY,
+    "max_delay": RESILIENCE_MAX_DELAY,
+    "failure_threshold": CIRCUIT_FAILURE_THRESHOLD,
+    "reset_timeout": CIRCUIT_RESET_TIMEOUT
+}
+
+# ============================================
+# 客户端限流配置（QPS 令牌桶 + 并发上限）
+# ============================================
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# 排队超过该时间（秒）仍未获得配额则放弃请求
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "120"))
+
+RATE_LIMIT_CONFIG = {
+    "red": {
+        "qps": float(os.getenv("RATE_LIMIT_RED_QPS", "2")),
+        "burst": int(os.getenv("RATE_LIMIT_RED_BURST", "4")),
+        "max_concurrency": int(os.getenv("RATE_LIMIT_RED_CONCURRENCY", "4"))
+    },
+    "blue": {
+        "qps": float(os.getenv("RATE_LIMIT_BLUE_QPS", "2")),
+        "burst": int(os.getenv("RATE_LIMIT_BLUE_BURST", "4")),
+        "max_concurrency": int(os.getenv("RATE_LIMIT_BLUE_CONCURRENCY", "4"))
+    },
+    "chatdoc": {
+        "qps": float(os.getenv("RATE_LIMIT_CHATDOC_QPS", "2")),
+        "burst": int(os.getenv("RATE_LIMIT_CHATDOC_BURST", "4")),
+        "max_concurrency": int(os.getenv("RATE_LIMIT_CHATDOC_CONCURRENCY", "4"))
+    },
+    "moonshot": {
+        "qps": float(os.getenv("RATE_LIMIT_MOONSHOT_QPS", "1")),
+        "burst": int(os.getenv("RATE_LIMIT_MOONSHOT_BURST", "2")),
+        "max_concurrency": int(os.getenv("RATE_LIMIT_MOONSHOT_CONCURRENCY", "2"))
+    }
+}
+
+# ============================================
+# 对冲请求配置（降低红/蓝方长尾延迟）
+# ============================================
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+# 首个回复超过历史首包延迟的该分位数仍未到达时，发起第二个请求
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "1"))
+# 样本不足时使用的默认对冲延迟（秒）
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "3"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+# 对冲请求数不超过普通请求数的该比例
+HEDGE_MAX_EXTRA_RATIO = float(os.getenv("HEDGE_MAX_EXTRA_RATIO", "0.1"))
+
+HEDGE_CONFIG = {
+    "enabled": HEDGE_ENABLED,
+    "percentile": HEDGE_PERCENTILE,
+    "min_delay": HEDGE_MIN_DELAY,
+    "default_delay": HEDGE_DEFAULT_DELAY,
+    "min_samples": HEDGE_MIN_SAMPLES,
+    "max_extra_ratio": HEDGE_MAX_EXTRA_RATIO
+}
+
+# ============================================
+# 助手回复缓存配置（相同提示词直接返回本地结果）
+# ============================================
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+
+RESPONSE_CACHE_CONFIG = {
+    "enabled": RESPONSE_CACHE_ENABLED,
+    "max_entries": RESPONSE_CACHE_MAX_ENTRIES,
+    "ttl": RESPONSE_CACHE_TTL
+}
+
+# ============================================
+# 开场问题预生成配置
+# ============================================
+# 预生成会额外调用红方接口，默认关闭
+OPENING_QUESTIONS_ENABLED = os.getenv("OPENING_QUESTIONS_ENABLED", "false").lower() == "true"
+# 每个知识库文件集合保持的开场问题数量
+OPENING_POOL_SIZE = int(os.getenv("OPENING_POOL_SIZE", "3"))
+
+OPENING_CONFIG = {
+    "enabled": OPENING_QUESTIONS_ENABLED,
+    "pool_size": OPENING_POOL_SIZE
+}
+
+# ============================================
+# 下一轮检索预取配置（用户输入期间预先检索）
+# ============================================
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "false").lower() == "true"
+# 预取结果的有效期（秒）
+PREFETCH_TTL = float(os.getenv("PREFETCH_TTL", "300"))
+# 用户输入中出现在预取依据里的字符二元组占比不低于该值时才复用预取结果
+PREFETCH_MIN_OVERLAP = float(os.getenv("PREFETCH_MIN_OVERLAP", "0.3"))
+
+PREFETCH_CONFIG = {
+    "enabled": PREFETCH_ENABLED,
+    "ttl": PREFETCH_TTL,
+    "min_overlap": PREFETCH_MIN_OVERLAP
+}
+
+# ============================================
+# 训练引擎与独立服务配置（python -m services.training_server）
+# ============================================
+# 默认只监听本机；监听其他地址时必须设置 TRAINING_SERVER_TOKEN
+TRAINING_SERVER_HOST = os.getenv("TRAINING_SERVER_HOST", "127.0.0.1")
+TRAINING_SERVER_PORT = int(os.getenv("TRAINING_SERVER_PORT", "8600"))
+# 调用方需在 Authorization: Bearer <token> 中携带，留空则不校验（仅允许监听本机地址）
+TRAINING_SERVER_TOKEN = os.getenv("TRAINING_SERVER_TOKEN", "")
+
+TRAINING_ENGINE_CONFIG = {
+    "host": TRAINING_SERVER_HOST,
+    "port": TRAINING_SERVER_PORT,
+    "token": TRAINING_SERVER_TOKEN,
+    # 执行训练轮次、报告生成等阻塞调用的线程数
+    "workers": int(os.getenv("TRAINING_SERVER_WORKERS", "32")),
+    # 内存中保留对话状态的会话数，超出后最久未使用的会话在下次访问时从数据库恢复
+    "max_sessions": int(os.getenv("TRAINING_ENGINE_MAX_SESSIONS", "500"))
+}
+
+# ============================================
+# 批量报告配置（python -m tools.bulk_report）
+# ============================================
+REPORT_BULK_CONCURRENCY = int(os.getenv("REPORT_BULK_CONCURRENCY", "4"))
+REPORT_EXPORT_DIR = os.getenv(
+    "REPORT_EXPORT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "exports", "reports")
+)
+
+REPORT_BULK_CONFIG = {
+    # 同时生成的报告数（实际请求速率仍受 RATE_LIMIT_MOONSHOT_* 限制）
+    "concurrency": REPORT_BULK_CONCURRENCY,
+    "export_dir": REPORT_EXPORT_DIR
+}
+
+# ============================================
+# 本地训练分析配置（报告页面的即时分析，不调用大模型）
+# ============================================
+ANALYTICS_CONFIG = {
+    # 问题与文档章节的相似度（TF-IDF 余弦）达到该值时视为覆盖了该章节
+    "coverage_threshold": float(os.getenv("ANALYTICS_COVERAGE_THRESHOLD", "0.1")),
+    # 每个会话参与覆盖分析的最大章节数
+    "max_sections": int(os.getenv("ANALYTICS_MAX_SECTIONS", "200"))
+}
+
+# ============================================
+# 日志配置
+# ============================================
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# text 或 json（每行一个 JSON 对象）
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+# 日志文件路径，留空则只输出到控制台
+LOG_FILE = os.getenv("LOG_FILE", "")
+
+LOG_CONFIG = {
+    "level": LOG_LEVEL,
+    "format": LOG_FORMAT,
+    "file": LOG_FILE,
+    # 单个日志文件上限与保留份数
+    "file_max_bytes": int(os.getenv("LOG_FILE_MAX_MB", "20")) * 1024 * 1024,
+    "file_backups": int(os.getenv("LOG_FILE_BACKUPS", "5")),
+    # DEBUG 级别日志的采样比例（0-1），高频调试日志只输出一部分
+    "debug_sample_rate": float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))
+}
+
+# ============================================
+# 链路追踪配置
+# ============================================
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+# 追踪记录导出的 JSON Lines 文件路径，留空则只保存在内存中
+TRACING_EXPORT_PATH = os.getenv("TRACING_EXPORT_PATH", "")
+# 每个会话在内存中保留的最近追踪数
+TRACING_MAX_TRACES_PER_SESSION = int(os.getenv("TRACING_MAX_TRACES_PER_SESSION", "50"))
+# 在内存中保留追踪记录的会话数（按最近使用淘汰）
+TRACING_MAX_SESSIONS = int(os.getenv("TRACING_MAX_SESSIONS", "500"))
+
+TRACING_CONFIG = {
+    "enabled": TRACING_ENABLED,
+    "export_path": TRACING_EXPORT_PATH,
+    "max_traces_per_session": TRACING_MAX_TRACES_PER_SESSION,
+    "max_sessions": TRACING_MAX_SESSIONS
+}
+
+# ============================================
+# 运行指标配置（Prometheus 格式）
+# ============================================
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# 指标端口没有鉴权，默认只监听本机；需要远程采集时显式设置为 0.0.0.0 等地址
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# 与 Streamlit（8501）相邻的端口
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8502"))
+
+METRICS_CONFIG = {
+    "enabled": METRICS_ENABLED,
+    "host": METRICS_HOST,
+    "port": METRICS_PORT,
+    # 统计活跃会话的时间窗口（秒）
+    "active_session_window": int(os.getenv("METRICS_ACTIVE_SESSION_WINDOW", "900"))
+}
+
+# ============================================
+# 慢请求性能剖析配置（默认关闭）
+# ============================================
+# 启用后，训练轮次或报告生成超过阈值时自动保存一份性能剖析，按会话ID归档
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+# sampling：后台线程定时采样调用栈，开销低；cprofile：记录每次函数调用，结果精确但开销较大
+PROFILING_MODE = os.getenv("PROFILING_MODE", "sampling")
+
+PROFILING_CONFIG = {
+    "enabled": PROFILING_ENABLED,
+    "mode": PROFILING_MODE,
+    # 训练轮次超过该耗时（秒）时保存剖析结果
+    "turn_threshold": float(os.getenv("PROFILING_TURN_THRESHOLD", "15")),
+    # 报告生成超过该耗时（秒）时保存剖析结果
+    "report_threshold": float(os.getenv("PROFILING_REPORT_THRESHOLD", "60")),
+    # 采样间隔（秒，仅 sampling 模式）
+    "sample_interval": float(os.getenv("PROFILING_SAMPLE_INTERVAL", "0.01")),
+    "output_dir": os.getenv("PROFILING_OUTPUT_DIR", ".cache/profiles"),
+    # 每个会话最多保留的剖析结果数
+    "max_per_session": int(os.getenv("PROFILING_MAX_PER_SESSION", "20"))
+}
+
+# ============================================
+# 本地模拟服务配置（离线压测/基准测试用）
+# ============================================
+# 启用后红方、蓝方、知识库与报告接口全部指向本地模拟服务（python -m tools.mock_server）
+MOCK_ENABLED = os.getenv("MOCK_ENABLED", "false").lower() == "true"
+MOCK_HOST = os.getenv("MOCK_HOST", "127.0.0.1")
+MOCK_PORT = int(os.getenv("MOCK_PORT", "8765"))
+
+MOCK_CONFIG = {
+    "host": MOCK_HOST,
+    "port": MOCK_PORT,
+    # 首个内容帧前的延迟（秒）
+    "first_token_latency": float(os.getenv("MOCK_FIRST_TOKEN_LATENCY", "0.5")),
+    # 流式输出速率（字/秒）
+    "token_rate": float(os.getenv("MOCK_TOKEN_RATE", "50")),
+    # 每帧字数
+    "chunk_chars": int(os.getenv("MOCK_CHUNK_CHARS", "8")),
+    # 每次回复的字数
+    "response_chars": int(os.getenv("MOCK_RESPONSE_CHARS", "200")),
+    # REST 接口的处理延迟（秒）
+    "rest_latency": float(os.getenv("MOCK_REST_LATENCY", "0.1")),
+    # 错误注入比例（0-1）与注入的错误码
+    "error_rate": float(os.getenv("MOCK_ERROR_RATE", "0")),
+    "error_code": int(os.getenv("MOCK_ERROR_CODE", "10110")),
+    # 随机种子，保证多次运行的延迟与错误序列一致
+    "seed": int(os.getenv("MOCK_SEED", "42"))
+}
+
+if MOCK_ENABLED:
+    _mock_http = f"http://{MOCK_HOST}:{MOCK_PORT}"
+    _mock_ws = f"ws://{MOCK_HOST}:{MOCK_PORT}"
+    RED_CONFIG["ws_url"] = f"{_mock_ws}/red/chat"
+    BLUE_CONFIG["ws_url"] = f"{_mock_ws}/blue/chat"
+    CHATDOC_CONFIG["base_url"] = _mock_http
+    CHATDOC_CONFIG["ws_url"] = f"{_mock_ws}/openapi/chat"
+    MOONSHOT_CONFIG["base_url"] = _mock_http
+    MOONSHOT_CONFIG["model"] = MOONSHOT_CONFIG["model"] or "mock-model"
+    # 模拟服务不校验签名，未配置的密钥用占位值填充
+    for _config in (RED_CONFIG, BLUE_CONFIG, CHATDOC_CONFIG, MOONSHOT_CONFIG):
+        for _key in ("app_id", "api_key", "api_secret"):
+            if _key in _config and not _config[_key]:
+                _config[_key] = "mock"
@@ -6,9 +6,103 @@ PrePlay 数据库管理
 import sqlite3
 import json
 import os
+import threading
+import time
+import zlib
+from functools import wraps
 from datetime import datetime
 from typing import List, Dict, Optional
 
+from config import CONTENT_COMPRESSION, CONTENT_COMPRESSION_LEVEL
+from utils.metrics import record_db_query
+
+# zstandard 为可选依赖，未安装时回退为 zlib
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# ============================================
+# 文本压缩
+# ============================================
+
+def compress_content(text: Optional[str]) -> tuple:
+    """
+    压缩文本内容
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        (data, codec): 压缩后的字节和编码名称（zstd/zlib/none）
+    """
+    if text is None:
+        return None, None
+
+    raw = text.encode("utf-8")
+    codec = CONTENT_COMPRESSION
+    if codec == "zstd" and zstandard is None:
+        codec = "zlib"
+
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=CONTENT_COMPRESSION_LEVEL).compress(raw), "zstd"
+    if codec == "zlib":
+        return zlib.compress(raw, CONTENT_COMPRESSION_LEVEL), "zlib"
+    return raw, "none"
+
+
+def decompress_content(data, codec: Optional[str]) -> Optional[str]:
+    """
+    解压文本内容
+
+    Args:
+        data: 存储的内容（字节或旧版未压缩的字符串）
+        codec: 编码名称，为空表示旧版未压缩文本
+
+    Returns:
+        原始文本
+    """
+    if data is None:
+        return None
+    if codec is None or isinstance(data, str):
+        return data if isinstance(data, str) else bytes(data).decode("utf-8")
+
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("内容使用 zstd 压缩，请安装 zstandard")
+        raw = zstandard.ZstdDecompressor().decompress(data)
+    elif codec == "zlib":
+        raw = zlib.decompress(data)
+    else:
+        raw = bytes(data)
+    return raw.decode("utf-8")
+
+
+# ============================================
+# 连接锁
+# ============================================
+
+def synchronized(method):
+    """
+    在数据库锁内执行方法
+
+    所有线程共用一个连接，游标操作与提交需要串行执行；
+    同时记录等待锁的时间与执行时间，供压测与运行指标观察锁竞争和查询耗时。
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        start = time.perf_counter()
+        with self._lock:
+            acquired = time.perf_counter()
+            lock_wait = acquired - start
+            self._record_lock_wait(lock_wait)
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                record_db_query(method.__name__, time.perf_counter() - acquired, lock_wait)
+    return wrapper
+
 
 class DatabaseManager:
     """数据库管理类"""
@@ -16,8 +110,37 @@ class DatabaseManager:
     def __init__(self, db_path: str = "preplay.db"):
         self.db_path = db_path
         self.conn = None
+        self._lock = threading.RLock()
+        self._lock_stats = {"acquisitions": 0, "contended": 0, "total_wait": 0.0, "max_wait": 0.0}
+        # SQLite 未编译 FTS5 或版本低于 3.34（不支持 trigram 分词）时，搜索回退为 LIKE 扫描
+        self.fts_enabled = False
         self._init_db()
 
+    def _record_lock_wait(self, wait):
+        stats = self._lock_stats
+        stats["acquisitions"] += 1
+        # 超过 1 毫秒视为发生了竞争
+        if wait > 0.001:
+            stats["contended"] += 1
+        stats["total_wait"] += wait
+        stats["max_wait"] = max(stats["max_wait"], wait)
+
+    def get_lock_stats(self) -> Dict:
+        """
+        获取数据库锁的等待统计
+
+        Returns:
+            acquisitions（加锁次数）, contended（等待超过 1 毫秒的次数）, total_wait, max_wait（秒）
+        """
+        with self._lock:
+            return dict(self._lock_stats)
+
+    def reset_lock_stats(self):
+        """清零数据库锁的等待统计"""
+        with self._lock:
+            for key in self._lock_stats:
+                self._lock_stats[key] = 0 if key in ("acquisitions", "contended") else 0.0
+
     def connect(self):
         """建立数据库连接"""
         if self.conn is None:
@@ -55,6 +178,12 @@ class DatabaseManager:
             # 列已存在，忽略
             pass
 
+        # 清空对话历史时记录的最后一条消息ID，此前的消息不再作为对话上下文（仍参与报告）
+        try:
+            cursor.execute("ALTER TABLE sessions ADD COLUMN history_cutoff_id INTEGER")
+        except sqlite3.OperationalError:
+            pass
+
         # 创建知识库文件表
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS knowledge_files (
@@ -63,11 +192,18 @@ class DatabaseManager:
                 file_name TEXT NOT NULL,
                 file_type TEXT NOT NULL,
                 file_size INTEGER,
-                content TEXT,
+                content BLOB,
+                content_codec TEXT,
                 uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         """)
 
+        # 兼容旧数据库：添加 content_codec 列（如果不存在），NULL 表示未压缩文本
+        try:
+            cursor.execute("ALTER TABLE knowledge_files ADD COLUMN content_codec TEXT")
+        except sqlite3.OperationalError:
+            pass
+
         # 创建消息表
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS messages (
@@ -92,12 +228,115 @@ class DatabaseManager:
             ON messages(timestamp)
         """)
 
+        # 创建开场问题池表（按知识库文件集合预生成的红方开场问题）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS opening_questions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                knowledge_key TEXT NOT NULL,
+                question TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_opening_questions_key
+            ON opening_questions(knowledge_key)
+        """)
+
+        # 创建报告表（每个会话保存最近一次生成的报告，对话指纹不变时直接复用）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS reports (
+                session_id TEXT PRIMARY KEY,
+                content BLOB NOT NULL,
+                content_codec TEXT,
+                message_count INTEGER NOT NULL,
+                fingerprint TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (session_id) REFERENCES sessions(id) ON DELETE CASCADE
+            )
+        """)
+
+        # 创建训练分析缓存表（本地计算的分析结果，对话或知识库变化后重新计算）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS session_analytics (
+                session_id TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                data TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (session_id) REFERENCES sessions(id) ON DELETE CASCADE
+            )
+        """)
+
         conn.commit()
 
+        self._compress_legacy_knowledge_content()
+        self._init_message_search()
+
+    def _init_message_search(self):
+        """
+        创建消息全文索引
+
+        使用 trigram 分词（按连续三个字符切分，适合中文），索引与 messages 表通过触发器同步；
+        首次创建时为已有消息建立索引。
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'")
+        exists = cursor.fetchone() is not None
+        try:
+            cursor.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                    content, content='messages', content_rowid='id', tokenize='trigram'
+                )
+            """)
+        except sqlite3.OperationalError:
+            return
+
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+                INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+                INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+                INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+            END
+        """)
+        if not exists:
+            cursor.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+        conn.commit()
+        self.fts_enabled = True
+
+    def _compress_legacy_knowledge_content(self):
+        """将旧版未压缩的知识库文件内容转为压缩存储"""
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute(
+            "SELECT file_id, content FROM knowledge_files WHERE content IS NOT NULL AND content_codec IS NULL"
+        )
+        rows = cursor.fetchall()
+        for row in rows:
+            data, codec = compress_content(decompress_content(row["content"], None))
+            cursor.execute(
+                "UPDATE knowledge_files SET content = ?, content_codec = ? WHERE file_id = ?",
+                (data, codec, row["file_id"])
+            )
+        if rows:
+            conn.commit()
+
     # ============================================
     # 会话操作
     # ============================================
 
+    @synchronized
     def create_session(self, session_id: str) -> bool:
         """
         创建新的训练会话
@@ -122,6 +361,7 @@ class DatabaseManager:
             # 会话ID已存在
             return False
 
+    @synchronized
     def update_session_sids(self, session_id: str, red_sid: str = None, blue_sid: str = None) -> bool:
         """
         更新会话的红/蓝方sid
@@ -159,6 +399,7 @@ class DatabaseManager:
         conn.commit()
         return cursor.rowcount > 0
 
+    @synchronized
     def get_session(self, session_id: str) -> Optional[Dict]:
         """
         获取会话信息
@@ -182,6 +423,7 @@ class DatabaseManager:
             return dict(row)
         return None
 
+    @synchronized
     def list_sessions(self, limit: int = 10) -> List[Dict]:
         """
         列出最近的会话
@@ -202,6 +444,52 @@ class DatabaseManager:
 
         return [dict(row) for row in cursor.fetchall()]
 
+    @synchronized
+    def find_sessions(self, since: str = None, until: str = None, session_ids: List[str] = None) -> List[Dict]:
+        """
+        按创建时间范围或会话ID筛选会话（按创建时间先后）
+
+        Args:
+            since: 起始时间（本地时间，含），如 "2025-03-01" 或 "2025-03-01 08:00:00"
+            until: 截止时间（本地时间，不含）
+            session_ids: 会话ID列表（可选）
+
+        Returns:
+            会话列表，每个会话附带消息数 message_count
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        conditions = []
+        params = []
+        # created_at 由 CURRENT_TIMESTAMP 写入，为 UTC 时间
+        if since:
+            conditions.append("datetime(s.created_at, 'localtime') >= datetime(?)")
+            params.append(since)
+        if until:
+            conditions.append("datetime(s.created_at, 'localtime') < datetime(?)")
+            params.append(until)
+        if session_ids is not None:
+            if not session_ids:
+                return []
+            conditions.append(f"s.id IN ({', '.join('?' * len(session_ids))})")
+            params.extend(session_ids)
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor.execute(
+            f"""
+            SELECT s.*, COUNT(m.id) AS message_count
+            FROM sessions s LEFT JOIN messages m ON m.session_id = s.id
+            {where}
+            GROUP BY s.id
+            ORDER BY s.created_at ASC
+            """,
+            params
+        )
+
+        return [dict(row) for row in cursor.fetchall()]
+
+    @synchronized
     def update_session_knowledge_file_ids(self, session_id: str, file_ids: List[str]) -> bool:
         """
         更新会话关联的知识库文件 ID 列表
@@ -230,6 +518,7 @@ class DatabaseManager:
         conn.commit()
         return cursor.rowcount > 0
 
+    @synchronized
     def get_session_knowledge_file_ids(self, session_id: str) -> List[str]:
         """
         获取会话关联的知识库文件 ID 列表
@@ -260,6 +549,7 @@ class DatabaseManager:
     # 消息操作
     # ============================================
 
+    @synchronized
     def add_message(self, session_id: str, role: str, content: str, source: str = "", timestamp: str = None) -> int:
         """
         添加一条消息
@@ -293,9 +583,13 @@ class DatabaseManager:
         conn.commit()
         return cursor.lastrowid
 
+    @synchronized
     def get_messages(self, session_id: str) -> List[Dict]:
         """
-        获取会话的所有消息（按时间排序）
+        获取会话的所有消息（按写入顺序排序）
+
+        旧版本保存的时间戳只有时分秒，与完整日期时间混在一起无法按时间排序，
+        因此按自增ID排序。
 
         Args:
             session_id: 会话ID
@@ -311,13 +605,66 @@ class DatabaseManager:
             SELECT id, session_id, role, source, content, timestamp
             FROM messages
             WHERE session_id = ?
-            ORDER BY timestamp ASC
+            ORDER BY id ASC
             """,
             (session_id,)
         )
 
         return [dict(row) for row in cursor.fetchall()]
 
+    @synchronized
+    def get_session_watermark(self, session_id: str) -> Optional[Dict]:
+        """
+        获取会话对话记录的版本标记，用于判断内存中的对话状态是否过期
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            {"last_message_id": 最后一条消息ID（没有消息时为0）, "history_cutoff_id": 清空历史的位置}，
+            会话不存在返回None
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute(
+            """
+            SELECT COALESCE((SELECT MAX(id) FROM messages WHERE session_id = s.id), 0) AS last_message_id,
+                   COALESCE(s.history_cutoff_id, 0) AS history_cutoff_id
+            FROM sessions s
+            WHERE s.id = ?
+            """,
+            (session_id,)
+        )
+
+        row = cursor.fetchone()
+        if row:
+            return dict(row)
+        return None
+
+    @synchronized
+    def update_session_history_cutoff(self, session_id: str, message_id: int) -> bool:
+        """
+        记录清空对话历史的位置
+
+        Args:
+            session_id: 会话ID
+            message_id: 清空时的最后一条消息ID
+
+        Returns:
+            是否更新成功
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute(
+            "UPDATE sessions SET history_cutoff_id = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (message_id, session_id)
+        )
+        conn.commit()
+        return cursor.rowcount > 0
+
+    @synchronized
     def get_messages_for_report(self, session_id: str) -> List[Dict]:
         """
         获取用于生成报告的消息列表（格式化）
@@ -342,6 +689,7 @@ class DatabaseManager:
 
         return result
 
+    @synchronized
     def delete_session(self, session_id: str) -> bool:
         """
         删除会话及其所有消息
@@ -355,6 +703,9 @@ class DatabaseManager:
         conn = self.connect()
         cursor = conn.cursor()
 
+        cursor.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        cursor.execute("DELETE FROM reports WHERE session_id = ?", (session_id,))
+        cursor.execute("DELETE FROM session_analytics WHERE session_id = ?", (session_id,))
         cursor.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
         conn.commit()
         return cursor.rowcount > 0
@@ -363,6 +714,7 @@ class DatabaseManager:
     # 知识库文件管理
     # ============================================
 
+    @synchronized
     def add_knowledge_file(self, file_id: str, file_name: str, file_type: str, file_size: int = None, content: str = None) -> int:
         """
         添加知识库文件记录
@@ -380,29 +732,33 @@ class DatabaseManager:
         conn = self.connect()
         cursor = conn.cursor()
 
+        data, codec = compress_content(content)
+
         cursor.execute(
             """
-            INSERT INTO knowledge_files (file_id, file_name, file_type, file_size, content)
-            VALUES (?, ?, ?, ?, ?)
+            INSERT INTO knowledge_files (file_id, file_name, file_type, file_size, content, content_codec)
+            VALUES (?, ?, ?, ?, ?, ?)
             """,
-            (file_id, file_name, file_type, file_size, content)
+            (file_id, file_name, file_type, file_size, data, codec)
         )
         conn.commit()
         return cursor.lastrowid
 
+    @synchronized
     def get_knowledge_files(self) -> List[Dict]:
         """
-        获取所有知识库文件列表
+        获取所有知识库文件列表（仅元数据，不含内容）
 
         Returns:
-            文件列表
+            文件列表，stored_size 为内容的存储字节数
         """
         conn = self.connect()
         cursor = conn.cursor()
 
         cursor.execute(
             """
-            SELECT id, file_id, file_name, file_type, file_size, content, uploaded_at
+            SELECT id, file_id, file_name, file_type, file_size,
+                   length(content) AS stored_size, uploaded_at
             FROM knowledge_files
             ORDER BY uploaded_at DESC
             """
@@ -410,6 +766,31 @@ class DatabaseManager:
 
         return [dict(row) for row in cursor.fetchall()]
 
+    @synchronized
+    def get_knowledge_file_content(self, file_id: str) -> Optional[str]:
+        """
+        获取知识库文件内容（按需解压）
+
+        Args:
+            file_id: 知识库文件ID
+
+        Returns:
+            文件文本内容，不存在返回None
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute(
+            "SELECT content, content_codec FROM knowledge_files WHERE file_id = ?",
+            (file_id,)
+        )
+
+        row = cursor.fetchone()
+        if row:
+            return decompress_content(row["content"], row["content_codec"])
+        return None
+
+    @synchronized
     def delete_knowledge_file(self, file_id: str) -> bool:
         """
         删除知识库文件记录
@@ -427,6 +808,7 @@ class DatabaseManager:
         conn.commit()
         return cursor.rowcount > 0
 
+    @synchronized
     def delete_all_knowledge_files(self) -> bool:
         """
         删除所有知识库文件记录
@@ -441,6 +823,7 @@ class DatabaseManager:
         conn.commit()
         return True
 
+    @synchronized
     def get_knowledge_file_by_id(self, file_id: str) -> Optional[Dict]:
         """
         通过file_id获取知识库文件
@@ -461,13 +844,316 @@ class DatabaseManager:
 
         row = cursor.fetchone()
         if row:
-            return dict(row)
+            result = dict(row)
+            result["content"] = decompress_content(result["content"], result.pop("content_codec"))
+            return result
         return None
 
+    # ============================================
+    # 开场问题池
+    # ============================================
+
+    @synchronized
+    def add_opening_questions(self, knowledge_key: str, questions: List[str]) -> int:
+        """
+        向开场问题池添加问题
+
+        Args:
+            knowledge_key: 知识库文件集合的键
+            questions: 问题列表
+
+        Returns:
+            添加的数量
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.executemany(
+            "INSERT INTO opening_questions (knowledge_key, question) VALUES (?, ?)",
+            [(knowledge_key, q) for q in questions]
+        )
+        conn.commit()
+        return cursor.rowcount
+
+    @synchronized
+    def pop_opening_question(self, knowledge_key: str) -> Optional[str]:
+        """
+        取出（并删除）一个最早生成的开场问题
+
+        Args:
+            knowledge_key: 知识库文件集合的键
+
+        Returns:
+            问题内容，池为空返回None
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        while True:
+            cursor.execute(
+                """
+                SELECT id, question FROM opening_questions
+                WHERE knowledge_key = ?
+                ORDER BY id ASC LIMIT 1
+                """,
+                (knowledge_key,)
+            )
+            row = cursor.fetchone()
+            if row is None:
+                return None
+
+            cursor.execute("DELETE FROM opening_questions WHERE id = ?", (row["id"],))
+            conn.commit()
+            # 删除成功才算取到，避免并发时两个会话拿到同一个问题
+            if cursor.rowcount > 0:
+                return row["question"]
+
+    @synchronized
+    def count_opening_questions(self, knowledge_key: str) -> int:
+        """
+        统计开场问题池中的问题数量
+
+        Args:
+            knowledge_key: 知识库文件集合的键
+
+        Returns:
+            问题数量
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute(
+            "SELECT COUNT(*) AS count FROM opening_questions WHERE knowledge_key = ?",
+            (knowledge_key,)
+        )
+        return cursor.fetchone()["count"]
+
+    # ============================================
+    # 全文搜索
+    # ============================================
+
+    def _search_terms(self, query: str) -> tuple:
+        """
+        拆分搜索词
+
+        Returns:
+            (FTS5 查询表达式或None, 需要用 LIKE 匹配的短词列表)；trigram 索引只能匹配不少于 3 个字的词
+        """
+        terms = query.split()
+        if not self.fts_enabled:
+            return None, terms
+        long_terms = [t for t in terms if len(t) >= 3]
+        short_terms = [t for t in terms if len(t) < 3]
+        match = " AND ".join('"' + t.replace('"', '""') + '"' for t in long_terms) or None
+        return match, short_terms
+
+    @synchronized
+    def search_messages(self, query: str, session_limit: int = 20, messages_per_session: int = 3) -> List[Dict]:
+        """
+        按内容搜索训练记录
+
+        多个词以空格分隔，需同时出现在同一条消息中；会话按最相关消息的 BM25 得分排序。
+
+        Args:
+            query: 搜索词
+            session_limit: 返回的会话数
+            messages_per_session: 每个会话返回的匹配消息数
+
+        Returns:
+            [{"session_id", "created_at", "hits"（匹配消息数）, "messages": [
+                {"id", "role", "source", "timestamp", "content", "snippet"}]}, ...]
+        """
+        match, short_terms = self._search_terms(query.strip())
+        if not match and not short_terms:
+            return []
+
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        like_sql = "".join(" AND m.content LIKE ? ESCAPE '\\'" for _ in short_terms)
+        like_params = [
+            "%" + t.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%" for t in short_terms
+        ]
+        if match:
+            source = "messages_fts f JOIN messages m ON m.id = f.rowid"
+            where = "messages_fts MATCH ?" + like_sql
+            params = [match] + like_params
+            # rank 为 BM25 得分（越小越相关）；bm25()/snippet() 不能用于聚合与窗口函数
+            score = "f.rank"
+        else:
+            source = "messages m"
+            where = like_sql[len(" AND "):]
+            params = like_params
+            # 没有相关度得分时按时间倒序
+            score = "-julianday(m.timestamp)"
+
+        # 只统计仍存在的会话
+        cursor.execute(
+            f"""
+            SELECT m.session_id, s.created_at, COUNT(*) AS hits, MIN({score}) AS best
+            FROM {source} JOIN sessions s ON s.id = m.session_id
+            WHERE {where}
+            GROUP BY m.session_id
+            ORDER BY best ASC, s.created_at DESC
+            LIMIT ?
+            """,
+            params + [session_limit]
+        )
+        sessions = [dict(row) for row in cursor.fetchall()]
+        if not sessions:
+            return []
+
+        # 每个会话最相关的若干条消息
+        cursor.execute(
+            f"""
+            SELECT id FROM (
+                SELECT m.id, ROW_NUMBER() OVER (PARTITION BY m.session_id ORDER BY {score}) AS n
+                FROM {source}
+                WHERE {where} AND m.session_id IN ({", ".join("?" * len(sessions))})
+            )
+            WHERE n <= ?
+            ORDER BY n
+            """,
+            params + [s["session_id"] for s in sessions] + [messages_per_session]
+        )
+        ids = [row["id"] for row in cursor.fetchall()]
+        position = {message_id: i for i, message_id in enumerate(ids)}
+
+        # 按 rowid 限定全文索引的行，只为选中的消息生成摘要
+        snippet, id_column = ("snippet(messages_fts, 0, '**', '**', '…', 24)", "f.rowid") if match else ("NULL", "m.id")
+        cursor.execute(
+            f"""
+            SELECT m.id, m.session_id, m.role, m.source, m.timestamp, m.content, {snippet} AS snippet
+            FROM {source}
+            WHERE {where} AND {id_column} IN ({", ".join("?" * len(ids))})
+            """,
+            params + ids
+        )
+        messages = {}
+        # 在 SQL 中按 rank 排序会为全部匹配行计算得分，这里按上一步的相关度顺序排列
+        for row in sorted(cursor.fetchall(), key=lambda row: position[row["id"]]):
+            message = dict(row)
+            messages.setdefault(message.pop("session_id"), []).append(message)
+
+        for session in sessions:
+            session.pop("best")
+            session["messages"] = messages.get(session["session_id"], [])
+        return sessions
+
+    # ============================================
+    # 训练报告
+    # ============================================
+
+    @synchronized
+    def save_report(self, session_id: str, content: str, message_count: int, fingerprint: str) -> bool:
+        """
+        保存会话的训练报告（覆盖之前的报告）
+
+        Args:
+            session_id: 会话ID
+            content: 报告内容（Markdown）
+            message_count: 生成报告时的消息数
+            fingerprint: 生成报告时的对话指纹
+
+        Returns:
+            是否保存成功
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        data, codec = compress_content(content)
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO reports (session_id, content, content_codec, message_count, fingerprint, created_at)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            """,
+            (session_id, data, codec, message_count, fingerprint)
+        )
+        conn.commit()
+        return cursor.rowcount > 0
+
+    @synchronized
+    def get_report(self, session_id: str) -> Optional[Dict]:
+        """
+        获取会话保存的训练报告
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            报告信息字典（content 为解压后的 Markdown），不存在返回None
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT * FROM reports WHERE session_id = ?", (session_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        result = dict(row)
+        result["content"] = decompress_content(result["content"], result.pop("content_codec"))
+        return result
+
+    # ============================================
+    # 训练分析缓存
+    # ============================================
+
+    @synchronized
+    def save_session_analytics(self, session_id: str, fingerprint: str, data: Dict) -> bool:
+        """
+        保存会话的训练分析结果
+
+        Args:
+            session_id: 会话ID
+            fingerprint: 计算时的对话指纹
+            data: 分析结果
+
+        Returns:
+            是否保存成功
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO session_analytics (session_id, fingerprint, data, created_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            """,
+            (session_id, fingerprint, json.dumps(data, ensure_ascii=False))
+        )
+        conn.commit()
+        return cursor.rowcount > 0
+
+    @synchronized
+    def get_session_analytics(self, session_id: str) -> Optional[Dict]:
+        """
+        获取会话缓存的训练分析结果
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            {"fingerprint", "data", "created_at"}，不存在返回None
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute(
+            "SELECT fingerprint, data, created_at FROM session_analytics WHERE session_id = ?",
+            (session_id,)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        result = dict(row)
+        result["data"] = json.loads(result["data"])
+        return result
+
     # ============================================
     # 统计信息
     # ============================================
 
+    @synchronized
     def get_session_stats(self, session_id: str) -> Dict:
         """
         获取会话统计信息
@@ -552,6 +1238,12 @@ def get_all_knowledge_files() -> List[Dict]:
     return db.get_knowledge_files()
 
 
+def get_knowledge_file_content(file_id: str) -> Optional[str]:
+    """获取知识库文件内容"""
+    db = get_db()
+    return db.get_knowledge_file_content(file_id)
+
+
 def delete_knowledge_file(file_id: str) -> bool:
     """删除知识库文件记录"""
     db = get_db()
@@ -13,8 +13,11 @@ if str(project_root) not in sys.path:
 
 import streamlit as st
 from datetime import datetime
-from services.report_service import generate_report
-from services.session_service import get_training_stats, get_report_data
+from services.report_service import generate_report, get_session_report, conversation_fingerprint
+from services.rate_limiter import PRIORITY_BACKGROUND, get_expected_wait
+from services.session_service import get_training_stats, get_report_data, get_training_report
+from services.analytics_service import get_session_analytics
+from utils.metrics import start_metrics_server
 
 # 页面配置
 st.set_page_config(
@@ -24,6 +27,9 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+# 运行指标端点（每个进程只启动一次）
+start_metrics_server()
+
 # 隐藏侧边栏菜单
 hide_menu_style = """
     <style>
@@ -94,14 +100,75 @@ st.write(f"🔄 对话轮次：{st.session_state.get('current_round', 0)}")
 
 st.divider()
 
+# 本地训练分析（不调用大模型，生成 AI 报告前即可查看）
+analytics = get_session_analytics(session_id) if session_id else None
+if analytics and analytics["turns"]:
+    st.markdown("### 🔍 训练分析")
+
+    response_time = analytics["response_time"]
+    fillers = analytics["fillers"]
+    filler_rate = fillers["hesitation"]["per_100_chars"] + fillers["hedging"]["per_100_chars"]
+    coverage = analytics["coverage"]
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("平均回答字数", f"{analytics['length']['mean']:.0f}")
+    with col2:
+        st.metric("回答用时（中位数）", f"{response_time['median']:.0f} 秒" if response_time else "—")
+    with col3:
+        st.metric("犹豫/含糊用语", f"{filler_rate:.1f} 次/百字")
+    with col4:
+        st.metric("文档章节覆盖", f"{coverage['covered']}/{coverage['total']}" if coverage else "—")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown("**回答字数分布**")
+        st.bar_chart(analytics["length"]["histogram"])
+        if fillers["top_words"]:
+            st.caption("常用犹豫/含糊用语：" + "、".join(f"{w['word']}（{w['count']}）" for w in fillers["top_words"]))
+    with col2:
+        st.markdown("**逐轮统计**")
+        target_display = {"red": "🔴 红方", "blue": "🔵 蓝方", None: "—"}
+        st.dataframe([
+            {
+                "轮次": turn["turn"],
+                "对象": target_display[turn["target"]],
+                "回答字数": turn["chars"],
+                "回答用时（秒）": turn["response_time"],
+                "AI 回复耗时（秒）": turn["reply_latency"],
+                "犹豫/含糊用语": turn["fillers"]
+            }
+            for turn in analytics["per_turn"]
+        ], use_container_width=True, hide_index=True)
+
+    if coverage:
+        with st.expander(f"📚 文档章节覆盖（{coverage['ratio']:.0%}）"):
+            for section in coverage["sections"]:
+                mark = "✅" if section["questions"] else "⬜"
+                st.write(f"{mark} {section['title']}" + (f"（{section['questions']} 个问题）" if section["questions"] else ""))
+
+    st.divider()
+
 # KIMI AI 报告生成
 st.markdown("### 🤖 AI 训练分析报告")
 
+# 对话没有变化时直接显示已保存的报告（例如批量生成过的报告）
+if session_id and conversation and not st.session_state.get("kimi_report"):
+    saved_report = get_training_report(session_id)
+    if saved_report and saved_report["fingerprint"] == conversation_fingerprint(conversation):
+        st.session_state.kimi_report = saved_report["content"]
+
 # 生成报告按钮
 if st.button("✨ 生成 AI 报告", type="primary", use_container_width=True):
-    with st.spinner("🤖 正在调用 KIMI 生成报告，请稍候..."):
+    spinner_text = "🤖 正在调用 KIMI 生成报告，请稍候..."
+    expected_wait = get_expected_wait("moonshot", PRIORITY_BACKGROUND)
+    if expected_wait >= 1:
+        spinner_text += f"（当前排队中，预计等待 {expected_wait:.0f} 秒）"
+    with st.spinner(spinner_text):
         try:
-            report_markdown = generate_report(conversation)
+            # 生成的报告按会话保存；数据库中没有对话记录时只生成不保存
+            saved = get_session_report(session_id, force=True) if session_id else None
+            report_markdown = saved["report"] if saved else generate_report(conversation, session_id=session_id)
             st.session_state.kimi_report = report_markdown
             st.success("✅ 报告生成成功！")
         except Exception as e:
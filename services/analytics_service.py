@@ -0,0 +1,391 @@
+# coding: utf-8
+"""
+训练分析服务
+基于 messages 表在本地计算训练指标（不调用大模型）：回答用时、回答长度分布、
+犹豫/含糊用语频率、红方问题对知识库文档章节的覆盖。结果按会话缓存，对话或知识库变化后重新计算
+"""
+import math
+import re
+import sys
+from datetime import datetime
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from config import ANALYTICS_CONFIG
+from database import get_knowledge_file_content
+from services.session_service import get_session_service
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 计算方法变化时递增，使已缓存的结果失效
+ANALYTICS_VERSION = 1
+
+FILLER_WORDS = {
+    # 犹豫：口头停顿与填充词
+    "hesitation": ["嗯", "呃", "额", "那个", "就是说", "然后呢", "怎么说呢", "……", "..."],
+    # 含糊：不确定、缺乏把握的表达
+    "hedging": ["可能", "好像", "大概", "也许", "或许", "应该是", "差不多", "我觉得", "感觉"]
+}
+
+# 回答字数分布的分箱边界
+LENGTH_BINS = [0, 20, 50, 100, 200, 400, math.inf]
+
+_HEADING_PATTERN = re.compile(
+    r"^(#{1,6}\s+\S.*"
+    r"|第[一二三四五六七八九十百零\d]+[章节部分篇].*"
+    r"|[一二三四五六七八九十]+[、.．]\s*\S.*"
+    r"|\d+(\.\d+)+\s*\S.*)$"
+)
+_SENTENCE_END = ("。", "，", "；", "：", "！", "？", ".", ",", ";", ":")
+_TOKEN_PATTERN = re.compile(r"[一-鿿]+|[A-Za-z0-9]+")
+
+
+def _np():
+    # numpy 只在实际计算时导入，避免拖慢页面首次加载
+    import numpy
+    return numpy
+
+
+# ============================================
+# 时间与回答
+# ============================================
+
+def _parse_timestamps(timestamps):
+    """
+    解析消息时间戳
+
+    Returns:
+        (秒数数组, 是否为完整日期时间)；旧数据只有 HH:MM:SS，按当天秒数处理并展开跨零点
+    """
+    np = _np()
+    values = []
+    full = True
+    for ts in timestamps:
+        ts = str(ts or "")
+        try:
+            values.append(datetime.strptime(ts[:19], "%Y-%m-%d %H:%M:%S").timestamp())
+            continue
+        except ValueError:
+            full = False
+        try:
+            t = datetime.strptime(ts[-8:], "%H:%M:%S")
+            values.append(t.hour * 3600 + t.minute * 60 + t.second)
+        except ValueError:
+            values.append(np.nan)
+
+    seconds = np.array(values, dtype=float)
+    if not full and len(seconds) > 1:
+        seconds = seconds - seconds[0] if not np.isnan(seconds[0]) else seconds
+        wraps = np.concatenate([[0], np.cumsum(np.diff(seconds) < -43200)])
+        seconds = seconds + wraps * 86400
+    return seconds, full
+
+
+def _stats(values):
+    np = _np()
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return None
+    return {
+        "count": int(len(values)),
+        "mean": float(values.mean()),
+        "median": float(np.median(values)),
+        "p90": float(np.percentile(values, 90)),
+        "max": float(values.max())
+    }
+
+
+def _turn_metrics(messages):
+    """按用户发言统计回答用时、回答耗时与长度"""
+    np = _np()
+    roles = np.array([
+        "user" if m["role"] == "user" else ("red" if "红" in (m.get("source") or "") else "blue")
+        for m in messages
+    ])
+    seconds, full = _parse_timestamps([m["timestamp"] for m in messages])
+    user_idx = np.flatnonzero(roles == "user")
+    lengths = np.array([len(messages[i]["content"]) for i in user_idx], dtype=float)
+
+    # 用户回答用时：红方提问到用户回答的间隔
+    prev_idx = user_idx - 1
+    answers_red = (prev_idx >= 0) & (roles[np.clip(prev_idx, 0, None)] == "red")
+    response_time = np.where(answers_red, seconds[user_idx] - seconds[np.clip(prev_idx, 0, None)], np.nan)
+    response_time[response_time < 0] = np.nan
+
+    # AI 回答耗时：用户发言到下一条回答的间隔（旧数据回答与提问记录为同一时间，无法统计）
+    next_idx = user_idx + 1
+    has_reply = next_idx < len(messages)
+    reply_latency = np.full(len(user_idx), np.nan)
+    if full:
+        safe_next = np.clip(next_idx, None, len(messages) - 1)
+        replied = has_reply & (roles[safe_next] != "user")
+        reply_latency = np.where(replied, seconds[safe_next] - seconds[user_idx], np.nan)
+
+    targets = [roles[i + 1] if i + 1 < len(messages) and roles[i + 1] != "user" else None for i in user_idx]
+    return user_idx, lengths, response_time, reply_latency, targets
+
+
+# ============================================
+# 犹豫/含糊用语
+# ============================================
+
+def _filler_metrics(texts, lengths):
+    np = _np()
+    words = [(category, word) for category, items in FILLER_WORDS.items() for word in items]
+    counts = np.array([[text.count(word) for _, word in words] for text in texts], dtype=float).reshape(
+        len(texts), len(words)
+    )
+    total_chars = float(lengths.sum())
+    categories = np.array([category for category, _ in words])
+
+    result = {"per_turn": counts.sum(axis=1).astype(int).tolist(), "top_words": []}
+    for category in FILLER_WORDS:
+        total = float(counts[:, categories == category].sum())
+        result[category] = {
+            "count": int(total),
+            # 每百字出现次数
+            "per_100_chars": total / total_chars * 100 if total_chars else 0.0
+        }
+
+    totals = counts.sum(axis=0)
+    for j in np.argsort(-totals)[:5]:
+        if totals[j] > 0:
+            result["top_words"].append({"word": words[j][1], "count": int(totals[j])})
+    return result
+
+
+# ============================================
+# 文档章节覆盖
+# ============================================
+
+def split_sections(text, max_sections=None):
+    """
+    按标题把文档切分为章节
+
+    识别 Markdown 标题、"第X章"、"一、"、"3.1" 形式的短标题行；识别不到标题时按 500 字分段。
+
+    Args:
+        text: 文档文本
+        max_sections: 最多返回的章节数（可选）
+
+    Returns:
+        [{"title": 标题, "text": 章节文本}, ...]
+    """
+    sections = []
+    title, lines = None, []
+    for raw in text.splitlines():
+        line = raw.strip()
+        # 标题行较短且不以句末标点结尾（排除折行后以编号开头的正文）
+        if line and len(line) <= 40 and not line.endswith(_SENTENCE_END) and _HEADING_PATTERN.match(line):
+            if title is not None or "".join(lines).strip("=-— "):
+                sections.append({"title": title or "开头", "text": "\n".join(lines)})
+            title, lines = line.lstrip("# "), [line]
+        else:
+            lines.append(line)
+    if title is not None or "".join(lines).strip("=-— "):
+        sections.append({"title": title or "开头", "text": "\n".join(lines)})
+
+    if len(sections) < 2:
+        body = re.sub(r"\s+", "", text)
+        sections = [
+            {"title": f"第 {i // 500 + 1} 段", "text": body[i:i + 500]}
+            for i in range(0, len(body), 500)
+        ]
+    return sections[:max_sections] if max_sections else sections
+
+
+def _terms(text):
+    """中文按相邻两字、英文与数字按整词切分"""
+    terms = []
+    for token in _TOKEN_PATTERN.findall(text):
+        if token.isascii():
+            terms.append(token.lower())
+        elif len(token) == 1:
+            terms.append(token)
+        else:
+            terms.extend(token[i:i + 2] for i in range(len(token) - 1))
+    return terms
+
+
+def _tfidf_matrix(docs, vocab, idf):
+    np = _np()
+    matrix = np.zeros((len(docs), len(vocab)))
+    for row, doc in enumerate(docs):
+        cols = [vocab[t] for t in _terms(doc) if t in vocab]
+        if cols:
+            np.add.at(matrix[row], cols, 1.0)
+    matrix = np.log1p(matrix) * idf
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def _coverage_metrics(questions, sections, threshold):
+    """每个红方问题归入最相似的章节，相似度达到阈值的章节视为已覆盖"""
+    np = _np()
+    section_terms = [set(_terms(s["text"])) for s in sections]
+    vocab = {term: i for i, term in enumerate(sorted(set().union(*section_terms)))}
+    if not vocab:
+        return None
+
+    df = np.zeros(len(vocab))
+    for terms in section_terms:
+        df[[vocab[t] for t in terms]] += 1
+    idf = np.log((1 + len(sections)) / (1 + df)) + 1
+
+    section_matrix = _tfidf_matrix([s["text"] for s in sections], vocab, idf)
+    question_matrix = _tfidf_matrix(questions, vocab, idf)
+    similarity = question_matrix @ section_matrix.T if questions else np.zeros((0, len(sections)))
+
+    best = similarity.argmax(axis=1) if questions else np.array([], dtype=int)
+    best_score = similarity.max(axis=1) if questions else np.array([])
+    matched = best_score >= threshold
+    hits = np.bincount(best[matched], minlength=len(sections))
+    max_score = similarity.max(axis=0) if questions else np.zeros(len(sections))
+
+    return {
+        "covered": int((hits > 0).sum()),
+        "total": len(sections),
+        "ratio": float((hits > 0).mean()),
+        "unmatched_questions": int((~matched).sum()),
+        "sections": [
+            {"title": s["title"], "questions": int(hits[i]), "score": float(max_score[i])}
+            for i, s in enumerate(sections)
+        ]
+    }
+
+
+# ============================================
+# 会话分析
+# ============================================
+
+def analyze_messages(messages, documents=None, config=None):
+    """
+    计算一组消息的训练分析
+
+    Args:
+        messages: 数据库消息（role, source, content, timestamp），按时间排序
+        documents: 知识库文档文本列表（可选，用于章节覆盖）
+        config: 分析配置，默认取 ANALYTICS_CONFIG
+
+    Returns:
+        dict: turns, response_time, reply_latency, length, fillers, coverage, per_turn
+    """
+    np = _np()
+    config = config or ANALYTICS_CONFIG
+
+    user_idx, lengths, response_time, reply_latency, targets = _turn_metrics(messages)
+    texts = [messages[i]["content"] for i in user_idx]
+
+    histogram, _ = np.histogram(lengths, bins=LENGTH_BINS)
+    labels = [
+        f"{int(low)}-{int(high) - 1}" if high != math.inf else f"{int(low)}+"
+        for low, high in zip(LENGTH_BINS[:-1], LENGTH_BINS[1:])
+    ]
+    fillers = _filler_metrics(texts, lengths)
+
+    coverage = None
+    if documents:
+        sections = []
+        for document in documents:
+            sections.extend(split_sections(document))
+        sections = sections[:config["max_sections"]]
+        questions = [m["content"] for m in messages if m["role"] == "assistant" and "红" in (m.get("source") or "")]
+        if sections:
+            coverage = _coverage_metrics(questions, sections, config["coverage_threshold"])
+
+    def _value(x):
+        return None if np.isnan(x) else float(x)
+
+    return {
+        "version": ANALYTICS_VERSION,
+        "turns": int(len(user_idx)),
+        "response_time": _stats(response_time),
+        "reply_latency": _stats(reply_latency),
+        "length": {
+            "total_chars": int(lengths.sum()),
+            **(_stats(lengths) or {}),
+            "p10": float(np.percentile(lengths, 10)) if len(lengths) else None,
+            "histogram": dict(zip(labels, histogram.astype(int).tolist()))
+        },
+        "fillers": fillers,
+        "coverage": coverage,
+        "per_turn": [
+            {
+                "turn": n + 1,
+                "target": targets[n],
+                "chars": int(lengths[n]),
+                "response_time": _value(response_time[n]),
+                "reply_latency": _value(reply_latency[n]),
+                "fillers": fillers["per_turn"][n]
+            }
+            for n in range(len(user_idx))
+        ]
+    }
+
+
+def _session_documents(file_ids):
+    documents = []
+    for file_id in file_ids:
+        content = get_knowledge_file_content(file_id)
+        if content:
+            documents.append(content)
+    return documents
+
+
+class AnalyticsService:
+    """训练分析服务"""
+
+    def __init__(self, config=None):
+        self.config = config or ANALYTICS_CONFIG
+
+    def get_session_analytics(self, session_id, force=False):
+        """
+        获取会话的训练分析（对话与知识库文件未变化时直接返回缓存）
+
+        Args:
+            session_id: 会话ID
+            force: 是否忽略缓存重新计算
+
+        Returns:
+            分析结果dict，会话没有消息时返回None
+        """
+        service = get_session_service()
+        messages = service.get_messages(session_id)
+        if not messages:
+            return None
+
+        file_ids = service.get_knowledge_file_ids(session_id) or []
+        fingerprint = f"v{ANALYTICS_VERSION}:{len(messages)}:{messages[-1]['id']}:{','.join(file_ids)}"
+        if not force:
+            cached = service.db.get_session_analytics(session_id)
+            if cached is not None and cached["fingerprint"] == fingerprint:
+                return cached["data"]
+
+        result = analyze_messages(messages, _session_documents(file_ids), self.config)
+        try:
+            service.db.save_session_analytics(session_id, fingerprint, result)
+        except Exception as e:
+            logger.warning("保存训练分析失败: %s", e, extra={"session_id": session_id})
+        return result
+
+
+# 全局实例
+_analytics_service = None
+
+
+def get_analytics_service():
+    """获取训练分析服务实例（单例）"""
+    global _analytics_service
+    if _analytics_service is None:
+        _analytics_service = AnalyticsService()
+    return _analytics_service
+
+
+def get_session_analytics(session_id, force=False):
+    """获取会话的训练分析"""
+    return get_analytics_service().get_session_analytics(session_id, force)
@@ -0,0 +1,153 @@
+# coding: utf-8
+"""
+讯飞接口鉴权
+星火助手 WebSocket 地址签名（HMAC-SHA256）与 ChatDoc 请求签名（MD5 + HMAC-SHA1），
+签名结果在有效时间窗内缓存：星火按 Date 头（秒级）缓存签名地址，ChatDoc 按秒级时间戳缓存签名
+"""
+import base64
+import hashlib
+import hmac
+import threading
+import time
+from urllib.parse import urlparse, urlencode
+from wsgiref.handlers import format_date_time
+
+
+class WsParam:
+    """星火助手 WebSocket 鉴权参数生成"""
+
+    def __init__(self, APPID, APIKey, APISecret, Assistant_url):
+        self.APPID = APPID
+        self.APIKey = APIKey
+        self.APISecret = APISecret
+        self.host = urlparse(Assistant_url).netloc
+        self.path = urlparse(Assistant_url).path
+        self.Assistant_url = Assistant_url
+        # 最近一次签名的 (date, url)
+        self._cached = None
+        self._lock = threading.Lock()
+
+    def _sign(self, date):
+        signature_origin = "host: " + self.host + "\n"
+        signature_origin += "date: " + date + "\n"
+        signature_origin += "GET " + self.path + " HTTP/1.1"
+
+        signature_sha = hmac.new(self.APISecret.encode('utf-8'), signature_origin.encode('utf-8'),
+                                 digestmod=hashlib.sha256).digest()
+
+        signature_sha_base64 = base64.b64encode(signature_sha).decode(encoding='utf-8')
+
+        authorization_origin = f'api_key="{self.APIKey}", algorithm="hmac-sha256", headers="host date request-line", signature="{signature_sha_base64}"'
+
+        authorization = base64.b64encode(authorization_origin.encode('utf-8')).decode(encoding='utf-8')
+
+        v = {
+            "authorization": authorization,
+            "date": date,
+            "host": self.host
+        }
+        return self.Assistant_url + '?' + urlencode(v)
+
+    def create_url(self):
+        """生成签名地址，同一 Date（同一秒）内复用上次的签名"""
+        date = format_date_time(time.time())
+        with self._lock:
+            cached = self._cached
+        if cached is not None and cached[0] == date:
+            return cached[1]
+
+        url = self._sign(date)
+        with self._lock:
+            self._cached = (date, url)
+        return url
+
+
+class ChatDocAuth:
+    """ChatDoc 认证类"""
+
+    def __init__(self, app_id, api_secret):
+        self.app_id = app_id
+        self.api_secret = api_secret
+        # 最近一次签名的 (timestamp, signature)
+        self._cached = None
+        self._lock = threading.Lock()
+
+    def get_signature(self, timestamp=None):
+        """
+        生成签名，同一时间戳（同一秒）内复用上次的签名
+
+        Args:
+            timestamp: 时间戳，不传则使用当前时间
+
+        Returns:
+            signature: 签名字符串
+        """
+        if timestamp is None:
+            timestamp = str(int(time.time()))
+
+        with self._lock:
+            cached = self._cached
+        if cached is not None and cached[0] == timestamp:
+            return cached[1]
+
+        # MD5(APPID + timestamp)
+        m2 = hashlib.md5()
+        data = bytes(self.app_id + timestamp, encoding="utf-8")
+        m2.update(data)
+        check_sum = m2.hexdigest()
+
+        # HMAC-SHA1
+        signature = hmac.new(
+            self.api_secret.encode('utf-8'),
+            check_sum.encode('utf-8'),
+            digestmod=hashlib.sha1
+        ).digest()
+
+        # Base64 编码
+        signature = base64.b64encode(signature).decode(encoding='utf-8')
+        with self._lock:
+            self._cached = (timestamp, signature)
+        return signature
+
+    def get_headers(self, timestamp=None, content_type="application/json"):
+        """
+        获取请求头
+
+        Args:
+            timestamp: 时间戳
+            content_type: Content-Type
+
+        Returns:
+            请求头字典
+        """
+        if timestamp is None:
+            timestamp = str(int(time.time()))
+
+        signature = self.get_signature(timestamp)
+
+        headers = {
+            "appId": self.app_id,
+            "timestamp": timestamp,
+            "signature": signature
+        }
+
+        if content_type:
+            headers["Content-Type"] = content_type
+
+        return headers
+
+    def get_ws_url(self, ws_url, timestamp=None):
+        """
+        获取带签名参数的 WebSocket 地址
+
+        Args:
+            ws_url: WebSocket 基础地址
+            timestamp: 时间戳
+
+        Returns:
+            签名地址
+        """
+        if timestamp is None:
+            timestamp = str(int(time.time()))
+        signature = self.get_signature(timestamp)
+        return f"{ws_url}?appId={self.app_id}&timestamp={timestamp}&signature={signature}"
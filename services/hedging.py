@@ -0,0 +1,234 @@
+# coding: utf-8
+"""
+对冲请求
+首个回复迟迟未到达时并行发起第二个相同请求，采用先开始流式返回的一方并取消另一方，
+对冲延迟取历史首包延迟的分位数，额外请求量受比例上限约束
+"""
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from config import HEDGE_CONFIG
+from services.ws_stream import CancelToken
+from utils.tracing import submit_with_context
+from utils.metrics import registry
+
+
+class LatencyTracker:
+    """记录最近若干次请求的首包延迟"""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def count(self):
+        with self._lock:
+            return len(self._samples)
+
+    def percentile(self, p):
+        """
+        计算分位数
+
+        Args:
+            p: 分位（0-100）
+
+        Returns:
+            分位数秒数，无样本返回None
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))
+        return samples[index]
+
+
+class HedgeBudget:
+    """
+    对冲预算
+
+    每个普通请求增加 max_extra_ratio 份额度，每次对冲消耗 1 份，
+    额度有上限，保证对冲带来的额外上游请求不超过设定比例。
+    """
+
+    def __init__(self, max_extra_ratio, max_credit=2.0):
+        self.max_extra_ratio = max_extra_ratio
+        self.max_credit = max_credit
+        self.credit = 0.0
+        self._lock = threading.Lock()
+
+    def on_request(self):
+        with self._lock:
+            self.credit = min(self.max_credit, self.credit + self.max_extra_ratio)
+
+    def try_spend(self):
+        with self._lock:
+            if self.credit >= 1:
+                self.credit -= 1
+                return True
+            return False
+
+
+class HedgedCall:
+    """一次对冲调用的状态：记录哪一方先收到内容，并取消另一方"""
+
+    def __init__(self, on_token=None):
+        self.on_token = on_token
+        self.winner = None
+        self.first_token = threading.Event()
+        # 任一方收到内容或结束时唤醒等待方
+        self.progress = threading.Event()
+        self.tokens = {}
+        self._lock = threading.Lock()
+
+    def make_on_token(self, name):
+        def on_token(content):
+            with self._lock:
+                if self.winner is None:
+                    self.winner = name
+                    self.first_token.set()
+                    self.progress.set()
+                    for other, token in self.tokens.items():
+                        if other != name:
+                            token.cancel()
+                is_winner = self.winner == name
+            if is_winner and self.on_token is not None:
+                self.on_token(content)
+        return on_token
+
+
+class Hedger:
+    """单个端点的对冲调度"""
+
+    def __init__(self, endpoint, config=None):
+        self.endpoint = endpoint
+        self.config = config or HEDGE_CONFIG
+        self.tracker = LatencyTracker()
+        self.budget = HedgeBudget(self.config["max_extra_ratio"])
+        self.hedges_sent = 0
+        self.hedges_won = 0
+
+    def hedge_delay(self):
+        """当前的对冲延迟（秒）"""
+        if self.tracker.count() < self.config["min_samples"]:
+            return self.config["default_delay"]
+        return max(self.config["min_delay"], self.tracker.percentile(self.config["percentile"]))
+
+    def record(self, result):
+        """记录一次调用的首包延迟"""
+        if result.get("ttft") is not None:
+            self.tracker.record(result["ttft"])
+
+    def call(self, start_call, cancel_token=None, on_token=None):
+        """
+        执行一次（可能对冲的）流式调用
+
+        Args:
+            start_call: 发起调用的函数 start_call(cancel_token, on_token) -> stream_ws 结果
+            cancel_token: 外部取消令牌（可选）
+            on_token: 内容回调（可选），只转发最终采用的一方的内容
+
+        Returns:
+            dict: 采用的一方的调用结果，附加 hedged（是否发起了对冲）与 hedge_won（是否由对冲请求胜出）
+        """
+        if not self.config["enabled"]:
+            result = start_call(cancel_token, on_token)
+            self.record(result)
+            return result
+
+        self.budget.on_request()
+        call = HedgedCall(on_token)
+        futures = {}
+
+        def launch(name):
+            token = CancelToken()
+            if cancel_token is not None:
+                cancel_token.add_callback(token.cancel)
+            call.tokens[name] = token
+            futures[name] = submit_with_context(_executor, start_call, token, call.make_on_token(name))
+            futures[name].add_done_callback(lambda _: call.progress.set())
+
+        try:
+            launch("primary")
+            primary = futures["primary"]
+
+            hedged = False
+            # 主请求收到内容或已结束（如直接失败）时不再等待对冲延迟
+            call.progress.wait(self.hedge_delay())
+            if not call.first_token.is_set() and not primary.done() and self.budget.try_spend():
+                if cancel_token is None or not cancel_token.cancelled:
+                    hedged = True
+                    self.hedges_sent += 1
+                    launch("hedge")
+
+            if hedged:
+                # 等待任一方先收到内容，或两者都结束
+                while True:
+                    call.progress.clear()
+                    if call.first_token.is_set() or all(f.done() for f in futures.values()):
+                        break
+                    call.progress.wait()
+
+            return self._finish(call, futures, hedged)
+        finally:
+            # 调用方的令牌可能跨多次调用复用，解除对本次调用令牌的引用
+            if cancel_token is not None:
+                for token in call.tokens.values():
+                    cancel_token.remove_callback(token.cancel)
+
+    def _finish(self, call, futures, hedged):
+        """取采用的一方的结果，并取消另一方"""
+        winner = call.winner or "primary"
+        result = futures[winner].result()
+        if hedged:
+            loser = "hedge" if winner == "primary" else "primary"
+            call.tokens[loser].cancel()
+            if winner == "primary" and not result["text"] and futures["hedge"].done():
+                # 主请求失败且未收到内容时，采用对冲请求的结果
+                result = futures["hedge"].result()
+                winner = "hedge"
+            if winner == "hedge":
+                self.hedges_won += 1
+
+        self.record(result)
+        result["hedged"] = hedged
+        result["hedge_won"] = winner == "hedge"
+        return result
+
+
+# 全局实例
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="preplay-hedge")
+_hedgers = {}
+_hedgers_lock = threading.Lock()
+
+
+def get_hedger(endpoint):
+    """获取端点的对冲调度（每个端点一个）"""
+    with _hedgers_lock:
+        hedger = _hedgers.get(endpoint)
+        if hedger is None:
+            hedger = Hedger(endpoint)
+            _hedgers[endpoint] = hedger
+        return hedger
+
+
+def _collect_hedges():
+    with _hedgers_lock:
+        hedgers = list(_hedgers.items())
+    for endpoint, hedger in hedgers:
+        yield (endpoint, "sent"), hedger.hedges_sent
+        yield (endpoint, "won"), hedger.hedges_won
+
+
+registry.gauge("preplay_hedges", "对冲请求累计数（sent=发起, won=胜出）", ("service", "result"), _collect_hedges)
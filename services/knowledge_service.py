@@ -3,15 +3,11 @@
 讯飞星火知识库服务
 封装文档上传、删除、列表查询、检索功能
 """
-import hashlib
-import hmac
-import base64
 import time
 import json
 import sys
 import os
-import _thread as thread
-import ssl
+import tempfile
 from pathlib import Path
 
 # 添加项目根目录到 Python 路径
@@ -20,72 +16,13 @@ if str(project_root) not in sys.path:
     sys.path.insert(0, str(project_root))
 
 from config import CHATDOC_CONFIG
-import requests
-import websocket
+from services.auth import ChatDocAuth
+from services.ws_stream import StreamError, stream_ws
+from services.resilience import call_with_resilience, raise_for_stream_result
+from services.rate_limiter import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, RateLimitExceeded, rate_limited
+from utils.logger import get_logger
 
-
-class ChatDocAuth:
-    """ChatDoc 认证类"""
-
-    def __init__(self, app_id, api_secret):
-        self.app_id = app_id
-        self.api_secret = api_secret
-
-    def get_signature(self, timestamp=None):
-        """
-        生成签名
-
-        Args:
-            timestamp: 时间戳，不传则使用当前时间
-
-        Returns:
-            signature: 签名字符串
-        """
-        if timestamp is None:
-            timestamp = str(int(time.time()))
-
-        # MD5(APPID + timestamp)
-        m2 = hashlib.md5()
-        data = bytes(self.app_id + timestamp, encoding="utf-8")
-        m2.update(data)
-        check_sum = m2.hexdigest()
-
-        # HMAC-SHA1
-        signature = hmac.new(
-            self.api_secret.encode('utf-8'),
-            check_sum.encode('utf-8'),
-            digestmod=hashlib.sha1
-        ).digest()
-
-        # Base64 编码
-        return base64.b64encode(signature).decode(encoding='utf-8')
-
-    def get_headers(self, timestamp=None, content_type="application/json"):
-        """
-        获取请求头
-
-        Args:
-            timestamp: 时间戳
-            content_type: Content-Type
-
-        Returns:
-            请求头字典
-        """
-        if timestamp is None:
-            timestamp = str(int(time.time()))
-
-        signature = self.get_signature(timestamp)
-
-        headers = {
-            "appId": self.app_id,
-            "timestamp": timestamp,
-            "signature": signature
-        }
-
-        if content_type:
-            headers["Content-Type"] = content_type
-
-        return headers
+logger = get_logger(__name__)
 
 
 class KnowledgeService:
@@ -103,20 +40,25 @@ class KnowledgeService:
     # 1. 上传文档
     # ============================================
 
-    def upload_document(self, file_path, file_name=None, file_type="wiki"):
+    def upload_document(self, file_path, file_name=None, file_type="wiki", save_local_copy=True,
+                        priority=PRIORITY_BACKGROUND):
         """
         上传文档到知识库
 
+        与检索共用知识库的限流配额，默认按后台优先级排队，分片上传时不挤占训练中的检索。
+
         Args:
             file_path: 本地文件路径
             file_name: 文件名（可选，默认使用原文件名）
             file_type: 文件类型，默认为 "wiki"
+            save_local_copy: 是否在本地数据库保存文档文本（分片上传时由调用方统一保存）
+            priority: 限流排队优先级
 
         Returns:
             dict: 包含 fileId, sid 等信息
         """
-        timestamp = str(int(time.time()))
-        headers = self.auth.get_headers(timestamp, None)  # multipart 不设置 Content-Type
+        # requests 只在实际调用接口时导入，避免拖慢页面首次加载
+        import requests
 
         url = f"{self.base_url}/openapi/v1/file/upload"
 
@@ -124,22 +66,29 @@ class KnowledgeService:
             file_name = os.path.basename(file_path)
 
         # 构建 multipart/form-data
-        files = {'file': open(file_path, 'rb')}
         data = {
             "fileName": file_name,
             "fileType": file_type,
         }
 
         try:
-            response = requests.post(url, files=files, data=data, headers=headers)
+            with rate_limited("chatdoc", priority):
+                # 签名时间戳在获得配额后生成，避免排队过久导致签名过期
+                timestamp = str(int(time.time()))
+                headers = self.auth.get_headers(timestamp, None)  # multipart 不设置 Content-Type
+                with open(file_path, 'rb') as f:
+                    response = requests.post(url, files={'file': f}, data=data, headers=headers)
             response.raise_for_status()
 
             result = response.json()
 
             if result.get("code") == 0:
+                file_id = result.get("data", {}).get("fileId")
+                if save_local_copy:
+                    self._save_local_copy(file_id, file_name, file_path=file_path)
                 return {
                     "success": True,
-                    "file_id": result.get("data", {}).get("fileId"),
+                    "file_id": file_id,
                     "sid": result.get("sid"),
                     "file_name": file_name,
                     "raw": result
@@ -151,28 +100,113 @@ class KnowledgeService:
                     "code": result.get("code"),
                     "raw": result
                 }
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, RateLimitExceeded) as e:
             return {
                 "success": False,
                 "error": str(e)
             }
 
+    def _save_local_copy(self, file_id, file_name, file_path=None, text=None, file_size=None):
+        """
+        在本地数据库保存文档文本，供训练分析统计章节覆盖
+
+        给出 file_path 时经解析缓存提取文本；分片上传时由调用方给出整个文档的文本。
+        失败时只记录日志，不影响上传结果。
+        """
+        from database import add_knowledge_file
+        from utils.file_handler import extract_text_from_path
+
+        try:
+            if text is None:
+                text = extract_text_from_path(file_path)
+                file_size = os.path.getsize(file_path)
+            add_knowledge_file(
+                file_id,
+                file_name,
+                os.path.splitext(file_name)[1].lstrip(".").lower(),
+                file_size,
+                text
+            )
+        except Exception as e:
+            logger.warning("保存文档本地副本失败: %s", e, extra={"file_id": file_id})
+
+    def upload_large_document(self, file, file_name=None, chunk_bytes=None, file_type="wiki"):
+        """
+        分片上传大文档到知识库
+
+        流式提取文本并按大小切分，每个分片写入临时 txt 文件后单独上传，
+        上传完成立即删除临时文件。全部分片上传成功后，整个文档的文本只在本地保存一份
+        （记在第一个分片的文件ID下），因此需要在内存中保留已提取的文本。
+        任一分片失败时回滚删除已上传的分片。
+
+        Args:
+            file: 文件对象（需有 name 属性并支持 seek/read）
+            file_name: 文件名（可选，默认使用 file.name）
+            chunk_bytes: 每个分片的最大字节数（可选）
+            file_type: 文件类型，默认为 "wiki"
+
+        Returns:
+            dict: 包含 file_ids（分片文件ID列表）、parts 等信息
+        """
+        from utils.file_handler import iter_text_chunks
+
+        if file_name is None:
+            file_name = file.name
+        stem = os.path.splitext(file_name)[0]
+
+        file_ids = []
+        chunks = []
+        try:
+            for index, chunk in enumerate(iter_text_chunks(file, chunk_bytes), 1):
+                chunks.append(chunk)
+                with tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".txt", delete=False) as tmp_file:
+                    tmp_file.write(chunk)
+                    tmp_path = tmp_file.name
+
+                try:
+                    result = self.upload_document(
+                        tmp_path, f"{stem}_part{index:03d}.txt", file_type, save_local_copy=False
+                    )
+                finally:
+                    os.remove(tmp_path)
+
+                if not result["success"]:
+                    raise RuntimeError(f"第 {index} 个分片上传失败：{result.get('error', '上传失败')}")
+                file_ids.append(result["file_id"])
+        except Exception as e:
+            if file_ids:
+                self.delete_document(file_ids)
+            return {
+                "success": False,
+                "error": str(e)
+            }
+
+        if file_ids:
+            self._save_local_copy(file_ids[0], file_name, text="".join(chunks), file_size=getattr(file, "size", None))
+
+        return {
+            "success": True,
+            "file_ids": file_ids,
+            "parts": len(file_ids),
+            "file_name": file_name
+        }
+
     # ============================================
     # 2. 删除文档
     # ============================================
 
-    def delete_document(self, file_ids):
+    def delete_document(self, file_ids, priority=PRIORITY_BACKGROUND):
         """
         删除文档
 
         Args:
             file_ids: 文件ID或文件ID列表（支持单个字符串或列表）
+            priority: 限流排队优先级
 
         Returns:
             dict: 删除结果
         """
-        timestamp = str(int(time.time()))
-        headers = self.auth.get_headers(timestamp, None)  # form-data 不设置 Content-Type
+        import requests
 
         url = f"{self.base_url}/openapi/v1/file/del"
 
@@ -185,12 +219,19 @@ class KnowledgeService:
         data = {"fileIds": file_ids_str}
 
         try:
-            response = requests.post(url, data=data, headers=headers)
+            with rate_limited("chatdoc", priority):
+                timestamp = str(int(time.time()))
+                headers = self.auth.get_headers(timestamp, None)  # form-data 不设置 Content-Type
+                response = requests.post(url, data=data, headers=headers)
             response.raise_for_status()
 
             result = response.json()
 
             if result.get("code") == 0:
+                from database import delete_knowledge_file
+
+                for file_id in file_ids_str.split(","):
+                    delete_knowledge_file(file_id)
                 return {
                     "success": True,
                     "sid": result.get("sid"),
@@ -203,7 +244,7 @@ class KnowledgeService:
                     "code": result.get("code"),
                     "raw": result
                 }
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, RateLimitExceeded) as e:
             return {
                 "success": False,
                 "error": str(e)
@@ -213,21 +254,22 @@ class KnowledgeService:
     # 3. 获取文档列表
     # ============================================
 
-    def get_document_list(self, file_name=None, ext_name=None, current_page=1, page_size=10):
+    def get_document_list(self, file_name=None, ext_name=None, current_page=1, page_size=10,
+                          priority=PRIORITY_INTERACTIVE):
         """
-        获取文档列表
+        获取文档列表（用于页面展示，默认按交互优先级排队）
 
         Args:
             file_name: 文件名称模糊查询（可选）
             ext_name: 文件后缀（可选）
             current_page: 页码，默认1
             page_size: 每页数量，默认10
+            priority: 限流排队优先级
 
         Returns:
             dict: 包含文档列表和总数
         """
-        timestamp = str(int(time.time()))
-        headers = self.auth.get_headers(timestamp, "application/json")
+        import requests
 
         url = f"{self.base_url}/openapi/v1/file/list"
 
@@ -242,7 +284,10 @@ class KnowledgeService:
             data["extName"] = ext_name
 
         try:
-            response = requests.post(url, json=data, headers=headers)
+            with rate_limited("chatdoc", priority):
+                timestamp = str(int(time.time()))
+                headers = self.auth.get_headers(timestamp, "application/json")
+                response = requests.post(url, json=data, headers=headers)
             response.raise_for_status()
 
             result = response.json()
@@ -263,7 +308,7 @@ class KnowledgeService:
                     "code": result.get("code"),
                     "raw": result
                 }
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, RateLimitExceeded) as e:
             return {
                 "success": False,
                 "error": str(e)
@@ -273,9 +318,22 @@ class KnowledgeService:
     # 4. 检索文档（问答）
     # ============================================
 
-    def search_document(self, file_ids, question, messages=None, wiki_filter_score=0.83, temperature=0.5):
+    def _parse_search_message(self, message):
+        """解析一帧检索回复，返回 (content, status, sid)"""
+        data = json.loads(message)
+        code = data.get('code')
+        if code != 0:
+            logger.warning("知识库检索返回错误帧", extra={"code": code, "sid": data.get("sid", "")})
+            raise StreamError(f"检索错误: {code}", code)
+
+        content = data.get("content", "")
+        status = data.get("status", 0)
+        return content, status, data.get("sid", "")
+
+    def stream_search(self, file_ids, question, messages=None, wiki_filter_score=0.83, temperature=0.5,
+                      cancel_token=None, timeouts=None, priority=PRIORITY_INTERACTIVE):
         """
-        检索文档并进行问答
+        检索文档并进行问答，返回完整的调用结果
 
         Args:
             file_ids: 文件ID或文件ID列表
@@ -283,16 +341,16 @@ class KnowledgeService:
             messages: 对话历史（可选）
             wiki_filter_score: 检索过滤分数，默认0.83
             temperature: 温度参数，默认0.5
+            cancel_token: 取消令牌（可选）
+            timeouts: 截止时间配置（可选），见 WS_TIMEOUT_CONFIG
+            priority: 限流排队优先级（可选）
 
         Returns:
-            str: AI 回答内容
-        """
-        timestamp = str(int(time.time()))
-        signature = self.auth.get_signature(timestamp)
-
-        # 构建 WebSocket URL
-        ws_url = f"{self.ws_url}?appId={self.app_id}&timestamp={timestamp}&signature={signature}"
+            dict: text, sid, status, error, code, ttft, elapsed（见 stream_ws）
 
+        Raises:
+            RateLimitExceeded: 排队超时仍未获得配额
+        """
         # 统一处理 file_ids 格式
         if isinstance(file_ids, list):
             file_ids_list = file_ids
@@ -321,51 +379,60 @@ class KnowledgeService:
             for msg in messages:
                 body["messages"].insert(0, msg)
 
-        # WebSocket 调用
-        answer = []
-
-        def on_message(ws, message):
-            data = json.loads(message)
-            code = data.get('code')
-            if code != 0:
-                print(f'请求错误: {code}, {data}')
-                ws.close()
-                return
-
-            content = data.get("content", "")
-            status = data.get("status", 0)
-
-            if content:
-                answer.append(content)
-                print(content, end='')
-
-            if status == 2:  # 结束
-                ws.close()
-
-        def on_error(ws, error):
-            print(f"WebSocket 错误: {error}")
+        with rate_limited("chatdoc", priority, cancel_token):
+            ws_url = self.auth.get_ws_url(self.ws_url)
+
+            result = stream_ws(
+                ws_url,
+                body,
+                self._parse_search_message,
+                timeouts=timeouts,
+                cancel_token=cancel_token,
+                span_name="chatdoc.stream"
+            )
+        if result["status"] != "completed":
+            logger.warning(
+                "知识库检索未完成: %s", result["error"],
+                extra={"status": result["status"], "elapsed": round(result["elapsed"], 3), "sid": result["sid"]}
+            )
+        return result
+
+    def search_document(self, file_ids, question, messages=None, wiki_filter_score=0.83, temperature=0.5,
+                        cancel_token=None, timeouts=None, priority=PRIORITY_INTERACTIVE):
+        """
+        检索文档并进行问答
 
-        def on_close(ws, *args):
-            pass
+        未收到内容的连接失败/超时按退避策略重试；
+        超时或取消时返回已收到的部分回答。
 
-        def on_open(ws):
-            thread.start_new_thread(_send_request, (ws, body))
+        Args:
+            file_ids: 文件ID或文件ID列表
+            question: 用户问题
+            messages: 对话历史（可选）
+            wiki_filter_score: 检索过滤分数，默认0.83
+            temperature: 温度参数，默认0.5
+            cancel_token: 取消令牌（可选）
+            timeouts: 截止时间配置（可选）
+            priority: 限流排队优先级（可选）
 
-        def _send_request(ws, data):
-            ws.send(json.dumps(data))
+        Returns:
+            str: AI 回答内容
 
-        websocket.enableTrace(False)
-        ws = websocket.WebSocketApp(
-            ws_url,
-            on_message=on_message,
-            on_error=on_error,
-            on_close=on_close,
-            on_open=on_open
+        Raises:
+            UpstreamError: 重试耗尽仍未收到任何回答，或知识库服务处于熔断状态
+        """
+        result = call_with_resilience(
+            "chatdoc",
+            lambda: raise_for_stream_result(
+                "chatdoc",
+                self.stream_search(
+                    file_ids, question, messages, wiki_filter_score, temperature, cancel_token, timeouts,
+                    priority=priority
+                )
+            ),
+            cancel_token=cancel_token
         )
-
-        ws.run_forever(sslopt={"cert_reqs": ssl.CERT_NONE})
-
-        return "".join(answer)
+        return result["text"]
 
 
 # 全局实例
@@ -387,6 +454,12 @@ def upload_document(file_path, file_name=None, file_type="wiki"):
     return service.upload_document(file_path, file_name, file_type)
 
 
+def upload_large_document(file, file_name=None, chunk_bytes=None, file_type="wiki"):
+    """分片上传大文档"""
+    service = get_knowledge_service()
+    return service.upload_large_document(file, file_name, chunk_bytes, file_type)
+
+
 def delete_document(file_ids):
     """删除文档"""
     service = get_knowledge_service()
@@ -399,7 +472,10 @@ def get_document_list(file_name=None, ext_name=None, current_page=1, page_size=1
     return service.get_document_list(file_name, ext_name, current_page, page_size)
 
 
-def search_document(file_ids, question, messages=None, wiki_filter_score=0.83, temperature=0.5):
+def search_document(file_ids, question, messages=None, wiki_filter_score=0.83, temperature=0.5, cancel_token=None,
+                    priority=PRIORITY_INTERACTIVE):
     """检索文档"""
     service = get_knowledge_service()
-    return service.search_document(file_ids, question, messages, wiki_filter_score, temperature)
+    return service.search_document(
+        file_ids, question, messages, wiki_filter_score, temperature, cancel_token, priority=priority
+    )
@@ -0,0 +1,156 @@
+# coding: utf-8
+"""
+开场问题预生成服务
+上传文档或开始训练时，在后台为知识库文件集合预先生成一批红方开场问题，
+新会话打开即可直接展示，无需等待检索与红方的完整往返
+"""
+import hashlib
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from config import OPENING_CONFIG
+from database import get_db
+from services.red_assistant import chat_with_red
+from services.knowledge_service import search_document
+from services.rate_limiter import PRIORITY_BACKGROUND
+from services.turn_orchestrator import build_prompt_with_knowledge
+from utils.metrics import record_cache
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+# 用于检索材料要点的问题
+SUMMARY_QUESTION = "请概括这份材料的核心观点、关键数据和主要结论"
+
+# 让红方生成开场问题的指令
+OPENING_INSTRUCTION = "训练即将开始。请基于以上材料，直接向汇报人提出一个最有挑战性的开场问题。"
+
+
+def make_knowledge_key(file_ids):
+    """
+    生成知识库文件集合的键（与文件顺序无关）
+
+    Args:
+        file_ids: 知识库文件ID列表
+
+    Returns:
+        键字符串
+    """
+    raw = ",".join(sorted(file_ids))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class OpeningQuestionService:
+    """开场问题池服务"""
+
+    def __init__(self, config=None):
+        self.config = config or OPENING_CONFIG
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="preplay-opening")
+        # 正在补充的知识库集合，避免重复提交
+        self._filling = set()
+        self._lock = threading.Lock()
+
+    def ensure_pool(self, file_ids, pool_size=None):
+        """
+        确保知识库集合的问题池已满，不足时在后台补充
+
+        Args:
+            file_ids: 知识库文件ID列表
+            pool_size: 目标数量，默认取配置
+
+        Returns:
+            是否提交了后台补充任务
+        """
+        if not self.config["enabled"] or not file_ids:
+            return False
+
+        key = make_knowledge_key(file_ids)
+        with self._lock:
+            if key in self._filling:
+                return False
+            self._filling.add(key)
+
+        self.executor.submit(self._fill_pool, key, list(file_ids), pool_size or self.config["pool_size"])
+        return True
+
+    def _fill_pool(self, key, file_ids, pool_size):
+        """后台补充问题池"""
+        try:
+            db = get_db()
+            missing = pool_size - db.count_opening_questions(key)
+            if missing <= 0:
+                return
+
+            kb_answer = search_document(
+                file_ids,
+                SUMMARY_QUESTION,
+                wiki_filter_score=0.83,
+                temperature=0.5,
+                priority=PRIORITY_BACKGROUND
+            )
+            prompt = build_prompt_with_knowledge(kb_answer, OPENING_INSTRUCTION)
+
+            questions = []
+            for _ in range(missing):
+                answer, _sid = chat_with_red(prompt, [], priority=PRIORITY_BACKGROUND, use_cache=False)
+                if answer:
+                    questions.append(answer)
+
+            if questions:
+                db.add_opening_questions(key, questions)
+        except Exception as e:
+            logger.exception("预生成开场问题失败: %s", e)
+        finally:
+            with self._lock:
+                self._filling.discard(key)
+
+    def take_question(self, file_ids):
+        """
+        取出一个预生成的开场问题，并在后台补充问题池
+
+        Args:
+            file_ids: 知识库文件ID列表
+
+        Returns:
+            问题内容，池为空返回None
+        """
+        if not self.config["enabled"] or not file_ids:
+            return None
+
+        question = get_db().pop_opening_question(make_knowledge_key(file_ids))
+        record_cache("opening", question is not None)
+        self.ensure_pool(file_ids)
+        return question
+
+
+# 全局实例
+_opening_service = None
+
+
+def get_opening_service():
+    """获取开场问题服务实例（单例）"""
+    global _opening_service
+    if _opening_service is None:
+        _opening_service = OpeningQuestionService()
+    return _opening_service
+
+
+# 便捷函数
+def prepare_opening_questions(file_ids):
+    """在后台为知识库集合预生成开场问题"""
+    service = get_opening_service()
+    return service.ensure_pool(file_ids)
+
+
+def take_opening_question(file_ids):
+    """取出一个预生成的开场问题"""
+    service = get_opening_service()
+    return service.take_question(file_ids)
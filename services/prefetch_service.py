@@ -0,0 +1,186 @@
+# coding: utf-8
+"""
+下一轮检索预取服务
+一轮对话结束后、用户组织回答的间隙，以本轮 AI 回复为检索问题在后台预先检索知识库，
+结果按（会话, 对话对象, 检索温度）缓存。下一轮发给同一对象、知识库集合与温度一致、未过期，
+且用户输入与预取依据足够相关时直接复用，省去一次检索往返；否则照常按用户输入检索
+"""
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from config import PREFETCH_CONFIG
+from services.knowledge_service import search_document
+from services.rate_limiter import PRIORITY_BACKGROUND
+from services.resilience import is_circuit_open
+from services.ws_stream import CancelToken
+from utils.metrics import record_cache
+
+
+# 计算相关度时忽略的空白与标点
+_IGNORED_CHARS = re.compile(r"[\s\W_]+")
+
+
+def _bigrams(text):
+    text = _IGNORED_CHARS.sub("", text or "").lower()
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def basis_overlap(basis, user_input):
+    """
+    用户输入与预取依据的相关度
+
+    Args:
+        basis: 预取依据
+        user_input: 用户输入
+
+    Returns:
+        用户输入的字符二元组中出现在预取依据里的比例（0-1）
+    """
+    wanted = _bigrams(user_input)
+    if not wanted:
+        return 0.0
+    return len(wanted & _bigrams(basis)) / len(wanted)
+
+
+class PrefetchEntry:
+    """一个会话的预取结果"""
+
+    def __init__(self, knowledge_key, basis, future, cancel_token):
+        self.knowledge_key = knowledge_key
+        self.basis = basis
+        self.future = future
+        self.cancel_token = cancel_token
+        self.created_at = time.monotonic()
+
+
+class PrefetchService:
+    """按会话缓存的检索预取"""
+
+    def __init__(self, config=None):
+        self.config = config or PREFETCH_CONFIG
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="preplay-prefetch")
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def schedule(self, session_id, target, basis, file_ids, temperature=0.8):
+        """
+        在后台预取下一轮发给 target 的检索结果，替换之前相同对象与温度的预取
+
+        Args:
+            session_id: 会话ID
+            target: 对话对象（"red" 或 "blue"）
+            basis: 预取依据（通常为本轮 AI 回复，即用户下一轮要回应的内容）
+            file_ids: 知识库文件ID列表
+            temperature: 检索温度
+
+        Returns:
+            是否提交了预取任务
+        """
+        if not self.config["enabled"] or not file_ids or not basis:
+            return False
+        if is_circuit_open("chatdoc"):
+            return False
+
+        token = CancelToken()
+        future = self.executor.submit(
+            search_document,
+            file_ids,
+            basis,
+            wiki_filter_score=0.83,
+            temperature=temperature,
+            cancel_token=token,
+            priority=PRIORITY_BACKGROUND
+        )
+        entry = PrefetchEntry(tuple(sorted(file_ids)), basis, future, token)
+        key = (session_id, target, temperature)
+        with self._lock:
+            previous = self._entries.get(key)
+            self._entries[key] = entry
+        if previous is not None:
+            previous.cancel_token.cancel()
+        return True
+
+    def _miss(self):
+        self.misses += 1
+        record_cache("prefetch", False)
+        return None
+
+    def take(self, session_id, target, file_ids, temperature, user_input):
+        """
+        取出本轮可用的预取结果（取出后即从缓存移除）
+
+        对话对象、检索温度、知识库集合需与预取时一致，且未过期、用户输入与预取依据的相关度
+        不低于 min_overlap；不满足时记为未命中，由调用方按用户输入照常检索。
+
+        Args:
+            session_id: 会话ID
+            target: 本轮对话对象
+            file_ids: 本轮使用的知识库文件ID列表
+            temperature: 本轮检索温度
+            user_input: 用户输入
+
+        Returns:
+            PrefetchEntry（其检索任务可能仍在进行），无可用预取返回None
+        """
+        with self._lock:
+            entry = self._entries.pop((session_id, target, temperature), None)
+            # 只有另一方（或另一温度）的预取时同样记为未命中，保留给对应的对象使用
+            has_other = entry is None and any(key[0] == session_id for key in self._entries)
+        if entry is None:
+            return self._miss() if has_other else None
+        if not file_ids:
+            entry.cancel_token.cancel()
+            return None
+
+        expired = time.monotonic() - entry.created_at > self.config["ttl"]
+        relevant = basis_overlap(entry.basis, user_input) >= self.config["min_overlap"]
+        if expired or not relevant or entry.knowledge_key != tuple(sorted(file_ids)):
+            entry.cancel_token.cancel()
+            return self._miss()
+        if entry.future.done() and entry.future.exception() is not None:
+            return self._miss()
+
+        self.hits += 1
+        record_cache("prefetch", True)
+        return entry
+
+    def discard(self, session_id):
+        """丢弃会话的全部预取（如清空对话或离开训练页）"""
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == session_id]
+            entries = [self._entries.pop(key) for key in keys]
+        for entry in entries:
+            entry.cancel_token.cancel()
+        return bool(entries)
+
+
+# 全局实例
+_prefetch_service = None
+
+
+def get_prefetch_service():
+    """获取预取服务实例（单例）"""
+    global _prefetch_service
+    if _prefetch_service is None:
+        _prefetch_service = PrefetchService()
+    return _prefetch_service
+
+
+# 便捷函数
+def discard_prefetch(session_id):
+    """丢弃会话的预取结果"""
+    service = get_prefetch_service()
+    return service.discard(session_id)
@@ -0,0 +1,238 @@
+# coding: utf-8
+"""
+客户端限流与请求调度
+每个上游端点一个调度器：令牌桶限制 QPS，并发上限限制同时进行的请求数，
+等待中的请求按优先级排队（交互式对话优先于后台报告任务）
+"""
+import heapq
+import itertools
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from config import RATE_LIMIT_CONFIG, RATE_LIMIT_ENABLED, RATE_LIMIT_MAX_WAIT
+from services.resilience import ENDPOINT_NAMES, UpstreamError
+from utils.tracing import span
+from utils.metrics import registry
+
+
+# 优先级：数值越小越先执行
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+
+class RateLimitExceeded(UpstreamError):
+    """排队超时仍未获得配额"""
+
+
+class TokenBucket:
+    """令牌桶"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_take(self):
+        """
+        尝试取一个令牌
+
+        Returns:
+            0 表示成功取得；否则为还需等待的秒数
+        """
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class EndpointScheduler:
+    """单个端点的请求调度器"""
+
+    def __init__(self, endpoint, qps, burst, max_concurrency, max_wait=None):
+        self.endpoint = endpoint
+        self.bucket = TokenBucket(qps, burst)
+        self.max_concurrency = max_concurrency
+        self.max_wait = RATE_LIMIT_MAX_WAIT if max_wait is None else max_wait
+        self.active = 0
+        # 请求平均占用时长（指数滑动平均），用于估算排队时间
+        self.avg_hold = 1.0
+        self._queue = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def queue_depth(self):
+        """当前排队的请求数"""
+        with self._cond:
+            return len(self._queue)
+
+    def expected_wait(self, priority=PRIORITY_INTERACTIVE):
+        """
+        估算新请求按给定优先级入队后的等待时间
+
+        Args:
+            priority: 请求优先级
+
+        Returns:
+            预计等待秒数
+        """
+        with self._cond:
+            ahead = sum(1 for entry in self._queue if entry[0] <= priority)
+            self.bucket._refill()
+            # QPS 限制：前面的请求和自己都需要令牌
+            token_wait = max(0.0, (ahead + 1 - self.bucket.tokens) / self.bucket.rate)
+            # 并发限制：前面的请求需要等待空闲槽位
+            busy = self.active + ahead - self.max_concurrency + 1
+            slot_wait = max(0, busy) * self.avg_hold / self.max_concurrency
+            return max(token_wait, slot_wait)
+
+    def acquire(self, priority=PRIORITY_INTERACTIVE, cancel_token=None):
+        """
+        排队获取一个请求配额（令牌 + 并发槽位）
+
+        Args:
+            priority: 请求优先级
+            cancel_token: 取消令牌（可选）
+
+        Raises:
+            RateLimitExceeded: 超过最长排队时间
+            UpstreamError: 排队期间被取消
+        """
+        name = ENDPOINT_NAMES.get(self.endpoint, self.endpoint)
+        entry = [priority, next(self._seq)]
+        deadline = time.monotonic() + self.max_wait
+        wake = None
+        if cancel_token is not None:
+            def _notify():
+                with self._cond:
+                    self._cond.notify_all()
+            wake = _notify
+            cancel_token.add_callback(wake)
+
+        try:
+            with self._cond:
+                heapq.heappush(self._queue, entry)
+                try:
+                    while True:
+                        if cancel_token is not None and cancel_token.cancelled:
+                            raise UpstreamError(f"{name}请求已取消")
+
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise RateLimitExceeded(f"{name}请求排队超过 {self.max_wait:g} 秒", transient=False)
+
+                        if self._queue[0] is entry and self.active < self.max_concurrency:
+                            wait = self.bucket.try_take()
+                            if wait == 0:
+                                heapq.heappop(self._queue)
+                                self.active += 1
+                                self._cond.notify_all()
+                                return
+                            self._cond.wait(min(wait, remaining))
+                        else:
+                            self._cond.wait(remaining)
+                except BaseException:
+                    if entry in self._queue:
+                        self._queue.remove(entry)
+                        heapq.heapify(self._queue)
+                        self._cond.notify_all()
+                    raise
+        finally:
+            if wake is not None:
+                cancel_token.remove_callback(wake)
+
+    def release(self, hold_time):
+        """
+        归还并发槽位
+
+        Args:
+            hold_time: 本次请求占用槽位的时长（秒）
+        """
+        with self._cond:
+            self.active -= 1
+            self.avg_hold = 0.8 * self.avg_hold + 0.2 * hold_time
+            self._cond.notify_all()
+
+
+# 全局调度器
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(endpoint):
+    """获取端点的调度器（每个端点一个）"""
+    with _schedulers_lock:
+        scheduler = _schedulers.get(endpoint)
+        if scheduler is None:
+            limits = RATE_LIMIT_CONFIG[endpoint]
+            scheduler = EndpointScheduler(
+                endpoint,
+                limits["qps"],
+                limits["burst"],
+                limits["max_concurrency"]
+            )
+            _schedulers[endpoint] = scheduler
+        return scheduler
+
+
+def _collect_queue_depths():
+    with _schedulers_lock:
+        schedulers = list(_schedulers.items())
+    for endpoint, scheduler in schedulers:
+        yield (endpoint,), scheduler.queue_depth()
+
+
+def _collect_in_flight():
+    with _schedulers_lock:
+        schedulers = list(_schedulers.items())
+    for endpoint, scheduler in schedulers:
+        yield (endpoint,), scheduler.active
+
+
+registry.gauge("preplay_upstream_queue_depth", "排队等待配额的上游请求数", ("service",), _collect_queue_depths)
+registry.gauge("preplay_upstream_in_flight", "正在进行的上游请求数", ("service",), _collect_in_flight)
+
+
+@contextmanager
+def rate_limited(endpoint, priority=PRIORITY_INTERACTIVE, cancel_token=None):
+    """
+    在限流配额内执行一次上游请求
+
+    Args:
+        endpoint: 端点名称（red/blue/chatdoc/moonshot）
+        priority: 请求优先级
+        cancel_token: 取消令牌（可选）
+    """
+    if not RATE_LIMIT_ENABLED:
+        yield
+        return
+
+    scheduler = get_scheduler(endpoint)
+    with span(f"{endpoint}.queue", priority=priority):
+        scheduler.acquire(priority, cancel_token)
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        scheduler.release(time.monotonic() - start)
+
+
+def get_expected_wait(endpoint, priority=PRIORITY_INTERACTIVE):
+    """获取端点当前的预计排队时间（秒），供界面提示"""
+    if not RATE_LIMIT_ENABLED:
+        return 0.0
+    return get_scheduler(endpoint).expected_wait(priority)
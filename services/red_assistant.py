@@ -2,17 +2,7 @@
 """
 红方魔鬼导师服务
 """
-import _thread as thread
-import base64
-import hashlib
-import hmac
 import json
-import ssl
-from datetime import datetime
-from time import mktime
-from urllib.parse import urlparse, urlencode
-from wsgiref.handlers import format_date_time
-import websocket
 import sys
 from pathlib import Path
 
@@ -22,42 +12,15 @@ if str(project_root) not in sys.path:
     sys.path.insert(0, str(project_root))
 
 from config import RED_CONFIG
+from services.auth import WsParam
+from services.ws_stream import StreamError, stream_ws
+from services.resilience import call_with_resilience, raise_for_stream_result
+from services.rate_limiter import PRIORITY_INTERACTIVE, rate_limited
+from services.hedging import get_hedger
+from services.response_cache import get_response_cache, make_cache_key
+from utils.logger import get_logger
 
-
-class WsParam:
-    """WebSocket 鉴权参数生成"""
-    def __init__(self, APPID, APIKey, APISecret, Assistant_url):
-        self.APPID = APPID
-        self.APIKey = APIKey
-        self.APISecret = APISecret
-        self.host = urlparse(Assistant_url).netloc
-        self.path = urlparse(Assistant_url).path
-        self.Assistant_url = Assistant_url
-
-    def create_url(self):
-        now = datetime.now()
-        date = format_date_time(mktime(now.timetuple()))
-
-        signature_origin = "host: " + self.host + "\n"
-        signature_origin += "date: " + date + "\n"
-        signature_origin += "GET " + self.path + " HTTP/1.1"
-
-        signature_sha = hmac.new(self.APISecret.encode('utf-8'), signature_origin.encode('utf-8'),
-                                 digestmod=hashlib.sha256).digest()
-
-        signature_sha_base64 = base64.b64encode(signature_sha).decode(encoding='utf-8')
-
-        authorization_origin = f'api_key="{self.APIKey}", algorithm="hmac-sha256", headers="host date request-line", signature="{signature_sha_base64}"'
-
-        authorization = base64.b64encode(authorization_origin.encode('utf-8')).decode(encoding='utf-8')
-
-        v = {
-            "authorization": authorization,
-            "date": date,
-            "host": self.host
-        }
-        url = self.Assistant_url + '?' + urlencode(v)
-        return url
+logger = get_logger(__name__)
 
 
 class RedAssistant:
@@ -69,9 +32,9 @@ class RedAssistant:
         self.app_id = self.config["app_id"]
         self.api_secret = self.config["api_secret"]
         self.api_key = self.config["api_key"]
+        self.ws_param = WsParam(self.app_id, self.api_key, self.api_secret, self.ws_url)
         self.sid = ""
         self.answer = ""
-        self.ws = None
 
     def _gen_params(self, question, chat_history=None):
         """生成助手API请求参数"""
@@ -102,82 +65,117 @@ class RedAssistant:
         }
         return data
 
-    def _on_message(self, ws, message):
-        """收到websocket消息的处理"""
+    def _parse_message(self, message):
+        """解析一帧 websocket 消息，返回 (content, status, sid)"""
         data = json.loads(message)
 
         code = data['header']['code']
         if code != 0:
-            print(f'红方请求错误: {code}, {data}')
-            ws.close()
-            return
+            logger.warning("红方返回错误帧", extra={"code": code, "sid": data['header'].get('sid', "")})
+            raise StreamError(f"请求错误: {code}", code)
 
-        if 'sid' in data['header']:
-            self.sid = data['header']['sid']
+        sid = data['header'].get('sid', "")
 
         choices = data["payload"]["choices"]
         status = choices["status"]
         content = choices["text"][0]["content"]
+        return content, status, sid
 
-        print(content, end="")
-        self.answer += content
-
-        if status == 2:
-            ws.close()
-
-    def _on_error(self, ws, error):
-        """收到websocket错误的处理"""
-        print(f"红方错误: {error}")
-
-    def _on_close(self, ws, one, two):
-        """收到websocket关闭的处理"""
-        pass
+    def stream_chat(self, question, chat_history=None, cancel_token=None, timeouts=None, on_token=None,
+                    priority=PRIORITY_INTERACTIVE):
+        """
+        与红方对话一次，返回完整的调用结果
 
-    def _on_open(self, ws):
-        """收到websocket连接建立的处理"""
-        thread.start_new_thread(self._run, (ws,))
+        Args:
+            question: 用户问题
+            chat_history: 对话历史（可选）
+            cancel_token: 取消令牌（可选）
+            timeouts: 截止时间配置（可选），见 WS_TIMEOUT_CONFIG
+            on_token: 每收到一段内容时的回调（可选）
+            priority: 限流排队优先级（可选）
 
-    def _run(self, ws):
-        """发送消息"""
-        data = json.dumps(self._gen_params(ws.question, ws.chat_history))
-        ws.send(data)
+        Returns:
+            dict: text, sid, status, error, code, ttft, elapsed（见 stream_ws）
 
-    def chat(self, question, chat_history=None):
+        Raises:
+            RateLimitExceeded: 排队超时仍未获得配额
+        """
+        with rate_limited("red", priority, cancel_token):
+            wsUrl = self.ws_param.create_url()
+
+            result = stream_ws(
+                wsUrl,
+                self._gen_params(question, chat_history),
+                self._parse_message,
+                timeouts=timeouts,
+                cancel_token=cancel_token,
+                on_token=on_token,
+                span_name="red.stream"
+            )
+        if result["status"] != "completed":
+            logger.warning(
+                "红方调用未完成: %s", result["error"],
+                extra={"status": result["status"], "elapsed": round(result["elapsed"], 3), "sid": result["sid"]}
+            )
+
+        self.answer = result["text"]
+        if result["sid"]:
+            self.sid = result["sid"]
+        return result
+
+    def chat(self, question, chat_history=None, cancel_token=None, timeouts=None, priority=PRIORITY_INTERACTIVE,
+             use_cache=True, on_token=None):
         """
         与红方对话一次
 
+        未收到内容的连接失败/超时按退避策略重试；
+        超时或取消时返回已收到的部分回答。
+        启用对冲（HEDGE_ENABLED）时，首个回复迟迟未到达会并行发起第二个请求。
+        启用回复缓存（RESPONSE_CACHE_ENABLED）时，完全相同的提示词直接返回缓存的完整回复。
+
         Args:
             question: 用户问题
             chat_history: 对话历史（可选）
+            cancel_token: 取消令牌（可选）
+            timeouts: 截止时间配置（可选）
+            priority: 限流排队优先级（可选）
+            use_cache: 是否使用回复缓存，传 False 可绕过缓存
+            on_token: 每收到一段内容时的回调（可选，命中缓存时不调用）
 
         Returns:
             (answer, sid): 回答内容和会话ID
-        """
-        wsParam = WsParam(
-            self.app_id,
-            self.api_key,
-            self.api_secret,
-            self.ws_url
-        )
-        wsUrl = wsParam.create_url()
-
-        self.answer = ""
 
-        websocket.enableTrace(False)
-        ws = websocket.WebSocketApp(
-            wsUrl,
-            on_message=self._on_message,
-            on_error=self._on_error,
-            on_close=self._on_close,
-            on_open=self._on_open
+        Raises:
+            UpstreamError: 重试耗尽仍未收到任何回答，或红方服务处于熔断状态
+        """
+        cache = get_response_cache() if use_cache else None
+        cache_key = None
+        if cache is not None:
+            cache_key = make_cache_key(self.ws_url, self._gen_params(question, chat_history))
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        hedger = get_hedger("red")
+        result = call_with_resilience(
+            "red",
+            lambda: raise_for_stream_result(
+                "red",
+                hedger.call(
+                    lambda token, on_token: self.stream_chat(
+                        question, chat_history, token, timeouts, on_token, priority=priority
+                    ),
+                    cancel_token,
+                    on_token
+                )
+            ),
+            cancel_token=cancel_token
         )
 
-        ws.question = question
-        ws.chat_history = chat_history
-
-        ws.run_forever(sslopt={"cert_reqs": ssl.CERT_NONE})
-
-        return self.answer, self.sid
+        # 只缓存完整的回复
+        if cache_key is not None and result["status"] == "completed":
+            cache.put(cache_key, (result["text"], result["sid"]))
+        return result["text"], result["sid"]
 
 
 # 全局实例
@@ -192,16 +190,21 @@ def get_red_assistant():
     return _red_assistant
 
 
-def chat_with_red(question, chat_history=None):
+def chat_with_red(question, chat_history=None, cancel_token=None, priority=PRIORITY_INTERACTIVE, use_cache=True,
+                  on_token=None):
     """
     与红方魔鬼导师对话一次
 
     Args:
         question: 用户问题
         chat_history: 对话历史（可选）
+        cancel_token: 取消令牌（可选）
+        priority: 限流排队优先级（可选）
+        use_cache: 是否使用回复缓存（可选）
+        on_token: 每收到一段内容时的回调（可选）
 
     Returns:
         (answer, sid): 回答内容和会话ID
     """
     assistant = get_red_assistant()
-    return assistant.chat(question, chat_history)
+    return assistant.chat(question, chat_history, cancel_token, priority=priority, use_cache=use_cache, on_token=on_token)
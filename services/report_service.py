@@ -1,10 +1,14 @@
 # coding: utf-8
 """
 KIMI 报告生成服务
+生成的报告按会话保存，对话没有变化时直接复用；支持按会话批量生成
 """
-import requests
-from typing import List
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Optional
+import hashlib
+import json
 import sys
+import time
 from pathlib import Path
 
 # 添加项目根目录到 Python 路径
@@ -12,7 +16,16 @@ project_root = Path(__file__).parent.parent
 if str(project_root) not in sys.path:
     sys.path.insert(0, str(project_root))
 
-from config import MOONSHOT_CONFIG
+from config import MOONSHOT_CONFIG, REPORT_BULK_CONFIG
+from services.resilience import UpstreamError, call_with_resilience
+from services.rate_limiter import PRIORITY_BACKGROUND, rate_limited
+from services.session_service import get_report_data, get_training_report, save_training_report
+from utils.tracing import span, trace
+from utils.metrics import record_upstream
+from utils.profiling import profile_slow
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
 
 
 class ReportGenerator:
@@ -24,31 +37,67 @@ class ReportGenerator:
         self.base_url = self.config["base_url"]
         self.model = self.config["model"]
 
-    def generate(self, conversation: List[dict]) -> str:
+    def generate(self, conversation: List[dict], priority: int = PRIORITY_BACKGROUND, session_id: str = None) -> str:
         """
         生成 Markdown 格式的训练报告
 
+        报告请求默认以后台优先级排队，让位于交互式对话。
+        启用性能剖析时，耗时超过阈值的生成过程会按会话保存剖析结果。
+
         Args:
             conversation: 对话历史列表
+            priority: 限流排队优先级（可选）
+            session_id: 会话ID（可选，用于追踪与性能剖析归档）
 
         Returns:
             markdown 格式的报告
         """
+        # requests 只在实际调用接口时导入，避免拖慢页面首次加载
+        import requests
+
         prompt = self._build_prompt(conversation)
 
         try:
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": self.model,
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": """你是 PrePlay 专业的训练报告生成助手。你的职责是分析用户与红方魔鬼导师、蓝方心理教练的完整对话，生成一份结构清晰、有指导意义的训练报告。请严格按照以下结构生成 Markdown 格式的报告：
+            with trace("report", session_id=session_id, messages=len(conversation)), \
+                    profile_slow("report", session_id=session_id, messages=len(conversation)):
+                result = call_with_resilience("moonshot", lambda: self._post_completion(prompt, priority))
+            markdown = result["choices"][0]["message"]["content"]
+            return markdown
+
+        except (requests.exceptions.RequestException, UpstreamError) as e:
+            logger.error("报告生成失败: %s", e)
+            raise Exception(f"无法生成报告: {str(e)}")
+
+    def _post_completion(self, prompt: str, priority: int = PRIORITY_BACKGROUND) -> dict:
+        """
+        调用 Moonshot 对话补全接口
+
+        连接失败、超时、429 与 5xx 视为可重试的上游故障。
+
+        Args:
+            prompt: 用户提示词
+            priority: 限流排队优先级
+
+        Returns:
+            接口返回的 JSON
+        """
+        import requests
+
+        start = time.perf_counter()
+        try:
+            with rate_limited("moonshot", priority), span("moonshot.completion") as current:
+                response = requests.post(
+                    f"{self.base_url}/chat/completions",
+                    headers={
+                        "Authorization": f"Bearer {self.api_key}",
+                        "Content-Type": "application/json"
+                    },
+                    json={
+                        "model": self.model,
+                        "messages": [
+                            {
+                                "role": "system",
+                                "content": """你是 PrePlay 专业的训练报告生成助手。你的职责是分析用户与红方魔鬼导师、蓝方心理教练的完整对话，生成一份结构清晰、有指导意义的训练报告。请严格按照以下结构生成 Markdown 格式的报告：
 
 # PrePlay 训练报告
 
@@ -69,26 +118,39 @@ class ReportGenerator:
 ## 🌟 鼓励与肯定
 
 [正面的鼓励语言，2-3 句话]"""
-                        },
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ],
-                    "temperature": 0.6,
-                    "max_tokens": 4000
-                },
-                timeout=60
-            )
-
-            response.raise_for_status()
-
-            markdown = response.json()["choices"][0]["message"]["content"]
-            return markdown
-
-        except requests.exceptions.RequestException as e:
-            print(f"报告生成失败: {str(e)}")
-            raise Exception(f"无法生成报告: {str(e)}")
+                            },
+                            {
+                                "role": "user",
+                                "content": prompt
+                            }
+                        ],
+                        "temperature": 0.6,
+                        "max_tokens": 4000
+                    },
+                    timeout=60
+                )
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            record_upstream("moonshot", "error", time.perf_counter() - start)
+            raise UpstreamError(str(e), transient=True)
+
+        record_upstream("moonshot", response.status_code, response.elapsed.total_seconds())
+        current.set(
+            status_code=response.status_code,
+            request_bytes=len(response.request.body or b""),
+            response_bytes=len(response.content)
+        )
+
+        if response.status_code == 429 or response.status_code >= 500:
+            raise UpstreamError(f"HTTP {response.status_code}", transient=True, code=response.status_code)
+
+        response.raise_for_status()
+        result = response.json()
+        usage = result.get("usage") or {}
+        current.set(
+            prompt_tokens=usage.get("prompt_tokens"),
+            completion_tokens=usage.get("completion_tokens")
+        )
+        return result
 
     def _build_prompt(self, conversation: List[dict]) -> str:
         """构建报告生成的提示词"""
@@ -138,15 +200,121 @@ def get_report_generator():
     return _report_generator
 
 
-def generate_report(conversation: List[dict]) -> str:
+def generate_report(conversation: List[dict], priority: int = PRIORITY_BACKGROUND, session_id: str = None) -> str:
     """
     生成训练报告
 
     Args:
         conversation: 对话历史列表
+        priority: 限流排队优先级（可选）
+        session_id: 会话ID（可选）
 
     Returns:
         markdown 格式的报告
     """
     generator = get_report_generator()
-    return generator.generate(conversation)
+    return generator.generate(conversation, priority, session_id)
+
+
+def conversation_fingerprint(conversation: List[dict]) -> str:
+    """
+    计算对话指纹，对话内容不变时指纹不变
+
+    Args:
+        conversation: 对话历史列表
+
+    Returns:
+        十六进制摘要
+    """
+    payload = json.dumps(
+        [[msg.get("role"), msg.get("source", ""), msg.get("content", "")] for msg in conversation],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get_session_report(session_id: str, force: bool = False, priority: int = PRIORITY_BACKGROUND) -> Optional[dict]:
+    """
+    获取会话的训练报告
+
+    已保存的报告与当前对话指纹一致时直接返回，否则重新生成并保存。
+
+    Args:
+        session_id: 会话ID
+        force: 是否忽略已保存的报告重新生成
+        priority: 限流排队优先级（可选）
+
+    Returns:
+        dict: session_id, messages（参与报告的消息数）, report（Markdown）, cached（是否复用已保存的报告）；
+        会话没有对话记录时返回None
+
+    Raises:
+        Exception: 报告生成失败
+    """
+    conversation = get_report_data(session_id)
+    if not conversation:
+        return None
+
+    fingerprint = conversation_fingerprint(conversation)
+    if not force:
+        saved = get_training_report(session_id)
+        if saved is not None and saved["fingerprint"] == fingerprint:
+            return {"session_id": session_id, "messages": len(conversation), "report": saved["content"], "cached": True}
+
+    report = generate_report(conversation, priority, session_id)
+    try:
+        save_training_report(session_id, report, len(conversation), fingerprint)
+    except Exception as e:
+        logger.error("保存报告失败: %s", e, extra={"session_id": session_id})
+    return {"session_id": session_id, "messages": len(conversation), "report": report, "cached": False}
+
+
+def generate_reports(
+    session_ids: List[str],
+    concurrency: int = None,
+    force: bool = False,
+    on_result: Callable[[dict], None] = None
+) -> List[dict]:
+    """
+    批量生成训练报告
+
+    多个报告并发生成，实际请求速率受 Moonshot 限流控制；已保存且对话未变化的报告直接跳过。
+
+    Args:
+        session_ids: 会话ID列表
+        concurrency: 同时生成的报告数，默认取 REPORT_BULK_CONFIG
+        force: 是否忽略已保存的报告重新生成
+        on_result: 每个会话处理完成时的回调（可选）
+
+    Returns:
+        [{"session_id", "status": "generated"/"cached"/"empty"/"failed", "messages", "report", "error", "elapsed"}, ...]，
+        顺序与 session_ids 一致
+    """
+    concurrency = concurrency or REPORT_BULK_CONFIG["concurrency"]
+
+    def run(session_id):
+        start = time.perf_counter()
+        result = {"session_id": session_id, "status": None, "messages": 0, "report": None, "error": None}
+        try:
+            report = get_session_report(session_id, force)
+            if report is None:
+                result["status"] = "empty"
+            else:
+                result["status"] = "cached" if report["cached"] else "generated"
+                result["messages"] = report["messages"]
+                result["report"] = report["report"]
+        except Exception as e:
+            result["status"] = "failed"
+            result["error"] = str(e)
+        result["elapsed"] = time.perf_counter() - start
+        return result
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1), thread_name_prefix="preplay-report") as executor:
+        futures = [executor.submit(run, session_id) for session_id in dict.fromkeys(session_ids)]
+        for future in as_completed(futures):
+            result = future.result()
+            results[result["session_id"]] = result
+            if on_result is not None:
+                on_result(result)
+    return [results[session_id] for session_id in dict.fromkeys(session_ids)]
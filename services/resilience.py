@@ -0,0 +1,249 @@
+# coding: utf-8
+"""
+上游服务容错
+为红方、蓝方、知识库与报告服务提供有界重试（带抖动的指数退避）和按端点的熔断器
+"""
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from config import RESILIENCE_CONFIG
+from utils.metrics import registry
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+# 讯飞接口中可重试的错误码（服务繁忙、网络异常、秒级/并发流控）
+TRANSIENT_ERROR_CODES = {10110, 10222, 11202, 11203}
+
+# 各端点的展示名称
+ENDPOINT_NAMES = {
+    "red": "红方",
+    "blue": "蓝方",
+    "chatdoc": "知识库",
+    "moonshot": "报告"
+}
+
+
+class UpstreamError(Exception):
+    """上游服务调用失败"""
+
+    def __init__(self, message, transient=False, code=None):
+        super().__init__(message)
+        self.transient = transient
+        self.code = code
+
+
+class CircuitOpenError(UpstreamError):
+    """熔断器打开，请求被直接拒绝"""
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    closed：正常放行；连续失败达到阈值后进入 open。
+    open：直接拒绝请求；冷却时间结束后进入 half_open。
+    half_open：只放行一个试探请求，成功则恢复 closed，失败则重新 open。
+    """
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """判断当前是否放行请求"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def is_open(self):
+        """熔断器是否处于拒绝状态（不改变状态）"""
+        with self._lock:
+            return self.state == "open" and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def record_success(self):
+        """记录一次成功"""
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        """记录一次失败"""
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        """请求既非成功也非上游故障（如取消、参数错误）时释放试探名额"""
+        with self._lock:
+            self._probe_in_flight = False
+
+
+# 全局熔断器
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(endpoint):
+    """获取端点的熔断器（每个端点一个）"""
+    with _breakers_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                endpoint,
+                RESILIENCE_CONFIG["failure_threshold"],
+                RESILIENCE_CONFIG["reset_timeout"]
+            )
+            _breakers[endpoint] = breaker
+        return breaker
+
+
+def _collect_circuit_states():
+    states = {"closed": 0, "half_open": 1, "open": 2}
+    with _breakers_lock:
+        breakers = list(_breakers.items())
+    for endpoint, breaker in breakers:
+        yield (endpoint,), states[breaker.state]
+
+
+registry.gauge(
+    "preplay_circuit_state", "熔断器状态（0=closed, 1=half_open, 2=open）", ("service",), _collect_circuit_states
+)
+
+
+def is_circuit_open(endpoint):
+    """端点当前是否处于熔断状态"""
+    return get_circuit_breaker(endpoint).is_open()
+
+
+def backoff_delay(attempt, base_delay=None, max_delay=None):
+    """
+    计算第 attempt 次重试前的等待时间（full jitter 指数退避）
+
+    Args:
+        attempt: 重试序号，从 0 开始
+
+    Returns:
+        等待秒数
+    """
+    base_delay = RESILIENCE_CONFIG["base_delay"] if base_delay is None else base_delay
+    max_delay = RESILIENCE_CONFIG["max_delay"] if max_delay is None else max_delay
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def _is_inconclusive(result, cancel_token=None):
+    """调用已被取消，或流式调用（stream_ws 的结果）没有收到任何内容"""
+    if cancel_token is not None and cancel_token.cancelled:
+        return True
+    if isinstance(result, dict) and "status" in result and "text" in result:
+        return result["status"] == "cancelled" or not result["text"]
+    return False
+
+
+def call_with_resilience(endpoint, func, max_retries=None, cancel_token=None):
+    """
+    带重试和熔断保护地调用上游服务
+
+    只有 transient=True 的 UpstreamError 会被重试并计入熔断失败次数；
+    其他异常直接抛出。取消或没有内容的流式结果既不算成功也不算失败。
+
+    Args:
+        endpoint: 端点名称（red/blue/chatdoc/moonshot）
+        func: 无参调用函数
+        max_retries: 最大重试次数，默认取配置
+        cancel_token: 取消令牌（可选），取消后不再重试
+
+    Returns:
+        func 的返回值
+
+    Raises:
+        CircuitOpenError: 熔断器打开
+        UpstreamError: 重试耗尽后的最后一次错误
+    """
+    breaker = get_circuit_breaker(endpoint)
+    if max_retries is None:
+        max_retries = RESILIENCE_CONFIG["max_retries"]
+    name = ENDPOINT_NAMES.get(endpoint, endpoint)
+
+    attempt = 0
+    while True:
+        if not breaker.allow_request():
+            raise CircuitOpenError(f"{name}服务暂时不可用，请稍后再试", transient=True)
+
+        try:
+            result = func()
+        except UpstreamError as e:
+            if not e.transient:
+                breaker.release()
+                raise
+            breaker.record_failure()
+            if attempt >= max_retries or (cancel_token is not None and cancel_token.cancelled):
+                raise
+            logger.warning("%s调用失败，准备第 %d 次重试: %s", name, attempt + 1, e)
+        except BaseException:
+            breaker.release()
+            raise
+        else:
+            if _is_inconclusive(result, cancel_token):
+                # 取消或没有收到内容的流式结果不能说明上游已恢复，不重置熔断器
+                breaker.release()
+            else:
+                breaker.record_success()
+            return result
+
+        delay = backoff_delay(attempt)
+        attempt += 1
+        if cancel_token is not None:
+            if cancel_token.wait(delay):
+                raise UpstreamError(f"{name}请求已取消")
+        else:
+            time.sleep(delay)
+
+
+def raise_for_stream_result(endpoint, result):
+    """
+    将流式调用结果转换为异常
+
+    未收到任何内容的失败/超时视为上游故障；已有部分回答时保留结果不重试。
+
+    Args:
+        endpoint: 端点名称
+        result: stream_ws 返回的结果
+
+    Returns:
+        result 本身
+    """
+    if result["status"] in ("error", "timeout") and not result["text"]:
+        code = result.get("code")
+        transient = result["status"] == "timeout" or code is None or code in TRANSIENT_ERROR_CODES
+        name = ENDPOINT_NAMES.get(endpoint, endpoint)
+        raise UpstreamError(f"{name}{result['error']}", transient=transient, code=code)
+    return result
@@ -0,0 +1,112 @@
+# coding: utf-8
+"""
+助手回复缓存
+以 (助手地址, 模型 domain, temperature, 完整消息列表) 的哈希为键，
+在本地缓存红/蓝方的完整回复，按条目数 LRU 淘汰并设置过期时间
+"""
+import hashlib
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from config import RESPONSE_CACHE_CONFIG
+from utils.metrics import record_cache
+
+
+def make_cache_key(endpoint_url, params):
+    """
+    生成缓存键
+
+    Args:
+        endpoint_url: 助手 WebSocket 地址（区分不同助手）
+        params: 助手 API 请求参数（_gen_params 的返回值）
+
+    Returns:
+        十六进制哈希字符串
+    """
+    chat = params["parameter"]["chat"]
+    material = {
+        "endpoint": endpoint_url,
+        "domain": chat.get("domain"),
+        "temperature": chat.get("temperature"),
+        "messages": params["payload"]["message"]["text"]
+    }
+    raw = json.dumps(material, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """带过期时间的 LRU 回复缓存"""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        读取缓存
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            缓存值，未命中或已过期返回None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        record_cache("response", entry is not None)
+        return entry[1] if entry is not None else None
+
+    def put(self, key, value):
+        """写入缓存，超过条目上限时淘汰最久未使用的条目"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+# 全局实例
+_response_cache = None
+
+
+def get_response_cache():
+    """获取回复缓存实例（单例），未启用时返回None"""
+    global _response_cache
+    if not RESPONSE_CACHE_CONFIG["enabled"]:
+        return None
+    if _response_cache is None:
+        _response_cache = ResponseCache(
+            RESPONSE_CACHE_CONFIG["max_entries"],
+            RESPONSE_CACHE_CONFIG["ttl"]
+        )
+    return _response_cache
@@ -90,6 +90,31 @@ class SessionService:
         """
         return self.db.get_session(session_id)
 
+    def get_watermark(self, session_id: str) -> Optional[Dict]:
+        """
+        获取会话对话记录的版本标记（最后一条消息ID与清空历史的位置）
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            版本标记，会话不存在返回None
+        """
+        return self.db.get_session_watermark(session_id)
+
+    def update_history_cutoff(self, session_id: str, message_id: int) -> bool:
+        """
+        记录清空对话历史的位置，此前的消息不再作为对话上下文
+
+        Args:
+            session_id: 会话ID
+            message_id: 清空时的最后一条消息ID
+
+        Returns:
+            是否更新成功
+        """
+        return self.db.update_session_history_cutoff(session_id, message_id)
+
     def update_session_sids(self, session_id: str, red_sid: str = None, blue_sid: str = None) -> bool:
         """
         更新会话的红/蓝方sid
@@ -128,6 +153,34 @@ class SessionService:
         """
         return self.db.list_sessions(limit)
 
+    def find_sessions(self, since: str = None, until: str = None, session_ids: List[str] = None) -> List[Dict]:
+        """
+        按创建时间范围或会话ID筛选会话
+
+        Args:
+            since: 起始时间（本地时间，含）
+            until: 截止时间（本地时间，不含）
+            session_ids: 会话ID列表（可选）
+
+        Returns:
+            会话列表（含消息数 message_count）
+        """
+        return self.db.find_sessions(since, until, session_ids)
+
+    def search(self, query: str, limit: int = 20, messages_per_session: int = 3) -> List[Dict]:
+        """
+        按内容搜索训练记录
+
+        Args:
+            query: 搜索词（多个词以空格分隔）
+            limit: 返回的会话数
+            messages_per_session: 每个会话返回的匹配消息数
+
+        Returns:
+            按相关度排序的会话列表，每个会话附带匹配的消息与摘要（snippet，匹配处以 ** 标出）
+        """
+        return self.db.search_messages(query, limit, messages_per_session)
+
     def delete_session(self, session_id: str) -> bool:
         """
         删除会话及其所有消息
@@ -186,6 +239,37 @@ class SessionService:
             return self.update_knowledge_file_ids(session_id, existing_ids)
         return True
 
+    # ============================================
+    # 训练报告
+    # ============================================
+
+    def save_report(self, session_id: str, content: str, message_count: int, fingerprint: str) -> bool:
+        """
+        保存会话的训练报告
+
+        Args:
+            session_id: 会话ID
+            content: 报告内容（Markdown）
+            message_count: 生成报告时的消息数
+            fingerprint: 生成报告时的对话指纹
+
+        Returns:
+            是否保存成功
+        """
+        return self.db.save_report(session_id, content, message_count, fingerprint)
+
+    def get_report(self, session_id: str) -> Optional[Dict]:
+        """
+        获取会话保存的训练报告
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            报告信息字典（content, message_count, fingerprint, created_at），不存在返回None
+        """
+        return self.db.get_report(session_id)
+
 
 # 全局实例
 _session_service = None
@@ -246,3 +330,40 @@ def add_session_knowledge_file_id(session_id: str, file_id: str) -> bool:
     """向会话添加一个知识库文件 ID"""
     service = get_session_service()
     return service.add_knowledge_file_id(session_id, file_id)
+
+
+def get_training_watermark(session_id: str) -> Optional[Dict]:
+    """获取会话对话记录的版本标记"""
+    service = get_session_service()
+    return service.get_watermark(session_id)
+
+
+def update_training_history_cutoff(session_id: str, message_id: int) -> bool:
+    """记录清空对话历史的位置"""
+    service = get_session_service()
+    return service.update_history_cutoff(session_id, message_id)
+
+
+def search_training_history(query: str, limit: int = 20) -> List[Dict]:
+    """按内容搜索训练记录"""
+    service = get_session_service()
+    return service.search(query, limit)
+
+
+# 训练报告便捷函数
+def find_training_sessions(since: str = None, until: str = None, session_ids: List[str] = None) -> List[Dict]:
+    """按创建时间范围或会话ID筛选会话"""
+    service = get_session_service()
+    return service.find_sessions(since, until, session_ids)
+
+
+def save_training_report(session_id: str, content: str, message_count: int, fingerprint: str) -> bool:
+    """保存会话的训练报告"""
+    service = get_session_service()
+    return service.save_report(session_id, content, message_count, fingerprint)
+
+
+def get_training_report(session_id: str) -> Optional[Dict]:
+    """获取会话保存的训练报告"""
+    service = get_session_service()
+    return service.get_report(session_id)
@@ -0,0 +1,442 @@
+# coding: utf-8
+"""
+训练引擎
+与界面无关的训练流程：创建/恢复会话、发送一轮对话（可流式接收回答）、结束会话与生成报告。
+Streamlit 训练页面与独立的训练服务（services/training_server.py）共用该引擎
+
+会话的对话状态保存在内存中（按最近使用淘汰），每次使用前与数据库中的版本标记
+（最后一条消息ID与清空历史的位置）比对，不在内存中或已过期的会话从数据库恢复，
+因此同一会话的请求可以由任意一个共用数据库的进程处理。
+取消进行中的轮次只对本进程内的轮次有效（流式对话断开连接即取消，不受影响）。
+"""
+import queue
+import sys
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from config import TRAINING_ENGINE_CONFIG
+from services.session_service import (
+    create_training_session,
+    save_training_message,
+    get_training_messages,
+    get_training_stats,
+    update_session_knowledge_file_ids,
+    get_session_knowledge_file_ids,
+    get_training_watermark,
+    update_training_history_cutoff
+)
+from services.turn_orchestrator import TARGETS, get_turn_orchestrator
+from services.prefetch_service import discard_prefetch
+from services.opening_service import take_opening_question
+from services.ws_stream import CancelToken
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class SessionNotFoundError(Exception):
+    """会话不存在"""
+
+
+def build_api_history(chat_history, target):
+    """
+    按对话对象构造 API 格式的对话历史
+
+    红方只需要用户发给自己的消息（未标记对象的用户消息也算作发给红方），
+    蓝方需要完整对话历史。
+
+    Args:
+        chat_history: 对话历史（界面格式，role 为 user/red/blue）
+        target: 对话对象（"red" 或 "blue"）
+
+    Returns:
+        [{"role": "user"/"assistant", "content": ...}, ...]
+    """
+    if target == "red":
+        return [
+            {"role": "user", "content": msg["content"]}
+            for msg in chat_history
+            if msg["role"] == "user" and msg.get("target") in ("red", None)
+        ]
+    role_map = {"user": "user", "red": "assistant", "blue": "assistant"}
+    return [{"role": role_map.get(msg["role"], "user"), "content": msg["content"]} for msg in chat_history]
+
+
+def message_from_record(record):
+    """
+    把数据库中的消息转换为界面格式
+
+    Args:
+        record: 数据库消息（role 为 user/assistant，source 标明红/蓝方）
+
+    Returns:
+        dict: role（user/red/blue）, content, timestamp（HH:MM:SS）
+    """
+    role = record["role"]
+    timestamp = record["timestamp"]
+
+    # SQLite 返回的是类似 "2025-02-23 18:40:15" 的字符串，只取时间部分
+    if isinstance(timestamp, str):
+        parts = timestamp.split()
+        time_str = parts[-1][:8] if parts else "00:00:00"
+    else:
+        time_str = timestamp.strftime("%H:%M:%S")
+
+    if role == "assistant":
+        display_role = "red" if "红" in (record.get("source") or "") else "blue"
+    else:
+        display_role = role
+
+    return {"role": display_role, "content": record["content"], "timestamp": time_str}
+
+
+class TrainingSession:
+    """一个训练会话的对话状态"""
+
+    def __init__(self, session_id, file_ids=None, chat_history=None, watermark=None):
+        self.session_id = session_id
+        self.file_ids = list(file_ids or [])
+        self.chat_history = list(chat_history or [])
+        # 对话状态对应的数据库版本标记，与数据库不一致时说明会话在其他进程中有更新
+        self.watermark = watermark
+        self.lock = threading.Lock()
+
+    @property
+    def rounds(self):
+        return len([msg for msg in self.chat_history if msg["role"] == "user"])
+
+    def add_message(self, role, content, target=None, timestamp=None):
+        message = {
+            "role": role,
+            "content": content,
+            "timestamp": timestamp or datetime.now().strftime("%H:%M:%S"),
+            "target": target
+        }
+        with self.lock:
+            self.chat_history.append(message)
+        return message
+
+    def snapshot(self):
+        """可序列化的会话状态"""
+        with self.lock:
+            return {
+                "session_id": self.session_id,
+                "file_ids": list(self.file_ids),
+                "rounds": self.rounds,
+                "messages": [dict(msg) for msg in self.chat_history]
+            }
+
+
+class TrainingEngine:
+    """训练引擎"""
+
+    def __init__(self, config=None):
+        self.config = config or TRAINING_ENGINE_CONFIG
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    # ============================================
+    # 会话状态
+    # ============================================
+
+    def _remember(self, state):
+        with self._lock:
+            self._sessions[state.session_id] = state
+            self._sessions.move_to_end(state.session_id)
+            while len(self._sessions) > self.config["max_sessions"]:
+                self._sessions.popitem(last=False)
+        return state
+
+    def _get_state(self, session_id):
+        """取内存中的会话状态，没有或已过期时从数据库恢复"""
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is not None:
+                self._sessions.move_to_end(session_id)
+        if state is not None:
+            watermark = get_training_watermark(session_id)
+            if watermark is None:
+                with self._lock:
+                    self._sessions.pop(session_id, None)
+                raise SessionNotFoundError(f"会话不存在: {session_id}")
+            if watermark == state.watermark:
+                return state
+        return self._load_state(session_id)
+
+    def _load_state(self, session_id):
+        watermark = get_training_watermark(session_id)
+        if watermark is None:
+            raise SessionNotFoundError(f"会话不存在: {session_id}")
+        cutoff = watermark["history_cutoff_id"]
+        records = get_training_messages(session_id)
+        chat_history = [message_from_record(record) for record in records if record["id"] > cutoff]
+        # 以读到的消息为准，读取期间新写入的消息会在下次使用时触发重新加载
+        watermark["last_message_id"] = max((record["id"] for record in records), default=0)
+        file_ids = get_session_knowledge_file_ids(session_id) or []
+        return self._remember(TrainingSession(session_id, file_ids, chat_history, watermark))
+
+    def _sync_watermark(self, state):
+        """本进程写入消息后更新会话状态的版本标记，避免下次使用时重新加载"""
+        watermark = get_training_watermark(state.session_id)
+        if watermark is not None:
+            state.watermark = watermark
+
+    # ============================================
+    # 会话生命周期
+    # ============================================
+
+    def start_session(self, file_ids=None, use_opening=True):
+        """
+        创建新的训练会话
+
+        带知识库文件时关联到会话，并使用预生成的开场问题由红方直接开场。
+
+        Args:
+            file_ids: 知识库文件ID列表（可选）
+            use_opening: 是否使用预生成的开场问题
+
+        Returns:
+            dict: 会话状态（session_id, file_ids, rounds, messages）
+        """
+        session_id = create_training_session()
+        state = TrainingSession(session_id, file_ids)
+
+        if file_ids:
+            update_session_knowledge_file_ids(session_id, list(file_ids))
+            if use_opening:
+                opening_question = take_opening_question(list(file_ids))
+                if opening_question:
+                    state.add_message("red", opening_question)
+                    try:
+                        save_training_message(session_id, "assistant", opening_question, TARGETS["red"]["source"])
+                    except Exception as e:
+                        logger.error("保存开场问题失败: %s", e, extra={"session_id": session_id})
+
+        self._sync_watermark(state)
+        self._remember(state)
+        return state.snapshot()
+
+    def resume_session(self, session_id):
+        """
+        从数据库恢复会话（丢弃内存中的状态）
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            dict: 会话状态
+
+        Raises:
+            SessionNotFoundError: 会话不存在
+        """
+        return self._load_state(session_id).snapshot()
+
+    def get_session(self, session_id):
+        """
+        获取会话状态
+
+        Raises:
+            SessionNotFoundError: 会话不存在
+        """
+        return self._get_state(session_id).snapshot()
+
+    def clear_history(self, session_id):
+        """
+        清空会话的对话历史
+
+        数据库中的记录保留（供报告与搜索使用），只记录清空的位置，
+        此前的消息不再作为对话上下文，会话重新加载后同样生效。
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            dict: 会话状态
+        """
+        self.cancel_turn(session_id)
+        state = self._get_state(session_id)
+        watermark = get_training_watermark(session_id)
+        if watermark is None:
+            raise SessionNotFoundError(f"会话不存在: {session_id}")
+        update_training_history_cutoff(session_id, watermark["last_message_id"])
+        with state.lock:
+            state.chat_history = []
+        self._sync_watermark(state)
+        return state.snapshot()
+
+    def cancel_turn(self, session_id):
+        """取消会话正在进行的轮次，并丢弃为其预取的检索"""
+        cancelled = get_turn_orchestrator().cancel_session_turn(session_id)
+        discard_prefetch(session_id)
+        return cancelled
+
+    def end_session(self, session_id):
+        """
+        结束训练：取消进行中的轮次，释放内存中的会话状态
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            dict: session_id, rounds, stats（消息统计）
+        """
+        self.cancel_turn(session_id)
+        state = self._get_state(session_id)
+        with self._lock:
+            self._sessions.pop(session_id, None)
+        return {
+            "session_id": session_id,
+            "rounds": state.rounds,
+            "stats": get_training_stats(session_id)
+        }
+
+    def get_report(self, session_id, force=False):
+        """
+        获取训练报告（对话没有变化时复用已保存的报告）
+
+        Args:
+            session_id: 会话ID
+            force: 是否重新生成
+
+        Returns:
+            dict: session_id, messages（参与报告的消息数）, report（Markdown）, cached（是否复用已保存的报告）
+
+        Raises:
+            SessionNotFoundError: 会话没有对话记录
+            Exception: 报告生成失败
+        """
+        from services.report_service import get_session_report
+
+        report = get_session_report(session_id, force)
+        if report is None:
+            raise SessionNotFoundError(f"会话没有对话记录: {session_id}")
+        return report
+
+    # ============================================
+    # 对话
+    # ============================================
+
+    def send_turn(self, session_id, target, text, on_token=None, cancel_token=None):
+        """
+        发送一轮对话
+
+        用户消息与回答会写入会话状态与数据库；知识库检索、预取与推测调用由编排器处理。
+
+        Args:
+            session_id: 会话ID
+            target: 对话对象（"red" 或 "blue"）
+            text: 用户输入
+            on_token: 每收到一段回答内容时的回调（可选）
+            cancel_token: 本轮的取消令牌（可选）
+
+        Returns:
+            dict: user（用户消息）, reply（回答消息，没有回答时为None）,
+                  kb_used, kb_prefetched, kb_error, speculative_used, cancelled
+
+        Raises:
+            ValueError: 对话对象无效或输入为空
+            SessionNotFoundError: 会话不存在
+        """
+        if target not in TARGETS:
+            raise ValueError(f"无效的对话对象: {target}")
+        if not text or not text.strip():
+            raise ValueError("输入内容为空")
+
+        state = self._get_state(session_id)
+        user_message = state.add_message("user", text, target)
+        with state.lock:
+            api_history = build_api_history(state.chat_history, target)
+            file_ids = list(state.file_ids)
+
+        result = get_turn_orchestrator().run_turn(
+            target,
+            session_id,
+            text,
+            api_history,
+            file_ids=file_ids,
+            cancel_token=cancel_token,
+            on_token=on_token
+        )
+
+        reply = None
+        if result["response"]:
+            reply = state.add_message(result["role"], result["response"])
+        self._sync_watermark(state)
+
+        return {
+            "user": user_message,
+            "reply": reply,
+            "kb_used": result["kb_used"],
+            "kb_prefetched": result["kb_prefetched"],
+            "kb_error": result["kb_error"],
+            "speculative_used": result["speculative_used"],
+            "cancelled": result["cancelled"]
+        }
+
+    def stream_turn(self, session_id, target, text):
+        """
+        流式发送一轮对话
+
+        提前关闭生成器会取消本轮对话。
+
+        Args:
+            session_id: 会话ID
+            target: 对话对象（"red" 或 "blue"）
+            text: 用户输入
+
+        Yields:
+            {"event": "token", "content": ...}，最后一条为
+            {"event": "done", "result": send_turn 的返回值} 或 {"event": "error", "error": ...}
+        """
+        events = queue.Queue()
+        cancel_token = CancelToken()
+        streamed = []
+
+        def on_token(content):
+            streamed.append(content)
+            events.put({"event": "token", "content": content})
+
+        def run():
+            try:
+                result = self.send_turn(session_id, target, text, on_token=on_token, cancel_token=cancel_token)
+                # 命中缓存或采用推测结果时没有逐段内容，一次性补发完整回答
+                if not streamed and result["reply"]:
+                    events.put({"event": "token", "content": result["reply"]["content"]})
+                events.put({"event": "done", "result": result})
+            except Exception as e:
+                events.put({"event": "error", "error": str(e)})
+
+        worker = threading.Thread(target=run, name=f"preplay-engine-{session_id}", daemon=True)
+        worker.start()
+        finished = False
+        try:
+            while True:
+                event = events.get()
+                yield event
+                if event["event"] in ("done", "error"):
+                    finished = True
+                    return
+        finally:
+            if not finished:
+                cancel_token.cancel()
+
+
+# 全局实例
+_training_engine = None
+_training_engine_lock = threading.Lock()
+
+
+def get_training_engine():
+    """获取训练引擎实例（单例）"""
+    global _training_engine
+    with _training_engine_lock:
+        if _training_engine is None:
+            _training_engine = TrainingEngine()
+        return _training_engine
@@ -0,0 +1,309 @@
+# coding: utf-8
+"""
+训练服务
+以 HTTP/WebSocket 暴露训练引擎，可脱离 Streamlit 单独部署并横向扩展
+（会话状态保存在数据库中，多个实例需共用同一数据库）
+
+用法:
+    python -m services.training_server [--host 127.0.0.1] [--port 8600]
+    （监听非本机地址时需设置 TRAINING_SERVER_TOKEN）
+
+接口:
+    POST /sessions                        创建会话 {"file_ids": [...], "use_opening": true}
+    GET  /sessions/{id}                   会话状态
+    POST /sessions/{id}/resume            从数据库恢复会话
+    POST /sessions/{id}/turns             发送一轮对话 {"target": "red"/"blue", "text": ...}
+    GET  /sessions/{id}/ws                WebSocket 流式对话：发送 {"target", "text"} 或 {"action": "cancel"}，
+                                          接收 {"event": "token"/"done"/"error", ...}
+    POST /sessions/{id}/cancel            取消进行中的轮次
+    POST /sessions/{id}/clear             清空对话历史
+    POST /sessions/{id}/end               结束训练
+    POST /sessions/{id}/report            生成训练报告（对话未变化时复用已保存的报告）{"force": false}
+    POST /reports                         批量生成报告 {"session_ids": [...]} 或 {"since": ..., "until": ...}，
+                                          可选 "force"、"concurrency"
+    GET  /health                          健康检查
+"""
+import argparse
+import asyncio
+import functools
+import hmac
+import ipaddress
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from aiohttp import web, WSMsgType
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from config import TRAINING_ENGINE_CONFIG
+from services.training_engine import SessionNotFoundError, get_training_engine
+from services.ws_stream import CancelToken
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def _error(status, message):
+    return web.json_response({"error": message}, status=status)
+
+
+@web.middleware
+async def auth_middleware(request, handler):
+    """配置了 TRAINING_SERVER_TOKEN 时校验 Bearer 令牌（WebSocket 也可通过 ?token= 传入）"""
+    token = request.app["config"]["token"]
+    if token and request.path != "/health":
+        supplied = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+        if not (_token_matches(supplied, token) or _token_matches(request.query.get("token"), token)):
+            return _error(401, "未授权")
+    return await handler(request)
+
+
+def _token_matches(supplied, token):
+    """以固定时间比较令牌，避免按响应时间逐字猜测"""
+    return bool(supplied) and hmac.compare_digest(supplied.encode("utf-8"), token.encode("utf-8"))
+
+
+def is_loopback_host(host):
+    """监听地址是否只能从本机访问"""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+@web.middleware
+async def error_middleware(request, handler):
+    """把引擎抛出的异常转换为 JSON 错误"""
+    try:
+        return await handler(request)
+    except web.HTTPException:
+        raise
+    except SessionNotFoundError as e:
+        return _error(404, str(e))
+    except ValueError as e:
+        return _error(400, str(e))
+    except Exception as e:
+        logger.exception("处理请求失败: %s", e, extra={"path": request.path})
+        return _error(502, str(e))
+
+
+async def _call(request, func, *args, **kwargs):
+    """在线程池中执行阻塞的引擎调用"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(request.app["executor"], functools.partial(func, *args, **kwargs))
+
+
+async def _read_json(request):
+    if not request.can_read_body:
+        return {}
+    try:
+        data = await request.json()
+    except json.JSONDecodeError:
+        raise ValueError("请求体不是有效的 JSON")
+    if not isinstance(data, dict):
+        raise ValueError("请求体必须是 JSON 对象")
+    return data
+
+
+async def handle_health(request):
+    return web.json_response({"status": "ok"})
+
+
+async def handle_create_session(request):
+    data = await _read_json(request)
+    engine = request.app["engine"]
+    snapshot = await _call(request, engine.start_session, data.get("file_ids") or None, data.get("use_opening", True))
+    return web.json_response(snapshot, status=201)
+
+
+async def handle_get_session(request):
+    engine = request.app["engine"]
+    return web.json_response(await _call(request, engine.get_session, request.match_info["session_id"]))
+
+
+async def handle_resume_session(request):
+    engine = request.app["engine"]
+    return web.json_response(await _call(request, engine.resume_session, request.match_info["session_id"]))
+
+
+async def handle_turn(request):
+    data = await _read_json(request)
+    engine = request.app["engine"]
+    result = await _call(
+        request, engine.send_turn, request.match_info["session_id"], data.get("target"), data.get("text")
+    )
+    return web.json_response(result)
+
+
+async def handle_cancel(request):
+    engine = request.app["engine"]
+    cancelled = await _call(request, engine.cancel_turn, request.match_info["session_id"])
+    return web.json_response({"cancelled": cancelled})
+
+
+async def handle_clear(request):
+    engine = request.app["engine"]
+    return web.json_response(await _call(request, engine.clear_history, request.match_info["session_id"]))
+
+
+async def handle_end(request):
+    engine = request.app["engine"]
+    return web.json_response(await _call(request, engine.end_session, request.match_info["session_id"]))
+
+
+async def handle_report(request):
+    data = await _read_json(request)
+    engine = request.app["engine"]
+    return web.json_response(
+        await _call(request, engine.get_report, request.match_info["session_id"], bool(data.get("force")))
+    )
+
+
+async def handle_bulk_reports(request):
+    from services.report_service import generate_reports
+    from services.session_service import find_training_sessions
+
+    data = await _read_json(request)
+    session_ids = data.get("session_ids")
+    if session_ids is None and not (data.get("since") or data.get("until")):
+        raise ValueError("需要提供 session_ids 或 since/until")
+    sessions = await _call(request, find_training_sessions, data.get("since"), data.get("until"), session_ids)
+    results = await _call(
+        request, generate_reports, [s["id"] for s in sessions], data.get("concurrency"), bool(data.get("force"))
+    )
+    return web.json_response({"results": results})
+
+
+async def handle_turn_ws(request):
+    """WebSocket 流式对话，同一连接上可连续发送多轮；连接断开时取消进行中的轮次"""
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+
+    engine = request.app["engine"]
+    session_id = request.match_info["session_id"]
+    loop = asyncio.get_running_loop()
+    current = {"token": None, "task": None}
+
+    async def run_turn(target, text, cancel_token):
+        events = asyncio.Queue()
+        streamed = []
+
+        def on_token(content):
+            streamed.append(content)
+            loop.call_soon_threadsafe(events.put_nowait, {"event": "token", "content": content})
+
+        async def forward():
+            while True:
+                event = await events.get()
+                if event is None:
+                    return
+                await ws.send_json(event)
+
+        forwarder = asyncio.ensure_future(forward())
+        try:
+            result = await _call(
+                request, engine.send_turn, session_id, target, text, on_token=on_token, cancel_token=cancel_token
+            )
+            # 内容帧先于调用结果排入事件循环，此时已全部在队列中
+            events.put_nowait(None)
+            await forwarder
+            if not streamed and result["reply"]:
+                await ws.send_json({"event": "token", "content": result["reply"]["content"]})
+            await ws.send_json({"event": "done", "result": result})
+        except Exception as e:
+            events.put_nowait(None)
+            await forwarder
+            if not ws.closed:
+                await ws.send_json({"event": "error", "error": str(e)})
+
+    try:
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            try:
+                data = json.loads(msg.data)
+            except json.JSONDecodeError:
+                await ws.send_json({"event": "error", "error": "消息不是有效的 JSON"})
+                continue
+
+            if data.get("action") == "cancel":
+                if current["token"] is not None:
+                    current["token"].cancel()
+                continue
+
+            if current["task"] is not None and not current["task"].done():
+                await ws.send_json({"event": "error", "error": "上一轮对话尚未结束"})
+                continue
+
+            current["token"] = CancelToken()
+            current["task"] = asyncio.ensure_future(run_turn(data.get("target"), data.get("text"), current["token"]))
+    finally:
+        if current["token"] is not None:
+            current["token"].cancel()
+        if current["task"] is not None:
+            await asyncio.gather(current["task"], return_exceptions=True)
+
+    return ws
+
+
+async def _shutdown_executor(app):
+    app["executor"].shutdown(wait=False, cancel_futures=True)
+
+
+def create_app(config=None, engine=None):
+    """
+    创建训练服务应用
+
+    Args:
+        config: 服务配置，默认取 TRAINING_ENGINE_CONFIG
+        engine: 训练引擎（可选，默认使用全局实例）
+
+    Returns:
+        aiohttp 应用
+    """
+    config = {**TRAINING_ENGINE_CONFIG, **(config or {})}
+    app = web.Application(middlewares=[auth_middleware, error_middleware])
+    app["config"] = config
+    app["engine"] = engine or get_training_engine()
+    app["executor"] = ThreadPoolExecutor(max_workers=config["workers"], thread_name_prefix="preplay-server")
+    app.on_cleanup.append(_shutdown_executor)
+
+    app.router.add_get("/health", handle_health)
+    app.router.add_post("/sessions", handle_create_session)
+    app.router.add_get("/sessions/{session_id}", handle_get_session)
+    app.router.add_post("/sessions/{session_id}/resume", handle_resume_session)
+    app.router.add_post("/sessions/{session_id}/turns", handle_turn)
+    app.router.add_get("/sessions/{session_id}/ws", handle_turn_ws)
+    app.router.add_post("/sessions/{session_id}/cancel", handle_cancel)
+    app.router.add_post("/sessions/{session_id}/clear", handle_clear)
+    app.router.add_post("/sessions/{session_id}/end", handle_end)
+    app.router.add_post("/sessions/{session_id}/report", handle_report)
+    app.router.add_post("/reports", handle_bulk_reports)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PrePlay 训练服务")
+    parser.add_argument("--host", default=TRAINING_ENGINE_CONFIG["host"])
+    parser.add_argument("--port", type=int, default=TRAINING_ENGINE_CONFIG["port"])
+    args = parser.parse_args()
+
+    if not TRAINING_ENGINE_CONFIG["token"] and not is_loopback_host(args.host):
+        parser.error(f"监听 {args.host} 时必须设置 TRAINING_SERVER_TOKEN（未设置令牌时只能监听 127.0.0.1）")
+
+    from utils.metrics import start_metrics_server
+    start_metrics_server()
+
+    logger.info("训练服务已启动: http://%s:%d", args.host, args.port)
+    web.run_app(create_app({"host": args.host, "port": args.port}), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+# coding: utf-8
+"""
+训练轮次编排服务
+并发执行一轮对话中相互独立的步骤（保存用户消息、知识库检索、红/蓝方对话），
+并为知识库检索设置截止时间
+"""
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from config import TURN_CONFIG
+from services.red_assistant import chat_with_red
+from services.blue_assistant import chat_with_blue
+from services.knowledge_service import search_document
+from services.session_service import save_training_message
+from services.ws_stream import CancelToken
+from services.resilience import get_circuit_breaker, is_circuit_open
+from services.prefetch_service import get_prefetch_service
+from utils.tracing import span, submit_with_context, trace
+from utils.metrics import TURNS, mark_session_active, registry
+from utils.profiling import profile_slow
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+# 各角色的对话参数
+TARGETS = {
+    "red": {
+        "chat": chat_with_red,
+        "source": "红方魔鬼导师",
+        "retrieval_temperature": 0.8
+    },
+    "blue": {
+        "chat": chat_with_blue,
+        "source": "蓝方心理教练",
+        "retrieval_temperature": 0.7
+    }
+}
+
+
+def build_prompt_with_knowledge(kb_answer, user_input):
+    """将知识库检索结果拼接到用户问题前"""
+    return f"[知识库参考]\n{kb_answer}\n\n[用户问题]\n{user_input}"
+
+
+class TurnOrchestrator:
+    """训练轮次编排器"""
+
+    def __init__(self, config=None):
+        self.config = config or TURN_CONFIG
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.config["max_workers"],
+            thread_name_prefix="preplay-turn"
+        )
+        # 每个会话正在进行的轮次的取消令牌
+        self._active_turns = {}
+        self._lock = threading.Lock()
+
+    def cancel_session_turn(self, session_id):
+        """
+        取消会话正在进行的轮次（如用户离开页面或重新发送）
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            是否有轮次被取消
+        """
+        with self._lock:
+            token = self._active_turns.pop(session_id, None)
+        if token is None:
+            return False
+        token.cancel()
+        return True
+
+    def _begin_turn(self, session_id, cancel_token):
+        """登记新的轮次，同一会话上一轮未结束时先取消"""
+        with self._lock:
+            previous = self._active_turns.get(session_id)
+            self._active_turns[session_id] = cancel_token
+        if previous is not None and previous is not cancel_token:
+            previous.cancel()
+
+    def active_turn_count(self):
+        """正在进行的轮次数"""
+        with self._lock:
+            return len(self._active_turns)
+
+    def _end_turn(self, session_id, cancel_token):
+        with self._lock:
+            if self._active_turns.get(session_id) is cancel_token:
+                del self._active_turns[session_id]
+
+    def _child_token(self, parent):
+        """创建随父令牌一起取消的子令牌"""
+        child = CancelToken()
+        parent.add_callback(child.cancel)
+        return child
+
+    def _save_message(self, session_id, role, content, source, timestamp):
+        """保存消息，失败时只记录不中断对话"""
+        try:
+            with span("save_message", role=role, chars=len(content or "")):
+                return save_training_message(session_id, role, content, source, timestamp)
+        except Exception as e:
+            logger.exception("保存%s消息失败: %s", "用户" if role == "user" else "AI", e, extra={"session_id": session_id})
+            return None
+
+    def run_turn(self, target, session_id, user_input, api_history, file_ids=None, timestamp=None,
+                 speculative=None, retrieval_timeout=None, cancel_token=None, on_token=None):
+        """
+        执行一轮对话
+
+        保存用户消息与知识库检索并发进行；检索超过截止时间则放弃检索结果。
+        启用预取时，上一轮结束后已在后台预取的检索结果会直接复用，不再发起新的检索，
+        本轮结束后再以本轮回复为依据预取下一轮。
+        推测模式下，检索进行的同时先发起不带知识库上下文的对话，
+        检索及时返回时取消推测调用并改用带上下文的对话，否则直接使用推测结果。
+        同一会话发起新轮次或调用 cancel_session_turn 时，本轮的所有上游调用会被取消，
+        已收到的部分回答照常返回并保存。
+        传入 on_token 时逐段转发回答内容；采用推测结果或命中回复缓存时不会转发，
+        调用方应以返回的 response 为准。
+        每轮记录为一次 turn 追踪，包含消息保存、检索等待、对话及各上游调用的耗时；
+        启用性能剖析时，耗时超过阈值的轮次会按会话保存剖析结果。
+
+        Args:
+            target: 对话对象（"red" 或 "blue"）
+            session_id: 会话ID
+            user_input: 用户输入
+            api_history: 对话历史（API 格式）
+            file_ids: 知识库文件ID列表（可选）
+            timestamp: 用户消息的时间戳（可选，默认为保存时间；回答按完成时间保存）
+            speculative: 是否启用推测模式，默认取配置
+            retrieval_timeout: 检索截止时间（秒），默认取配置
+            cancel_token: 本轮的取消令牌（可选）
+            on_token: 每收到一段回答内容时的回调（可选）
+
+        Returns:
+            dict: response, sid, role, source, kb_used, kb_prefetched, kb_error, speculative_used, cancelled
+        """
+        spec = TARGETS[target]
+        if speculative is None:
+            speculative = self.config["speculative"]
+        if retrieval_timeout is None:
+            retrieval_timeout = self.config["retrieval_timeout"]
+
+        cancel_token = cancel_token or CancelToken()
+        mark_session_active(session_id)
+        self._begin_turn(session_id, cancel_token)
+        try:
+            with trace("turn", session_id=session_id, target=target, input_chars=len(user_input)) as root, \
+                    profile_slow("turn", session_id=session_id, target=target):
+                result = self._run_turn(
+                    spec, target, session_id, user_input, api_history, file_ids, timestamp,
+                    speculative, retrieval_timeout, cancel_token, on_token
+                )
+                root.set(
+                    history_messages=len(api_history or []),
+                    response_chars=len(result["response"] or ""),
+                    kb_used=result["kb_used"],
+                    kb_prefetched=result["kb_prefetched"],
+                    speculative_used=result["speculative_used"],
+                    cancelled=result["cancelled"]
+                )
+            TURNS.inc(target, "cancelled" if result["cancelled"] else "completed")
+            return result
+        except Exception:
+            TURNS.inc(target, "error")
+            raise
+        finally:
+            self._end_turn(session_id, cancel_token)
+
+    def _run_turn(self, spec, target, session_id, user_input, api_history, file_ids, timestamp,
+                  speculative, retrieval_timeout, cancel_token, on_token):
+        prefetch = get_prefetch_service()
+        save_future = submit_with_context(
+            self.executor,
+            self._save_message, session_id, "user", user_input, "", timestamp
+        )
+
+        kb_used = False
+        kb_prefetched = False
+        kb_error = None
+        speculative_used = False
+        prompt = user_input
+
+        if file_ids and is_circuit_open("chatdoc"):
+            # 知识库服务熔断中，直接跳过检索
+            kb_error = "知识库服务暂时不可用，已跳过检索"
+            with span("chat", kb=False):
+                response, sid = spec["chat"](prompt, api_history, cancel_token, on_token=on_token)
+        elif file_ids:
+            prefetched = prefetch.take(session_id, target, file_ids, spec["retrieval_temperature"], user_input)
+            if prefetched is not None:
+                # 复用上一轮结束后预取的检索
+                kb_prefetched = True
+                retrieval_token = prefetched.cancel_token
+                cancel_token.add_callback(retrieval_token.cancel)
+                retrieval_future = prefetched.future
+            else:
+                retrieval_token = self._child_token(cancel_token)
+                retrieval_future = submit_with_context(
+                    self.executor,
+                    search_document,
+                    file_ids,
+                    user_input,
+                    wiki_filter_score=0.83,
+                    temperature=spec["retrieval_temperature"],
+                    cancel_token=retrieval_token
+                )
+            speculative_future = None
+            if speculative:
+                speculative_token = self._child_token(cancel_token)
+                speculative_future = submit_with_context(
+                    self.executor, spec["chat"], user_input, api_history, speculative_token
+                )
+
+            try:
+                with span("retrieval_wait", prefetched=kb_prefetched) as current:
+                    kb_answer = retrieval_future.result(timeout=retrieval_timeout)
+                    current.set(kb_chars=len(kb_answer or ""))
+                if kb_answer:
+                    prompt = build_prompt_with_knowledge(kb_answer, user_input)
+                    kb_used = True
+            except FutureTimeoutError:
+                # 放弃检索，释放其占用的连接与线程；超过轮次期限同样计入知识库熔断失败次数
+                retrieval_token.cancel()
+                get_circuit_breaker("chatdoc").record_failure()
+                kb_error = f"知识库检索超过 {retrieval_timeout:g} 秒未返回"
+            except Exception as e:
+                kb_error = str(e)
+
+            if speculative_future is not None and not kb_used:
+                with span("chat", kb=False, speculative=True):
+                    response, sid = speculative_future.result()
+                speculative_used = True
+            else:
+                if speculative_future is not None:
+                    # 检索及时返回，取消推测调用
+                    speculative_token.cancel()
+                with span("chat", kb=kb_used):
+                    response, sid = spec["chat"](prompt, api_history, cancel_token, on_token=on_token)
+        else:
+            with span("chat", kb=False):
+                response, sid = spec["chat"](prompt, api_history, cancel_token, on_token=on_token)
+
+        save_future.result()
+        if response or not cancel_token.cancelled:
+            # 回答按完成时间保存，与用户消息的时间差即为回答耗时
+            self._save_message(session_id, "assistant", response, spec["source"], None)
+
+        if response and file_ids and not cancel_token.cancelled:
+            prefetch.schedule(session_id, target, response, file_ids, spec["retrieval_temperature"])
+
+        return {
+            "response": response,
+            "sid": sid,
+            "role": target,
+            "source": spec["source"],
+            "kb_used": kb_used,
+            "kb_prefetched": kb_prefetched and kb_used,
+            "kb_error": kb_error,
+            "speculative_used": speculative_used,
+            "cancelled": cancel_token.cancelled
+        }
+
+
+# 全局实例
+_turn_orchestrator = None
+
+
+def get_turn_orchestrator():
+    """获取轮次编排器实例（单例）"""
+    global _turn_orchestrator
+    if _turn_orchestrator is None:
+        _turn_orchestrator = TurnOrchestrator()
+    return _turn_orchestrator
+
+
+def _collect_active_turns():
+    if _turn_orchestrator is not None:
+        yield (), _turn_orchestrator.active_turn_count()
+
+
+registry.gauge("preplay_active_turns", "正在进行的训练轮次数", (), _collect_active_turns)
+
+
+def run_training_turn(target, session_id, user_input, api_history, file_ids=None, timestamp=None, on_token=None):
+    """执行一轮训练对话"""
+    orchestrator = get_turn_orchestrator()
+    return orchestrator.run_turn(target, session_id, user_input, api_history, file_ids, timestamp, on_token=on_token)
+
+
+def cancel_session_turn(session_id):
+    """取消会话正在进行的轮次"""
+    orchestrator = get_turn_orchestrator()
+    return orchestrator.cancel_session_turn(session_id)
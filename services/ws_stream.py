@@ -0,0 +1,227 @@
+# coding: utf-8
+"""
+WebSocket 流式调用
+红方、蓝方与知识库检索共用的流式收发逻辑，提供连接/首包/总时长截止时间与协作式取消
+"""
+import json
+import sys
+import threading
+import time
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from config import WS_TIMEOUT_CONFIG
+from utils.tracing import span
+from utils.metrics import record_upstream
+
+
+class StreamError(Exception):
+    """上游返回错误帧"""
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+
+class CancelToken:
+    """
+    协作式取消令牌
+
+    调用 cancel() 后，绑定在令牌上的回调（如关闭 WebSocket 连接）会立即执行，
+    之后再绑定的回调也会被立即调用。
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        """取消并触发所有回调"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks = list(self._callbacks)
+            self._callbacks.clear()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def wait(self, timeout=None):
+        """等待取消，返回是否已取消"""
+        return self._event.wait(timeout)
+
+    def add_callback(self, callback):
+        """绑定取消回调，已取消时立即执行"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        """解除绑定"""
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+def _remaining(deadline):
+    return max(deadline - time.monotonic(), 0.0)
+
+
+def stream_ws(url, payload, parse_message, timeouts=None, cancel_token=None, on_token=None, span_name="ws.stream"):
+    """
+    发送一次请求并读取流式响应，直到结束帧、截止时间或取消
+
+    调用过程记录为追踪阶段 span_name，附带状态、首包延迟、帧数、输出字数与请求/响应大小；
+    同时按服务（span_name 的第一段，如 red.stream 为 red）上报运行指标。
+
+    Args:
+        url: 已鉴权的 WebSocket 地址
+        payload: 请求体（dict）
+        parse_message: 解析单帧的函数，返回 (content, status, sid)，错误帧抛出 StreamError
+        timeouts: 截止时间配置 {"connect", "first_token", "total"}（秒），默认取 WS_TIMEOUT_CONFIG
+        cancel_token: 取消令牌（可选）
+        on_token: 每收到一段内容时的回调（可选）
+        span_name: 追踪阶段名称（可选）
+
+    Returns:
+        dict: text（已收到的内容，超时/取消时为部分回答）, sid,
+              status（completed/timeout/cancelled/error）, error, code（错误帧的错误码）,
+              ttft, elapsed, frames（收到的帧数）, request_bytes, response_bytes
+    """
+    with span(span_name) as current:
+        result = _stream_ws(url, payload, parse_message, timeouts, cancel_token, on_token)
+        current.set(
+            status=result["status"],
+            ttft_ms=result["ttft"] * 1000 if result["ttft"] is not None else None,
+            frames=result["frames"],
+            chars=len(result["text"]),
+            request_bytes=result["request_bytes"],
+            response_bytes=result["response_bytes"]
+        )
+    record_upstream(span_name.split(".")[0], result["status"], result["elapsed"], result["ttft"])
+    return result
+
+
+def _stream_ws(url, payload, parse_message, timeouts, cancel_token, on_token):
+    timeouts = {**WS_TIMEOUT_CONFIG, **(timeouts or {})}
+    start = time.monotonic()
+    total_deadline = start + timeouts["total"]
+    first_token_deadline = start + timeouts["first_token"]
+
+    result = {
+        "text": "",
+        "sid": "",
+        "status": "completed",
+        "error": None,
+        "code": None,
+        "ttft": None,
+        "elapsed": 0.0,
+        "frames": 0,
+        "request_bytes": 0,
+        "response_bytes": 0
+    }
+    pieces = []
+
+    def finish(status=None, error=None):
+        if status:
+            result["status"] = status
+            result["error"] = error
+        result["text"] = "".join(pieces)
+        result["elapsed"] = time.monotonic() - start
+        return result
+
+    if cancel_token is not None and cancel_token.cancelled:
+        return finish("cancelled", "请求已取消")
+
+    # websocket-client 只在首次发起流式调用时导入
+    import ssl
+    import websocket
+
+    try:
+        ws = websocket.create_connection(
+            url,
+            timeout=min(timeouts["connect"], _remaining(total_deadline)),
+            sslopt={"cert_reqs": ssl.CERT_NONE}
+        )
+    except websocket.WebSocketTimeoutException:
+        return finish("timeout", f"连接超过 {timeouts['connect']:g} 秒未建立")
+    except Exception as e:
+        return finish("error", f"连接失败: {str(e)}")
+
+    abort = ws.abort
+    if cancel_token is not None:
+        cancel_token.add_callback(abort)
+
+    try:
+        data = json.dumps(payload)
+        result["request_bytes"] = len(data.encode("utf-8"))
+        ws.send(data)
+
+        while True:
+            if cancel_token is not None and cancel_token.cancelled:
+                return finish("cancelled", "请求已取消")
+
+            if result["ttft"] is None:
+                deadline = min(first_token_deadline, total_deadline)
+            else:
+                deadline = total_deadline
+            remaining = _remaining(deadline)
+            if remaining <= 0:
+                if result["ttft"] is None and deadline == first_token_deadline:
+                    return finish("timeout", f"首个回复超过 {timeouts['first_token']:g} 秒未到达")
+                return finish("timeout", f"回复超过 {timeouts['total']:g} 秒未完成")
+
+            ws.settimeout(remaining)
+            try:
+                message = ws.recv()
+            except websocket.WebSocketTimeoutException:
+                continue
+
+            if not message:
+                # 对端关闭连接
+                if cancel_token is not None and cancel_token.cancelled:
+                    return finish("cancelled", "请求已取消")
+                return finish("error", "连接在回复完成前关闭")
+
+            result["frames"] += 1
+            result["response_bytes"] += len(message) if isinstance(message, bytes) else len(message.encode("utf-8"))
+            content, status, sid = parse_message(message)
+            if sid:
+                result["sid"] = sid
+            if content:
+                if result["ttft"] is None:
+                    result["ttft"] = time.monotonic() - start
+                pieces.append(content)
+                if on_token is not None:
+                    on_token(content)
+
+            if status == 2:
+                return finish()
+    except StreamError as e:
+        result["code"] = e.code
+        return finish("error", str(e))
+    except Exception as e:
+        if cancel_token is not None and cancel_token.cancelled:
+            return finish("cancelled", "请求已取消")
+        return finish("error", str(e))
+    finally:
+        if cancel_token is not None:
+            cancel_token.remove_callback(abort)
+        try:
+            ws.close()
+        except Exception:
+            pass
@@ -0,0 +1,157 @@
+# coding: utf-8
+"""
+文档解析缓存与大文档分块的测试
+"""
+import io
+import os
+
+import pytest
+
+from utils import file_handler
+from utils.file_handler import ParsedDocumentCache, iter_text_chunks, parse_uploaded_file_with_meta
+
+
+class NamedBytesIO(io.BytesIO):
+    """模拟 Streamlit 上传的文件对象"""
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = ParsedDocumentCache(str(tmp_path / "parsed"), 1024 * 1024)
+    monkeypatch.setattr(file_handler, "get_parse_cache", lambda: cache)
+    return cache
+
+
+def _chunks(text, chunk_bytes, block_size=None, name="doc.txt"):
+    return list(iter_text_chunks(NamedBytesIO(text.encode("utf-8"), name), chunk_bytes, block_size))
+
+
+# ============================================
+# 解析缓存
+# ============================================
+
+def test_parse_cache_hit_by_content(cache):
+    first = parse_uploaded_file_with_meta(NamedBytesIO("汇报材料".encode("utf-8"), "a.txt"))
+    second = parse_uploaded_file_with_meta(NamedBytesIO("汇报材料".encode("utf-8"), "a.txt"))
+
+    assert not first["cached"]
+    assert second["cached"]
+    assert second["text"] == "汇报材料"
+
+
+def test_parse_cache_hit_uses_current_file_name_and_size(cache):
+    parse_uploaded_file_with_meta(NamedBytesIO("汇报材料".encode("utf-8"), "a.txt"))
+    renamed = NamedBytesIO("汇报材料".encode("utf-8"), "b.txt")
+    renamed.size = 999
+
+    result = parse_uploaded_file_with_meta(renamed)
+
+    assert result["cached"]
+    assert result["metadata"]["file_name"] == "b.txt"
+    assert result["metadata"]["file_size"] == 999
+    # 缓存中的元数据不受本次上传影响
+    assert parse_uploaded_file_with_meta(NamedBytesIO("汇报材料".encode("utf-8"), "a.txt"))["metadata"]["file_name"] == "a.txt"
+
+
+def test_parse_cache_key_includes_file_type(cache):
+    parse_uploaded_file_with_meta(NamedBytesIO(b"# title", "a.txt"))
+
+    assert not parse_uploaded_file_with_meta(NamedBytesIO(b"# title", "a.md"))["cached"]
+
+
+def test_parse_empty_file(cache):
+    first = parse_uploaded_file_with_meta(NamedBytesIO(b"", "empty.txt"))
+    second = parse_uploaded_file_with_meta(NamedBytesIO(b"", "empty.txt"))
+
+    assert first["text"] == ""
+    assert first["metadata"]["char_count"] == 0
+    assert second["cached"] and second["text"] == ""
+
+
+def test_parse_unsupported_type(cache):
+    with pytest.raises(ValueError):
+        parse_uploaded_file_with_meta(NamedBytesIO(b"x", "a.exe"))
+
+
+def test_extract_text_from_path_uses_cache(cache, tmp_path):
+    path = tmp_path / "local.txt"
+    path.write_text("本地副本", encoding="utf-8")
+
+    assert file_handler.extract_text_from_path(str(path)) == "本地副本"
+    assert parse_uploaded_file_with_meta(NamedBytesIO("本地副本".encode("utf-8"), "up.txt"))["cached"]
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = ParsedDocumentCache(str(tmp_path), 600)
+    cache.put("old", "a" * 200, {})
+    cache.put("new", "b" * 200, {})
+    os.utime(tmp_path / "old.json", (1, 1))
+    cache.put("newest", "c" * 200, {})
+
+    assert cache.get("old") is None
+    assert cache.get("newest")["text"] == "c" * 200
+
+
+def test_cache_ignores_corrupt_entry(tmp_path):
+    cache = ParsedDocumentCache(str(tmp_path), 1024)
+    (tmp_path / "broken.json").write_text("{not json", encoding="utf-8")
+
+    assert cache.get("broken") is None
+
+
+# ============================================
+# 大文档分块
+# ============================================
+
+def test_chunks_empty_file():
+    assert _chunks("", 100) == []
+
+
+def test_chunks_respect_size_and_line_boundaries():
+    text = "".join(f"第{i}行内容\n" for i in range(50))
+
+    chunks = _chunks(text, 64)
+
+    assert "".join(chunks) == text
+    assert all(len(chunk.encode("utf-8")) <= 64 for chunk in chunks)
+    assert all(chunk.endswith("\n") for chunk in chunks)
+
+
+def test_chunks_split_line_longer_than_chunk_bytes():
+    long_line = "长" * 100
+    text = "开头\n" + long_line + "\n结尾\n"
+
+    chunks = _chunks(text, 30)
+
+    assert "".join(chunks) == text
+    assert all(len(chunk.encode("utf-8")) <= 30 for chunk in chunks)
+    # 超长行之前的内容单独成块，不与超长行的片段合并
+    assert chunks[0] == "开头\n"
+    assert chunks[-1] == "结尾\n"
+
+
+def test_chunks_multibyte_characters_across_read_blocks():
+    text = "中文内容跨越读取块边界\n" * 10
+
+    chunks = _chunks(text, 50, block_size=5)
+
+    assert "".join(chunks) == text
+
+
+def test_chunks_text_without_newline():
+    text = "无换行" * 40
+
+    chunks = _chunks(text, 32, block_size=16)
+
+    assert "".join(chunks) == text
+    assert all(len(chunk.encode("utf-8")) <= 32 for chunk in chunks)
+
+
+def test_chunks_unsupported_type():
+    with pytest.raises(ValueError):
+        _chunks("x", 10, name="doc.exe")
@@ -0,0 +1,137 @@
+# coding: utf-8
+"""
+对冲请求的测试
+"""
+import threading
+import time
+
+from services.hedging import HedgeBudget, Hedger, LatencyTracker
+from services.ws_stream import CancelToken
+
+
+def _config(**overrides):
+    config = {
+        "enabled": True,
+        "percentile": 95,
+        "min_delay": 0.05,
+        "default_delay": 0.05,
+        "min_samples": 1000,
+        "max_extra_ratio": 1.0
+    }
+    config.update(overrides)
+    return config
+
+
+def _result(text, ttft=None, status="completed"):
+    return {"status": status, "text": text, "ttft": ttft}
+
+
+def test_latency_tracker_percentile():
+    tracker = LatencyTracker(window=101)
+    assert tracker.percentile(95) is None
+
+    for i in range(101):
+        tracker.record(i / 100)
+
+    assert tracker.percentile(50) == 0.5
+    assert tracker.percentile(100) == 1.0
+
+
+def test_hedge_budget_caps_extra_requests():
+    budget = HedgeBudget(0.5, max_credit=2.0)
+
+    assert not budget.try_spend()
+    budget.on_request()
+    budget.on_request()
+    assert budget.try_spend()
+    assert not budget.try_spend()
+
+    for _ in range(10):
+        budget.on_request()
+    assert budget.credit == 2.0
+
+
+def test_hedge_delay_uses_default_until_enough_samples():
+    hedger = Hedger("red", _config(default_delay=3, min_samples=2, min_delay=0.1))
+    assert hedger.hedge_delay() == 3
+
+    hedger.tracker.record(0.01)
+    hedger.tracker.record(0.02)
+    assert hedger.hedge_delay() == 0.1
+
+
+def test_fast_primary_is_not_hedged():
+    hedger = Hedger("red", _config())
+
+    def call(token, on_token):
+        on_token("回答")
+        return _result("回答", ttft=0.001)
+
+    result = hedger.call(call)
+
+    assert result["text"] == "回答"
+    assert not result["hedged"]
+    assert hedger.hedges_sent == 0
+
+
+def test_primary_failure_returns_without_waiting_hedge_delay():
+    hedger = Hedger("red", _config(default_delay=5))
+
+    start = time.monotonic()
+    result = hedger.call(lambda token, on_token: _result("", status="error"))
+
+    assert time.monotonic() - start < 1
+    assert result["status"] == "error"
+    assert not result["hedged"]
+
+
+def test_slow_primary_is_hedged_and_hedge_wins():
+    hedger = Hedger("red", _config())
+    calls = []
+    tokens = {}
+
+    def call(token, on_token):
+        index = len(calls)
+        calls.append(index)
+        tokens[index] = token
+        if index == 0:
+            # 主请求卡住，直到被取消
+            token.wait(2)
+            return _result("", status="cancelled")
+        on_token("对冲")
+        return _result("对冲", ttft=0.01)
+
+    streamed = []
+    result = hedger.call(call, on_token=streamed.append)
+
+    assert result["hedged"] and result["hedge_won"]
+    assert result["text"] == "对冲"
+    assert streamed == ["对冲"]
+    assert tokens[0].cancelled
+
+
+def test_caller_cancel_token_callbacks_are_removed():
+    hedger = Hedger("red", _config())
+    token = CancelToken()
+
+    for _ in range(3):
+        hedger.call(lambda t, on_token: _result("回答", ttft=0.001), cancel_token=token)
+
+    assert token._callbacks == []
+
+
+def test_caller_cancel_propagates_to_call():
+    hedger = Hedger("red", _config(default_delay=5))
+    token = CancelToken()
+    started = threading.Event()
+
+    def call(call_token, on_token):
+        started.set()
+        call_token.wait(2)
+        return _result("", status="cancelled" if call_token.cancelled else "timeout")
+
+    threading.Timer(0.05, token.cancel).start()
+    result = hedger.call(call, cancel_token=token)
+
+    assert started.is_set()
+    assert result["status"] == "cancelled"
@@ -0,0 +1,179 @@
+# coding: utf-8
+"""
+令牌桶与优先级请求调度的测试
+"""
+import threading
+import time
+
+import pytest
+
+from services import rate_limiter
+from services.rate_limiter import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    EndpointScheduler,
+    RateLimitExceeded,
+    TokenBucket
+)
+from services.resilience import UpstreamError
+from services.ws_stream import CancelToken
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", clock)
+    return clock
+
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("等待超时")
+        time.sleep(0.005)
+
+
+# ============================================
+# 令牌桶
+# ============================================
+
+def test_bucket_allows_burst_then_reports_wait(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+
+    assert [bucket.try_take() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.try_take() == pytest.approx(0.5)
+
+
+def test_bucket_refills_over_time(clock):
+    bucket = TokenBucket(rate=2, capacity=2)
+    bucket.try_take()
+    bucket.try_take()
+
+    clock.now += 0.25
+    assert bucket.try_take() == pytest.approx(0.25)
+    clock.now += 0.25
+    assert bucket.try_take() == 0.0
+
+
+def test_bucket_never_exceeds_capacity(clock):
+    bucket = TokenBucket(rate=10, capacity=2)
+
+    clock.now += 60
+    assert [bucket.try_take() for _ in range(2)] == [0.0, 0.0]
+    assert bucket.try_take() > 0
+
+
+# ============================================
+# 调度器
+# ============================================
+
+def test_scheduler_limits_concurrency():
+    scheduler = EndpointScheduler("red", qps=1000, burst=10, max_concurrency=1, max_wait=0.1)
+    scheduler.acquire()
+
+    with pytest.raises(RateLimitExceeded):
+        scheduler.acquire()
+    assert scheduler.queue_depth() == 0
+
+    scheduler.release(0.01)
+    scheduler.acquire()
+    assert scheduler.active == 1
+
+
+def test_scheduler_serves_interactive_before_background():
+    scheduler = EndpointScheduler("red", qps=1000, burst=10, max_concurrency=1, max_wait=5)
+    scheduler.acquire()
+    order = []
+
+    def worker(name, priority):
+        scheduler.acquire(priority)
+        order.append(name)
+        scheduler.release(0.01)
+
+    background = threading.Thread(target=worker, args=("background", PRIORITY_BACKGROUND))
+    background.start()
+    _wait_for(lambda: scheduler.queue_depth() == 1)
+    interactive = threading.Thread(target=worker, args=("interactive", PRIORITY_INTERACTIVE))
+    interactive.start()
+    _wait_for(lambda: scheduler.queue_depth() == 2)
+
+    scheduler.release(0.01)
+    background.join(2)
+    interactive.join(2)
+    assert order == ["interactive", "background"]
+
+
+def test_scheduler_same_priority_is_fifo():
+    scheduler = EndpointScheduler("red", qps=1000, burst=10, max_concurrency=1, max_wait=5)
+    scheduler.acquire()
+    order = []
+    threads = []
+
+    for i in range(3):
+        def worker(i=i):
+            scheduler.acquire(PRIORITY_BACKGROUND)
+            order.append(i)
+            scheduler.release(0.01)
+        thread = threading.Thread(target=worker)
+        thread.start()
+        threads.append(thread)
+        _wait_for(lambda: scheduler.queue_depth() == i + 1)
+
+    scheduler.release(0.01)
+    for thread in threads:
+        thread.join(2)
+    assert order == [0, 1, 2]
+
+
+def test_scheduler_cancel_while_queued():
+    scheduler = EndpointScheduler("red", qps=1000, burst=10, max_concurrency=1, max_wait=5)
+    scheduler.acquire()
+    token = CancelToken()
+    errors = []
+
+    def worker():
+        try:
+            scheduler.acquire(cancel_token=token)
+        except UpstreamError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    _wait_for(lambda: scheduler.queue_depth() == 1)
+    token.cancel()
+    thread.join(2)
+
+    assert len(errors) == 1 and not isinstance(errors[0], RateLimitExceeded)
+    assert scheduler.queue_depth() == 0
+
+
+def test_scheduler_detaches_cancel_callback():
+    scheduler = EndpointScheduler("red", qps=1000, burst=10, max_concurrency=1, max_wait=5)
+    token = CancelToken()
+
+    scheduler.acquire(cancel_token=token)
+
+    # 调用方的令牌可能跨多次请求复用，获得配额后不再保留回调
+    assert token._callbacks == []
+
+
+def test_expected_wait_counts_requests_ahead(clock):
+    scheduler = EndpointScheduler("red", qps=2, burst=1, max_concurrency=10, max_wait=5)
+
+    assert scheduler.expected_wait() == 0.0
+    scheduler.bucket.try_take()
+    assert scheduler.expected_wait() == pytest.approx(0.5)
+    scheduler._queue.append([PRIORITY_INTERACTIVE, 0])
+    assert scheduler.expected_wait(PRIORITY_INTERACTIVE) == pytest.approx(1.0)
+    # 优先级更高的请求不用等后台请求
+    scheduler._queue[0][0] = PRIORITY_BACKGROUND
+    assert scheduler.expected_wait(PRIORITY_INTERACTIVE) == pytest.approx(0.5)
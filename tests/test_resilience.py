@@ -0,0 +1,196 @@
+# coding: utf-8
+"""
+熔断器与带重试的上游调用的测试
+"""
+import pytest
+
+from services import resilience
+from services.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    UpstreamError,
+    backoff_delay,
+    call_with_resilience,
+    get_circuit_breaker,
+    raise_for_stream_result
+)
+from services.ws_stream import CancelToken
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(resilience.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture(autouse=True)
+def isolated_breakers(monkeypatch):
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setattr(resilience, "backoff_delay", lambda attempt: 0)
+
+
+def _open_breaker(clock, threshold=2, reset_timeout=10):
+    breaker = CircuitBreaker("test", threshold, reset_timeout)
+    for _ in range(threshold):
+        breaker.record_failure()
+    return breaker
+
+
+# ============================================
+# 熔断器
+# ============================================
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker("test", 3, 10)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.allow_request()
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.is_open()
+    assert not breaker.allow_request()
+
+
+def test_breaker_success_resets_failures(clock):
+    breaker = CircuitBreaker("test", 2, 10)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+
+    assert breaker.state == "closed"
+
+
+def test_breaker_half_open_allows_single_probe(clock):
+    breaker = _open_breaker(clock)
+
+    clock.now += 10
+    assert not breaker.is_open()
+    assert breaker.allow_request()
+    assert breaker.state == "half_open"
+    assert not breaker.allow_request()
+
+
+def test_breaker_half_open_probe_success_closes(clock):
+    breaker = _open_breaker(clock)
+    clock.now += 10
+    breaker.allow_request()
+
+    breaker.record_success()
+
+    assert breaker.state == "closed"
+    assert breaker.allow_request() and breaker.allow_request()
+
+
+def test_breaker_half_open_probe_failure_reopens(clock):
+    breaker = _open_breaker(clock, threshold=5)
+    clock.now += 10
+    breaker.allow_request()
+
+    breaker.record_failure()
+
+    assert breaker.state == "open"
+    assert not breaker.allow_request()
+    clock.now += 10
+    assert breaker.allow_request()
+
+
+def test_breaker_release_frees_probe_without_closing(clock):
+    breaker = _open_breaker(clock)
+    clock.now += 10
+    breaker.allow_request()
+
+    breaker.release()
+
+    assert breaker.state == "half_open"
+    assert breaker.allow_request()
+
+
+def test_backoff_delay_is_bounded():
+    for attempt in range(10):
+        assert 0 <= backoff_delay(attempt, base_delay=0.5, max_delay=4) <= min(4, 0.5 * 2 ** attempt)
+
+
+# ============================================
+# 带重试的调用
+# ============================================
+
+def test_call_retries_transient_errors():
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise UpstreamError("busy", transient=True)
+        return "ok"
+
+    assert call_with_resilience("red", flaky, max_retries=2) == "ok"
+    assert len(calls) == 3
+    assert get_circuit_breaker("red").failures == 0
+
+
+def test_call_does_not_retry_permanent_errors():
+    calls = []
+
+    def broken():
+        calls.append(1)
+        raise UpstreamError("bad request", transient=False)
+
+    with pytest.raises(UpstreamError):
+        call_with_resilience("red", broken, max_retries=3)
+    assert len(calls) == 1
+    assert get_circuit_breaker("red").failures == 0
+
+
+def test_call_rejected_when_circuit_open(clock):
+    breaker = get_circuit_breaker("red")
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+    with pytest.raises(CircuitOpenError):
+        call_with_resilience("red", lambda: "ok")
+
+
+def test_cancelled_stream_result_does_not_reset_breaker():
+    breaker = get_circuit_breaker("red")
+    breaker.record_failure()
+
+    call_with_resilience("red", lambda: {"status": "cancelled", "text": ""})
+    call_with_resilience("red", lambda: {"status": "completed", "text": ""})
+    assert breaker.failures == 1
+
+    call_with_resilience("red", lambda: {"status": "completed", "text": "回答"})
+    assert breaker.failures == 0
+
+
+def test_cancelled_token_does_not_reset_breaker():
+    breaker = get_circuit_breaker("red")
+    breaker.record_failure()
+    token = CancelToken()
+    token.cancel()
+
+    call_with_resilience("red", lambda: "partial", cancel_token=token)
+
+    assert breaker.failures == 1
+
+
+def test_raise_for_stream_result():
+    with pytest.raises(UpstreamError) as timeout:
+        raise_for_stream_result("red", {"status": "timeout", "text": "", "error": "超时"})
+    assert timeout.value.transient
+
+    with pytest.raises(UpstreamError) as permanent:
+        raise_for_stream_result("red", {"status": "error", "text": "", "error": "参数错误", "code": 10001})
+    assert not permanent.value.transient
+
+    partial = {"status": "error", "text": "部分回答", "error": "断开"}
+    assert raise_for_stream_result("red", partial) is partial
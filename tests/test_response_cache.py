@@ -0,0 +1,93 @@
+# coding: utf-8
+"""
+助手回复缓存的测试
+"""
+import pytest
+
+from services import response_cache
+from services.response_cache import ResponseCache, make_cache_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(response_cache.time, "monotonic", clock)
+    return clock
+
+
+def _params(messages, temperature=0.5, domain="generalv3.5"):
+    return {
+        "parameter": {"chat": {"domain": domain, "temperature": temperature}},
+        "payload": {"message": {"text": messages}}
+    }
+
+
+def test_key_depends_on_endpoint_model_temperature_and_messages():
+    messages = [{"role": "user", "content": "你好"}]
+    base = make_cache_key("wss://red", _params(messages))
+
+    assert make_cache_key("wss://red", _params([dict(m) for m in messages])) == base
+    assert make_cache_key("wss://blue", _params(messages)) != base
+    assert make_cache_key("wss://red", _params(messages, temperature=0.9)) != base
+    assert make_cache_key("wss://red", _params(messages, domain="4.0Ultra")) != base
+    assert make_cache_key("wss://red", _params(messages + [{"role": "user", "content": "继续"}])) != base
+
+
+def test_get_and_put(clock):
+    cache = ResponseCache(max_entries=10, ttl=60)
+
+    assert cache.get("k") is None
+    cache.put("k", "回答")
+
+    assert cache.get("k") == "回答"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_entry_expires_after_ttl(clock):
+    cache = ResponseCache(max_entries=10, ttl=60)
+    cache.put("k", "回答")
+
+    clock.now += 60
+    assert cache.get("k") == "回答"
+    clock.now += 0.001
+    assert cache.get("k") is None
+    assert len(cache) == 0
+
+
+def test_put_refreshes_expiry(clock):
+    cache = ResponseCache(max_entries=10, ttl=60)
+    cache.put("k", "旧")
+    clock.now += 50
+    cache.put("k", "新")
+    clock.now += 50
+
+    assert cache.get("k") == "新"
+
+
+def test_evicts_least_recently_used(clock):
+    cache = ResponseCache(max_entries=2, ttl=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_clear(clock):
+    cache = ResponseCache(max_entries=2, ttl=60)
+    cache.put("a", 1)
+    cache.clear()
+
+    assert len(cache) == 0
+    assert cache.get("a") is None
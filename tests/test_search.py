@@ -0,0 +1,135 @@
+# coding: utf-8
+"""
+训练记录全文搜索的测试（FTS5 trigram 索引与短词 LIKE 回退）
+"""
+import pytest
+
+from database import DatabaseManager
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DatabaseManager(str(tmp_path / "search.db"))
+    yield db
+    db.close()
+
+
+@pytest.fixture(params=["fts", "like"])
+def search_db(request, db):
+    """分别在全文索引与 LIKE 回退下运行"""
+    if request.param == "fts" and not db.fts_enabled:
+        pytest.skip("SQLite 不支持 FTS5 trigram 分词")
+    if request.param == "like":
+        db.fts_enabled = False
+    return db
+
+
+def _session(db, session_id, *contents):
+    db.create_session(session_id)
+    for i, content in enumerate(contents):
+        db.add_message(session_id, "user" if i % 2 == 0 else "assistant", content)
+
+
+def _ids(results):
+    return [session["session_id"] for session in results]
+
+
+def test_search_terms_split_by_length(db):
+    if not db.fts_enabled:
+        pytest.skip("SQLite 不支持 FTS5 trigram 分词")
+
+    match, short_terms = db._search_terms('成本降低 A "引号" 数据')
+
+    assert match == '"成本降低" AND """引号"""'
+    assert short_terms == ["A", "数据"]
+
+
+def test_search_terms_without_fts(db):
+    db.fts_enabled = False
+
+    assert db._search_terms("成本降低 数据") == (None, ["成本降低", "数据"])
+
+
+def test_search_long_term(search_db):
+    _session(search_db, "s1", "我们的方案成本降低了30%", "成本降低的数据来源是什么？")
+    _session(search_db, "s2", "团队有十个人")
+
+    results = search_db.search_messages("成本降低")
+
+    assert _ids(results) == ["s1"]
+    assert results[0]["hits"] == 2
+    assert len(results[0]["messages"]) == 2
+
+
+def test_search_two_character_term(search_db):
+    _session(search_db, "s1", "数据来源于第三方")
+    _session(search_db, "s2", "没有相关内容")
+
+    results = search_db.search_messages("数据")
+
+    assert _ids(results) == ["s1"]
+    # 短词走 LIKE 匹配，没有摘要
+    assert results[0]["messages"][0]["snippet"] is None
+
+
+def test_search_single_character_term(search_db):
+    _session(search_db, "s1", "营收增长12%")
+    _session(search_db, "s2", "成本下降")
+
+    assert _ids(search_db.search_messages("%")) == ["s1"]
+    assert _ids(search_db.search_messages("营")) == ["s1"]
+
+
+def test_search_like_wildcards_are_literal(search_db):
+    _session(search_db, "s1", "a_b")
+    _session(search_db, "s2", "axb")
+
+    assert _ids(search_db.search_messages("_")) == ["s1"]
+
+
+def test_search_mixed_terms_must_match_same_message(search_db):
+    _session(search_db, "s1", "成本降低的数据", "其他内容")
+    _session(search_db, "s2", "成本降低了", "数据在这里")
+
+    assert _ids(search_db.search_messages("成本降低 数据")) == ["s1"]
+
+
+def test_search_snippet_highlights_match(db):
+    if not db.fts_enabled:
+        pytest.skip("SQLite 不支持 FTS5 trigram 分词")
+    _session(db, "s1", "我们的方案相比竞品成本降低了30%")
+
+    snippet = db.search_messages("成本降低")[0]["messages"][0]["snippet"]
+
+    assert "**成本降低**" in snippet
+
+
+def test_search_limits(search_db):
+    for i in range(5):
+        _session(search_db, f"s{i}", *[f"第{n}条 关键内容" for n in range(4)])
+
+    results = search_db.search_messages("关键内容", session_limit=3, messages_per_session=2)
+
+    assert len(results) == 3
+    assert all(session["hits"] == 4 and len(session["messages"]) == 2 for session in results)
+
+
+def test_search_empty_query(search_db):
+    _session(search_db, "s1", "内容")
+
+    assert search_db.search_messages("   ") == []
+
+
+def test_search_index_follows_updates_and_deletes(db):
+    if not db.fts_enabled:
+        pytest.skip("SQLite 不支持 FTS5 trigram 分词")
+    _session(db, "s1", "原始内容很长")
+    conn = db.connect()
+    conn.execute("UPDATE messages SET content = '修改后的内容' WHERE session_id = 's1'")
+    conn.commit()
+
+    assert db.search_messages("原始内容") == []
+    assert _ids(db.search_messages("修改后")) == ["s1"]
+
+    db.delete_session("s1")
+    assert db.search_messages("修改后") == []
@@ -0,0 +1,5 @@
+# coding: utf-8
+"""
+开发工具
+本地模拟服务、基准测试与压测脚本
+"""
@@ -0,0 +1,296 @@
+# coding: utf-8
+"""
+基准测试
+在本地模拟服务与临时数据库上测量典型操作的耗时，输出 p50/p95/p99 与吞吐量，
+结果保存为 JSON，可与之前的结果对比以发现性能回退
+
+用法:
+    python -m tools.benchmark [--iterations 20] [--output bench.json] [--compare baseline.json]
+
+使用模拟服务时默认关闭客户端限流（否则测到的是配额等待而非处理耗时），--rate-limit 开启
+
+场景:
+    red_turn_retrieval  带知识库检索的红方一轮对话
+    blue_turn_history   带 N 条历史消息的蓝方一轮对话
+    session_resume      通过训练引擎恢复含 N 条消息的会话
+    history_list        列出 N 个历史会话
+    report_generation   为 N 轮对话生成报告
+    parse_pdf           解析大 PDF
+    parse_docx          解析大 DOCX
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from tools.common import enable_mock_env, start_offline_backend, summarize
+
+
+SCENARIOS = [
+    "red_turn_retrieval",
+    "blue_turn_history",
+    "session_resume",
+    "history_list",
+    "report_generation",
+    "parse_pdf",
+    "parse_docx"
+]
+
+
+class NamedBytesIO(io.BytesIO):
+    """带文件名的内存文件，模拟 Streamlit 上传的文件对象"""
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+
+def make_pdf(pages, lines_per_page=40):
+    """生成指定页数的纯文本 PDF"""
+    objects = []
+    page_ids = []
+    font_id = 3
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    objects.append(None)  # 页面树，稍后填充
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    for page in range(pages):
+        lines = [f"BT /F1 10 Tf 40 {800 - i * 18} Td (Page {page + 1} line {i + 1}: "
+                 f"revenue grew 12 percent year over year) Tj ET" for i in range(lines_per_page)]
+        stream = "\n".join(lines).encode("latin-1")
+        objects.append(b"<< /Length " + str(len(stream)).encode() + b" >>\nstream\n" + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {content_id} 0 R >>".encode()
+        )
+        page_ids.append(len(objects))
+
+    kids = " ".join(f"{pid} 0 R" for pid in page_ids)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode()
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for index, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{index} 0 obj\n".encode() + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+def make_docx(paragraphs):
+    """生成指定段落数的 DOCX"""
+    from docx import Document
+
+    doc = Document()
+    for i in range(paragraphs):
+        doc.add_paragraph(f"第{i + 1}段：本季度营收同比增长12%，主要来自新用户转化率的提升与客单价的上涨。")
+    out = io.BytesIO()
+    doc.save(out)
+    return out.getvalue()
+
+
+def make_conversation(turns):
+    """生成 N 轮（用户 + 红方）对话"""
+    conversation = []
+    for i in range(turns):
+        conversation.append({"role": "user", "content": f"第{i + 1}轮回答：我们的方案相比竞品成本降低了30%。"})
+        conversation.append({"role": "assistant", "content": f"第{i + 1}轮追问：成本降低的数据来源是什么？样本量多大？"})
+    return conversation
+
+
+def run_scenario(name, func, iterations, warmup=1):
+    """
+    重复执行一个场景并汇总耗时
+
+    Args:
+        name: 场景名称
+        func: 无参函数，执行一次场景
+        iterations: 计时次数
+        warmup: 预热次数（不计时）
+
+    Returns:
+        dict: 见 summarize
+    """
+    for _ in range(warmup):
+        func()
+
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        try:
+            func()
+            latencies.append(time.perf_counter() - t0)
+        except Exception as e:
+            errors += 1
+            print(f"[{name}] 执行失败: {str(e)}")
+    elapsed = time.perf_counter() - start
+
+    result = summarize(latencies, elapsed, errors)
+    result["iterations"] = iterations
+    return result
+
+
+def build_scenarios(args):
+    """准备各场景的数据，返回 {场景名: 无参函数}"""
+    from services.session_service import get_session_service
+    from services.knowledge_service import get_knowledge_service
+    from services.turn_orchestrator import run_training_turn
+    from services.report_service import generate_report
+    from services.training_engine import get_training_engine
+    from utils.file_handler import extract_text_from_pdf, extract_text_from_docx
+
+    sessions = get_session_service()
+    scenarios = {}
+
+    if "red_turn_retrieval" in args.scenarios:
+        upload = get_knowledge_service().upload_document(str(project_root / "汇报材料.txt"))
+        if not upload["success"]:
+            raise RuntimeError(f"准备知识库文件失败: {upload.get('error')}")
+        file_ids = [upload["file_id"]]
+        session_id = sessions.create_session()
+        scenarios["red_turn_retrieval"] = lambda: run_training_turn(
+            "red", session_id, "我们的方案相比竞品成本降低了30%。", [], file_ids
+        )
+
+    if "blue_turn_history" in args.scenarios:
+        history = []
+        for i in range(args.history // 2):
+            history.append({"role": "user", "content": f"第{i + 1}轮：我有点紧张，不知道怎么回答成本问题。"})
+            history.append({"role": "assistant", "content": f"第{i + 1}轮建议：先肯定问题，再给出数据来源。"})
+        session_id = sessions.create_session()
+        scenarios["blue_turn_history"] = lambda: run_training_turn(
+            "blue", session_id, "评委追问数据来源时我该怎么说？", history
+        )
+
+    if "session_resume" in args.scenarios:
+        session_id = sessions.create_session()
+        for message in make_conversation(args.messages // 2):
+            sessions.save_message(session_id, message["role"], message["content"])
+
+        engine = get_training_engine()
+        scenarios["session_resume"] = lambda: engine.resume_session(session_id)
+
+    if "history_list" in args.scenarios:
+        for _ in range(args.sessions):
+            sessions.create_session()
+        scenarios["history_list"] = lambda: sessions.list_sessions(limit=args.sessions)
+
+    if "report_generation" in args.scenarios:
+        conversation = make_conversation(args.turns)
+        scenarios["report_generation"] = lambda: generate_report(conversation)
+
+    if "parse_pdf" in args.scenarios:
+        pdf = make_pdf(args.pdf_pages)
+        scenarios["parse_pdf"] = lambda: extract_text_from_pdf(NamedBytesIO(pdf, "bench.pdf"))
+
+    if "parse_docx" in args.scenarios:
+        docx = make_docx(args.docx_paragraphs)
+        scenarios["parse_docx"] = lambda: extract_text_from_docx(NamedBytesIO(docx, "bench.docx"))
+
+    return scenarios
+
+
+def compare(results, baseline_path):
+    """打印与基线结果的对比"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+
+    print(f"\n与基线 {baseline_path} 对比:")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        changes = []
+        for key in ("p50", "p95", "p99"):
+            if result[key] and base.get(key):
+                changes.append(f"{key} {(result[key] / base[key] - 1) * 100:+.1f}%")
+        print(f"  {name:<20} {'  '.join(changes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PrePlay 基准测试")
+    parser.add_argument("--iterations", type=int, default=20, help="每个场景的计时次数")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--history", type=int, default=20, help="蓝方对话的历史消息数")
+    parser.add_argument("--messages", type=int, default=200, help="恢复会话的消息数")
+    parser.add_argument("--sessions", type=int, default=500, help="历史会话数")
+    parser.add_argument("--turns", type=int, default=20, help="报告对话的轮数")
+    parser.add_argument("--pdf-pages", type=int, default=200)
+    parser.add_argument("--docx-paragraphs", type=int, default=5000)
+    parser.add_argument("--live", action="store_true", help="使用 .env 中配置的真实接口（默认使用模拟服务）")
+    parser.add_argument("--mock-port", type=int, default=None)
+    parser.add_argument("--rate-limit", action="store_true", help="使用模拟服务时也开启客户端限流（默认关闭）")
+    parser.add_argument("--db", default=None, help="数据库路径（默认使用临时数据库）")
+    parser.add_argument("--output", default=None, help="结果 JSON 路径")
+    parser.add_argument("--compare", default=None, help="对比的基线结果 JSON 路径")
+    args = parser.parse_args()
+
+    if not args.live:
+        enable_mock_env(args.mock_port)
+        if not args.rate_limit:
+            os.environ["RATE_LIMIT_ENABLED"] = "false"
+    db_path, mock_server = start_offline_backend(args.db, start_mock=not args.live)
+
+    from config import MOCK_CONFIG, RATE_LIMIT_CONFIG, RATE_LIMIT_ENABLED
+
+    try:
+        scenarios = build_scenarios(args)
+        results = {}
+        for name in SCENARIOS:
+            if name not in scenarios:
+                continue
+            print(f"运行 {name} ...")
+            results[name] = run_scenario(name, scenarios[name], args.iterations)
+    finally:
+        if mock_server is not None:
+            mock_server.stop()
+
+    print(f"\n{'场景':<20}{'p50':>9}{'p95':>9}{'p99':>9}{'吞吐(次/秒)':>14}{'错误':>6}")
+    for name, result in results.items():
+        cells = [f"{result[k] * 1000:8.1f}ms" if result[k] is not None else f"{'-':>10}" for k in ("p50", "p95", "p99")]
+        throughput = f"{result['throughput']:.2f}" if result["throughput"] else "-"
+        print(f"{name:<20}{''.join(cells)}{throughput:>14}{result['errors']:>6}")
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "mode": "live" if args.live else "mock",
+            "mock_config": None if args.live else MOCK_CONFIG,
+            "rate_limit": {"enabled": RATE_LIMIT_ENABLED, "endpoints": RATE_LIMIT_CONFIG},
+            "db_path": db_path,
+            "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare")}
+        },
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
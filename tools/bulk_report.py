@@ -0,0 +1,115 @@
+# coding: utf-8
+"""
+批量生成训练报告
+按创建日期范围或会话ID选出会话，并发生成报告（请求速率受 Moonshot 限流控制），
+已保存且对话未变化的报告直接复用；报告保存到数据库，并导出为 Markdown 文件
+
+用法:
+    python -m tools.bulk_report --since 2025-03-01 --until 2025-03-07 [--concurrency 4] [--output-dir exports/]
+    python -m tools.bulk_report --ids session_xxx session_yyy --force --export reports.jsonl
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from tools.common import enable_mock_env, start_offline_backend
+
+
+def _until_exclusive(value):
+    """只给出日期时包含当天"""
+    if value and len(value) == 10:
+        return (date.fromisoformat(value) + timedelta(days=1)).isoformat()
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PrePlay 批量生成训练报告")
+    parser.add_argument("--ids", nargs="*", default=None, help="会话ID")
+    parser.add_argument("--since", default=None, help="起始日期/时间（含），如 2025-03-01")
+    parser.add_argument("--until", default=None, help="截止日期（含当天）或时间（不含）")
+    parser.add_argument("--concurrency", type=int, default=None, help="同时生成的报告数（默认 REPORT_BULK_CONCURRENCY）")
+    parser.add_argument("--force", action="store_true", help="忽略已保存的报告重新生成")
+    parser.add_argument("--min-messages", type=int, default=1, help="跳过消息数少于该值的会话")
+    parser.add_argument("--output-dir", default=None, help="Markdown 导出目录（默认 REPORT_EXPORT_DIR）")
+    parser.add_argument("--export", default=None, help="把全部结果额外导出为一个 JSON Lines 文件")
+    parser.add_argument("--dry-run", action="store_true", help="只列出选中的会话")
+    parser.add_argument("--mock", action="store_true", help="使用本地模拟服务")
+    parser.add_argument("--db", default=None, help="数据库路径（默认使用项目数据库）")
+    args = parser.parse_args()
+
+    if args.ids is None and not (args.since or args.until):
+        parser.error("需要提供 --ids 或 --since/--until")
+
+    mock_server = None
+    if args.mock:
+        enable_mock_env()
+        _, mock_server = start_offline_backend(args.db)
+    elif args.db:
+        from services.session_service import get_session_service
+        get_session_service(args.db)
+
+    from config import REPORT_BULK_CONFIG
+    from services.report_service import generate_reports
+    from services.session_service import find_training_sessions
+
+    try:
+        sessions = find_training_sessions(args.since, _until_exclusive(args.until), args.ids)
+        if args.ids:
+            missing = set(args.ids) - {s["id"] for s in sessions}
+            for session_id in sorted(missing):
+                print(f"会话不存在: {session_id}")
+        selected = [s for s in sessions if s["message_count"] >= args.min_messages]
+        print(f"选中 {len(selected)} 个会话（共 {len(sessions)} 个，跳过消息数不足 {args.min_messages} 的会话）")
+
+        if args.dry_run:
+            for s in selected:
+                print(f"  {s['id']}  {s['created_at']}  {s['message_count']} 条消息")
+            return 0
+
+        output_dir = Path(args.output_dir or REPORT_BULK_CONFIG["export_dir"])
+        output_dir.mkdir(parents=True, exist_ok=True)
+        done = []
+
+        def on_result(result):
+            done.append(result)
+            if result["report"]:
+                path = output_dir / f"{result['session_id']}.md"
+                path.write_text(result["report"], encoding="utf-8")
+                detail = str(path)
+            else:
+                detail = result["error"] or ""
+            print(f"[{len(done)}/{len(selected)}] {result['session_id']} {result['status']} "
+                  f"{result['elapsed']:.1f}s {detail}")
+
+        start = time.perf_counter()
+        results = generate_reports([s["id"] for s in selected], args.concurrency, args.force, on_result)
+        elapsed = time.perf_counter() - start
+
+        if args.export:
+            created_at = {s["id"]: s["created_at"] for s in selected}
+            with open(args.export, "w", encoding="utf-8") as f:
+                for result in results:
+                    f.write(json.dumps({**result, "created_at": created_at[result["session_id"]]}, ensure_ascii=False) + "\n")
+            print(f"结果已导出到 {args.export}")
+
+        counts = {}
+        for result in results:
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+        summary = "，".join(f"{status} {count}" for status, count in sorted(counts.items()))
+        print(f"\n完成 {len(results)} 个会话，耗时 {elapsed:.1f}s：{summary or '无'}；报告目录 {output_dir}")
+        return 1 if counts.get("failed") else 0
+    finally:
+        if mock_server is not None:
+            mock_server.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+# coding: utf-8
+"""
+基准测试与压测的公共函数
+离线环境准备（模拟服务 + 临时数据库）与延迟统计
+"""
+import os
+import re
+import sys
+import tempfile
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+
+def enable_mock_env(port=None):
+    """
+    让后续导入的 config 指向本地模拟服务
+
+    必须在导入 config 及任何 services 模块之前调用。
+
+    Args:
+        port: 模拟服务端口（可选，默认取 MOCK_PORT）
+    """
+    if "config" in sys.modules:
+        raise RuntimeError("config 已被导入，无法再切换到模拟服务")
+    os.environ["MOCK_ENABLED"] = "true"
+    if port is not None:
+        os.environ["MOCK_PORT"] = str(port)
+
+
+def start_offline_backend(db_path=None, start_mock=True):
+    """
+    使用临时数据库，并按需在进程内启动模拟服务
+
+    Args:
+        db_path: 数据库文件路径（可选，默认在临时目录新建）
+        start_mock: 是否在进程内启动模拟服务
+
+    Returns:
+        (db_path, mock_server): 模拟服务未启动时 mock_server 为None
+    """
+    from services.session_service import get_session_service
+
+    if db_path is None:
+        db_path = os.path.join(tempfile.mkdtemp(prefix="preplay-bench-"), "preplay.db")
+    # 会话服务与数据库均为单例，先以临时路径初始化
+    get_session_service(db_path)
+
+    mock_server = None
+    if start_mock:
+        from tools.mock_server import MockServerThread
+        mock_server = MockServerThread().start()
+    return db_path, mock_server
+
+
+def load_markdown_script(path):
+    """
+    从对话模拟数据格式的 Markdown 中读取用户发言脚本
+
+    每个 "### 用户发言" 小节后的代码块为一条发言，
+    小节标题包含 "蓝方" 时发给蓝方，否则发给红方。
+
+    Args:
+        path: Markdown 文件路径
+
+    Returns:
+        [{"target": "red"/"blue", "content": 发言内容}, ...]
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+
+    steps = []
+    pattern = re.compile(r"^### (用户发言[^\n]*)\n+```[^\n]*\n(.*?)\n```", re.M | re.S)
+    for match in pattern.finditer(text):
+        target = "blue" if "蓝方" in match.group(1) else "red"
+        steps.append({"target": target, "content": match.group(2).strip()})
+    return steps
+
+
+def percentile(samples, p):
+    """
+    计算分位数（线性插值）
+
+    Args:
+        samples: 已排序的样本
+        p: 分位（0-100）
+
+    Returns:
+        分位数，无样本返回None
+    """
+    if not samples:
+        return None
+    k = (len(samples) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(samples) - 1)
+    return samples[lower] + (samples[upper] - samples[lower]) * (k - lower)
+
+
+def summarize(latencies, elapsed, errors=0):
+    """
+    汇总一组请求的延迟
+
+    Args:
+        latencies: 成功请求的耗时列表（秒）
+        elapsed: 整组请求的墙钟耗时（秒）
+        errors: 失败的请求数
+
+    Returns:
+        dict: count, errors, error_rate, mean, min, max, p50, p95, p99（秒）, throughput（次/秒）
+    """
+    samples = sorted(latencies)
+    total = len(samples) + errors
+    return {
+        "count": len(samples),
+        "errors": errors,
+        "error_rate": errors / total if total else 0.0,
+        "mean": sum(samples) / len(samples) if samples else None,
+        "min": samples[0] if samples else None,
+        "max": samples[-1] if samples else None,
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95),
+        "p99": percentile(samples, 99),
+        "throughput": len(samples) / elapsed if elapsed > 0 else None
+    }
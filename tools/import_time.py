@@ -0,0 +1,203 @@
+# coding: utf-8
+"""
+导入耗时测量
+在全新的解释器中执行各页面脚本的模块级导入（以及常用服务模块的导入），
+测量冷启动导入耗时并列出耗时最多的依赖包，用于评估服务启动后首次渲染页面的开销
+
+Streamlit 服务进程在渲染页面前已导入 streamlit，因此页面导入中不计 streamlit。
+
+用法:
+    python -m tools.import_time [--repeat 5] [--output imports.json] [--compare baseline.json]
+"""
+import argparse
+import ast
+import json
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+
+PAGES = ["app.py", "pages/1_训练.py", "pages/2_报告.py"]
+
+MODULES = [
+    "config",
+    "database",
+    "utils.file_handler",
+    "services.session_service",
+    "services.knowledge_service",
+    "services.turn_orchestrator",
+    "services.report_service"
+]
+
+# 渲染页面前服务进程已导入的包
+SERVER_PRELOADED = ("streamlit",)
+
+PROJECT_PACKAGES = ("config", "database", "services", "utils", "tools", "pages", "app")
+
+
+def page_imports(path):
+    """
+    读取页面脚本的模块级导入语句
+
+    Args:
+        path: 页面脚本路径
+
+    Returns:
+        导入语句列表
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+
+    statements = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            roots = [alias.name.split(".")[0] for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            roots = [node.module.split(".")[0]]
+        else:
+            continue
+        if any(root in SERVER_PRELOADED for root in roots):
+            continue
+        statements.append(ast.unparse(node))
+    return statements
+
+
+def _run_once(statements):
+    """在新解释器中执行导入，返回 (耗时秒, -X importtime 输出)"""
+    code = "\n".join([
+        "import sys, time",
+        f"sys.path.insert(0, {str(project_root)!r})",
+        "_t0 = time.perf_counter()",
+        *statements,
+        "print(time.perf_counter() - _t0)"
+    ])
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=str(project_root),
+        capture_output=True,
+        text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "导入失败")
+    return float(proc.stdout.strip().splitlines()[-1]), proc.stderr
+
+
+def _parse_packages(importtime_output):
+    """从 -X importtime 输出中读取各顶层包的累计耗时（毫秒）"""
+    packages = {}
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].strip()
+        if "." in name or name.startswith("_") or name in PROJECT_PACKAGES:
+            continue
+        cumulative_ms = int(parts[1]) / 1000
+        packages[name] = max(packages.get(name, 0), cumulative_ms)
+    return packages
+
+
+def _top_packages(importtime_output, limit, startup):
+    """按累计耗时列出导入最慢的顶层包（不含项目自身模块与解释器启动时已导入的包）"""
+    packages = _parse_packages(importtime_output)
+    packages = {name: ms for name, ms in packages.items() if name not in startup}
+    return sorted(packages.items(), key=lambda item: -item[1])[:limit]
+
+
+def measure(statements, repeat, top, startup=()):
+    """
+    多次测量一组导入的冷启动耗时
+
+    Returns:
+        dict: median, min, max（秒）, packages（最慢的顶层包及累计毫秒）
+    """
+    # 预热一次，确保字节码缓存已生成
+    _run_once(statements)
+
+    runs = [_run_once(statements) for _ in range(repeat)]
+    times = [elapsed for elapsed, _ in runs]
+    median = statistics.median(times)
+    # 取最接近中位数的一次运行列出慢包
+    _, output = min(runs, key=lambda run: abs(run[0] - median))
+    return {
+        "median": median,
+        "min": min(times),
+        "max": max(times),
+        "packages": _top_packages(output, top, startup)
+    }
+
+
+def compare(results, baseline_path):
+    """打印与基线结果的对比"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+
+    print(f"\n与基线 {baseline_path} 对比:")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base or not base.get("median"):
+            continue
+        change = (result["median"] / base["median"] - 1) * 100
+        print(f"  {name:<28} {base['median'] * 1000:8.1f}ms → {result['median'] * 1000:8.1f}ms  {change:+.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PrePlay 导入耗时测量")
+    parser.add_argument("--repeat", type=int, default=5, help="每个目标的测量次数")
+    parser.add_argument("--top", type=int, default=5, help="每个目标列出的最慢依赖包数")
+    parser.add_argument("--modules", nargs="*", default=MODULES, help="额外测量的模块")
+    parser.add_argument("--output", default=None, help="结果 JSON 路径")
+    parser.add_argument("--compare", default=None, help="对比的基线结果 JSON 路径")
+    args = parser.parse_args()
+
+    targets = {page: page_imports(project_root / page) for page in PAGES}
+    for module in args.modules:
+        targets[module] = [f"import {module}"]
+
+    # 解释器启动时（site 等）导入的包不计入慢包列表
+    startup = set(_parse_packages(_run_once([])[1]))
+
+    results = {}
+    for name, statements in targets.items():
+        print(f"测量 {name} ...")
+        try:
+            results[name] = measure(statements, args.repeat, args.top, startup)
+        except RuntimeError as e:
+            print(f"  跳过: {str(e)}")
+
+    print(f"\n{'目标':<28}{'中位数':>10}{'最小':>10}{'最大':>10}  最慢的依赖包")
+    for name, result in results.items():
+        packages = ", ".join(f"{package} {ms:.0f}ms" for package, ms in result["packages"])
+        cells = "".join(f"{result[k] * 1000:8.1f}ms" for k in ("median", "min", "max"))
+        print(f"{name:<28}{cells}  {packages}")
+
+    if args.output:
+        report = {
+            "meta": {
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare")}
+            },
+            "results": results
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
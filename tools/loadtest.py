@@ -0,0 +1,224 @@
+# coding: utf-8
+"""
+多用户压测
+K 个虚拟学员按对话脚本并发完成"创建会话 → 多轮红/蓝方对话 → 生成报告"，
+并发数按阶梯递增，输出每个并发等级的延迟分位数、错误率、线程数与数据库锁等待
+
+用法:
+    python -m tools.loadtest [--levels 1 5 10 20] [--script 对话模拟数据.md] [--output load.json]
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from tools.common import enable_mock_env, start_offline_backend, load_markdown_script, summarize
+
+
+class Recorder:
+    """线程安全地收集各操作的耗时与错误"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation, seconds=None, error=None):
+        with self._lock:
+            if error is None:
+                self.latencies.setdefault(operation, []).append(seconds)
+            else:
+                self.errors.setdefault(operation, []).append(str(error))
+
+    def timed(self, operation, func, *args, **kwargs):
+        """执行并记录一次操作，失败时返回None"""
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.record(operation, error=e)
+            return None
+        self.record(operation, time.perf_counter() - start)
+        return result
+
+
+class ResourceSampler:
+    """后台定时采样进程线程数"""
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="preplay-load-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.samples.append(threading.active_count())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self):
+        if not self.samples:
+            return {"peak": 0, "mean": 0}
+        return {"peak": max(self.samples), "mean": sum(self.samples) / len(self.samples)}
+
+
+def virtual_user(user_index, script, file_ids, recorder, think_time, with_report, rng):
+    """一个虚拟学员通过训练引擎完成一次完整训练"""
+    from services.training_engine import get_training_engine
+
+    engine = get_training_engine()
+    snapshot = recorder.timed("session_create", engine.start_session, file_ids or None)
+    if snapshot is None:
+        return
+    session_id = snapshot["session_id"]
+
+    for step in script:
+        if think_time > 0:
+            time.sleep(rng.uniform(think_time * 0.5, think_time * 1.5))
+        recorder.timed(f"turn_{step['target']}", engine.send_turn, session_id, step["target"], step["content"])
+
+    recorder.timed("session_end", engine.end_session, session_id)
+    if with_report:
+        recorder.timed("report_generate", engine.get_report, session_id)
+
+
+def run_level(users, script, file_ids, args, rng):
+    """
+    以给定并发数运行一轮压测
+
+    Returns:
+        dict: 该并发等级的各操作统计、线程数与数据库锁等待
+    """
+    from database import get_db
+
+    db = get_db()
+    db.reset_lock_stats()
+    recorder = Recorder()
+
+    threads = []
+    start = time.perf_counter()
+    with ResourceSampler() as sampler:
+        for i in range(users):
+            thread = threading.Thread(
+                target=virtual_user,
+                args=(i, script, file_ids, recorder, args.think_time, not args.no_report, random.Random(rng.random())),
+                name=f"preplay-vu-{i}"
+            )
+            threads.append(thread)
+            thread.start()
+            if args.ramp_up > 0 and users > 1:
+                time.sleep(args.ramp_up / users)
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - start
+
+    operations = {}
+    for operation in sorted(set(recorder.latencies) | set(recorder.errors)):
+        errors = recorder.errors.get(operation, [])
+        operations[operation] = summarize(recorder.latencies.get(operation, []), elapsed, len(errors))
+        if errors:
+            operations[operation]["sample_errors"] = errors[:3]
+
+    return {
+        "users": users,
+        "elapsed": elapsed,
+        "operations": operations,
+        "threads": sampler.summary(),
+        "db_lock": db.get_lock_stats()
+    }
+
+
+def print_level(level):
+    print(f"\n并发 {level['users']} 人，耗时 {level['elapsed']:.1f}s，"
+          f"线程峰值 {level['threads']['peak']}，"
+          f"数据库锁等待 {level['db_lock']['total_wait'] * 1000:.1f}ms"
+          f"（竞争 {level['db_lock']['contended']}/{level['db_lock']['acquisitions']} 次，"
+          f"最长 {level['db_lock']['max_wait'] * 1000:.1f}ms）")
+    print(f"  {'操作':<18}{'次数':>6}{'错误率':>8}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for name, stats in level["operations"].items():
+        cells = "".join(
+            f"{stats[k] * 1000:8.0f}ms" if stats[k] is not None else f"{'-':>10}"
+            for k in ("p50", "p95", "p99")
+        )
+        print(f"  {name:<18}{stats['count']:>6}{stats['error_rate']:>8.1%}{cells}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PrePlay 多用户压测")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 5, 10, 20], help="依次运行的并发人数")
+    parser.add_argument("--script", default=str(project_root / "对话模拟数据.md"), help="对话脚本（Markdown）")
+    parser.add_argument("--think-time", type=float, default=1.0, help="每轮发言前的平均思考时间（秒）")
+    parser.add_argument("--ramp-up", type=float, default=2.0, help="每个并发等级内用户陆续进入的总时长（秒）")
+    parser.add_argument("--no-knowledge", action="store_true", help="不使用知识库检索")
+    parser.add_argument("--no-report", action="store_true", help="训练结束后不生成报告")
+    parser.add_argument("--live", action="store_true", help="使用 .env 中配置的真实接口（默认使用模拟服务）")
+    parser.add_argument("--mock-port", type=int, default=None)
+    parser.add_argument("--db", default=None, help="数据库路径（默认使用临时数据库）")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="结果 JSON 路径")
+    args = parser.parse_args()
+
+    if not args.live:
+        enable_mock_env(args.mock_port)
+    db_path, mock_server = start_offline_backend(args.db, start_mock=not args.live)
+
+    script = load_markdown_script(args.script)
+    if not script:
+        print(f"脚本中没有用户发言: {args.script}")
+        return
+
+    rng = random.Random(args.seed)
+    levels = []
+    try:
+        file_ids = []
+        if not args.no_knowledge:
+            from services.knowledge_service import get_knowledge_service
+            upload = get_knowledge_service().upload_document(str(project_root / "汇报材料.txt"))
+            if not upload["success"]:
+                raise RuntimeError(f"准备知识库文件失败: {upload.get('error')}")
+            file_ids = [upload["file_id"]]
+
+        for users in args.levels:
+            print(f"运行并发 {users} 人 ...")
+            level = run_level(users, script, file_ids, args, rng)
+            print_level(level)
+            levels.append(level)
+    finally:
+        if mock_server is not None:
+            mock_server.stop()
+
+    if args.output:
+        report = {
+            "meta": {
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "mode": "live" if args.live else "mock",
+                "db_path": db_path,
+                "script_steps": len(script),
+                "params": {k: v for k, v in vars(args).items() if k != "output"}
+            },
+            "levels": levels
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
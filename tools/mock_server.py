@@ -0,0 +1,377 @@
+# coding: utf-8
+"""
+本地模拟服务
+模拟星火助手 WebSocket、ChatDoc 检索 WebSocket 与文件接口、Moonshot 对话补全接口，
+延迟、输出速率与错误注入均可配置，用于离线、可复现地测量性能
+
+用法:
+    python -m tools.mock_server [--port 8765] [--error-rate 0.1]
+
+    在 .env 中设置 MOCK_ENABLED=true 后，应用的所有上游请求都会发往本服务。
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from aiohttp import web, WSMsgType
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from config import MOCK_CONFIG
+
+
+# 回复内容的素材，按需重复截取到配置的字数
+SAMPLE_TEXT = (
+    "你提到的增长数据缺少对照组，如何证明是方案本身带来的效果？"
+    "如果评委追问成本结构，你能给出具体的拆分吗？"
+    "请用一句话说明你的方案与现有竞品最本质的区别。"
+    "你的用户调研样本量是多少，是否足以支撑这个结论？"
+)
+
+
+def make_text(length, seed_text=""):
+    """生成指定字数的回复内容"""
+    base = (seed_text[:20] + "，" if seed_text else "") + SAMPLE_TEXT
+    repeat = length // len(base) + 1
+    return (base * repeat)[:length]
+
+
+class MockState:
+    """模拟服务的配置与运行统计"""
+
+    def __init__(self, config=None):
+        self.config = {**MOCK_CONFIG, **(config or {})}
+        self.rng = random.Random(self.config["seed"])
+        self.files = {}
+        self.requests = {}
+        self.errors = {}
+
+    def count(self, endpoint, error=False):
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+        if error:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def should_fail(self):
+        rate = self.config["error_rate"]
+        return rate > 0 and self.rng.random() < rate
+
+    def chunks(self, text):
+        size = max(1, self.config["chunk_chars"])
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    def chunk_delay(self, chunk):
+        rate = self.config["token_rate"]
+        return len(chunk) / rate if rate > 0 else 0.0
+
+
+# ============================================
+# WebSocket 流式接口
+# ============================================
+
+def spark_frame(sid, status, seq, content="", code=0):
+    """星火助手回复帧"""
+    frame = {
+        "header": {
+            "code": code,
+            "message": "Success" if code == 0 else "mock error",
+            "sid": sid,
+            "status": status
+        }
+    }
+    if code == 0:
+        frame["payload"] = {
+            "choices": {
+                "status": status,
+                "seq": seq,
+                "text": [{"content": content, "role": "assistant", "index": 0}]
+            }
+        }
+    return frame
+
+
+def chatdoc_frame(sid, status, content="", code=0):
+    """ChatDoc 检索回复帧"""
+    return {"code": code, "content": content, "sid": sid, "status": status}
+
+
+async def stream_reply(request, endpoint, make_frame, extract_question):
+    """接收一个请求并按配置的延迟与速率流式返回"""
+    state = request.app["state"]
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+
+    msg = await ws.receive()
+    if msg.type != WSMsgType.TEXT:
+        await ws.close()
+        return ws
+
+    sid = f"mock-{uuid.uuid4().hex[:12]}"
+    failed = state.should_fail()
+    state.count(endpoint, failed)
+
+    await asyncio.sleep(state.config["first_token_latency"])
+    if failed:
+        await ws.send_str(json.dumps(make_frame(sid, 2, 0, code=state.config["error_code"]), ensure_ascii=False))
+        await ws.close()
+        return ws
+
+    question = extract_question(json.loads(msg.data))
+    chunks = state.chunks(make_text(state.config["response_chars"], question))
+    try:
+        for seq, chunk in enumerate(chunks):
+            status = 0 if seq == 0 else 1
+            if seq == len(chunks) - 1:
+                status = 2
+            await ws.send_str(json.dumps(make_frame(sid, status, seq, chunk), ensure_ascii=False))
+            if status != 2:
+                await asyncio.sleep(state.chunk_delay(chunk))
+    except ConnectionResetError:
+        # 客户端取消时提前断开
+        return ws
+
+    await ws.close()
+    return ws
+
+
+def _spark_question(body):
+    messages = body.get("payload", {}).get("message", {}).get("text", [])
+    return messages[-1]["content"] if messages else ""
+
+
+def _chatdoc_question(body):
+    messages = body.get("messages", [])
+    return messages[-1]["content"] if messages else ""
+
+
+async def handle_red(request):
+    return await stream_reply(request, "red", spark_frame, _spark_question)
+
+
+async def handle_blue(request):
+    return await stream_reply(request, "blue", spark_frame, _spark_question)
+
+
+async def handle_chatdoc_ws(request):
+    return await stream_reply(
+        request,
+        "chatdoc",
+        lambda sid, status, seq, content="", code=0: chatdoc_frame(sid, status, content, code),
+        _chatdoc_question
+    )
+
+
+# ============================================
+# REST 接口
+# ============================================
+
+async def _rest_prologue(request, endpoint):
+    """REST 接口的公共处理：延迟与错误注入，返回是否注入了错误"""
+    state = request.app["state"]
+    failed = state.should_fail()
+    state.count(endpoint, failed)
+    await asyncio.sleep(state.config["rest_latency"])
+    return failed
+
+
+def _chatdoc_response(data=None, code=0, desc=""):
+    return web.json_response({
+        "code": code,
+        "desc": desc or ("success" if code == 0 else "mock error"),
+        "sid": f"mock-{uuid.uuid4().hex[:12]}",
+        "data": data
+    })
+
+
+async def handle_file_upload(request):
+    state = request.app["state"]
+    form = await request.post()
+    if await _rest_prologue(request, "file_upload"):
+        return _chatdoc_response(code=state.config["error_code"])
+
+    upload = form.get("file")
+    size = len(upload.file.read()) if upload is not None else 0
+    file_id = uuid.uuid4().hex
+    state.files[file_id] = {
+        "fileId": file_id,
+        "fileName": form.get("fileName", ""),
+        "fileType": form.get("fileType", "wiki"),
+        "fileSize": size,
+        "fileStatus": "vectored",
+        "createTime": int(time.time() * 1000)
+    }
+    return _chatdoc_response({"fileId": file_id})
+
+
+async def handle_file_del(request):
+    state = request.app["state"]
+    form = await request.post()
+    if await _rest_prologue(request, "file_del"):
+        return _chatdoc_response(code=state.config["error_code"])
+
+    for file_id in str(form.get("fileIds", "")).split(","):
+        state.files.pop(file_id.strip(), None)
+    return _chatdoc_response()
+
+
+async def handle_file_list(request):
+    state = request.app["state"]
+    body = await request.json()
+    if await _rest_prologue(request, "file_list"):
+        return _chatdoc_response(code=state.config["error_code"])
+
+    page = max(1, int(body.get("currentPage", 1)))
+    size = max(1, int(body.get("pageSize", 10)))
+    rows = list(state.files.values())
+    return _chatdoc_response({"total": len(rows), "rows": rows[(page - 1) * size:page * size]})
+
+
+async def handle_chat_completions(request):
+    """Moonshot（OpenAI 兼容）对话补全，支持 stream=true 的 SSE 流式返回"""
+    state = request.app["state"]
+    body = await request.json()
+    if await _rest_prologue(request, "moonshot"):
+        return web.json_response({"error": {"message": "mock error", "type": "server_error"}}, status=500)
+
+    completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+    messages = body.get("messages", [])
+    question = messages[-1]["content"] if messages else ""
+    text = "# PrePlay 训练报告\n\n" + make_text(state.config["response_chars"], question)
+
+    await asyncio.sleep(state.config["first_token_latency"])
+    if not body.get("stream"):
+        await asyncio.sleep(state.chunk_delay(text))
+        return web.json_response({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock-model"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": sum(len(m.get("content", "")) for m in messages),
+                "completion_tokens": len(text),
+                "total_tokens": sum(len(m.get("content", "")) for m in messages) + len(text)
+            }
+        })
+
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await response.prepare(request)
+    for chunk in state.chunks(text):
+        event = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}]
+        }
+        await response.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+        await asyncio.sleep(state.chunk_delay(chunk))
+    await response.write(b"data: [DONE]\n\n")
+    await response.write_eof()
+    return response
+
+
+async def handle_stats(request):
+    """各接口的请求数与注入的错误数"""
+    state = request.app["state"]
+    return web.json_response({"requests": state.requests, "errors": state.errors, "files": len(state.files)})
+
+
+def create_app(config=None):
+    """
+    创建模拟服务应用
+
+    Args:
+        config: 覆盖 MOCK_CONFIG 的配置项（可选）
+
+    Returns:
+        aiohttp 应用
+    """
+    app = web.Application(client_max_size=1024 ** 3)
+    app["state"] = MockState(config)
+    app.router.add_get("/red/chat", handle_red)
+    app.router.add_get("/blue/chat", handle_blue)
+    app.router.add_get("/openapi/chat", handle_chatdoc_ws)
+    app.router.add_post("/openapi/v1/file/upload", handle_file_upload)
+    app.router.add_post("/openapi/v1/file/del", handle_file_del)
+    app.router.add_post("/openapi/v1/file/list", handle_file_list)
+    app.router.add_post("/chat/completions", handle_chat_completions)
+    app.router.add_get("/mock/stats", handle_stats)
+    return app
+
+
+class MockServerThread:
+    """在后台线程中运行模拟服务，供基准测试与压测脚本使用"""
+
+    def __init__(self, config=None):
+        self.app = create_app(config)
+        self.config = self.app["state"].config
+        self._loop = asyncio.new_event_loop()
+        self._runner = None
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="preplay-mock-server", daemon=True)
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._runner = web.AppRunner(self.app)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, self.config["host"], self.config["port"])
+        self._loop.run_until_complete(site.start())
+        self._started.set()
+        self._loop.run_forever()
+
+    @property
+    def state(self):
+        return self.app["state"]
+
+    def start(self, timeout=10):
+        """启动并等待服务就绪"""
+        self._thread.start()
+        if not self._started.wait(timeout):
+            raise RuntimeError("模拟服务启动超时")
+        return self
+
+    def stop(self):
+        """停止服务"""
+        if self._runner is not None:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PrePlay 本地模拟服务")
+    parser.add_argument("--host", default=MOCK_CONFIG["host"])
+    parser.add_argument("--port", type=int, default=MOCK_CONFIG["port"])
+    parser.add_argument("--first-token-latency", type=float, default=MOCK_CONFIG["first_token_latency"])
+    parser.add_argument("--token-rate", type=float, default=MOCK_CONFIG["token_rate"])
+    parser.add_argument("--response-chars", type=int, default=MOCK_CONFIG["response_chars"])
+    parser.add_argument("--error-rate", type=float, default=MOCK_CONFIG["error_rate"])
+    parser.add_argument("--error-code", type=int, default=MOCK_CONFIG["error_code"])
+    args = parser.parse_args()
+
+    config = {
+        "host": args.host,
+        "port": args.port,
+        "first_token_latency": args.first_token_latency,
+        "token_rate": args.token_rate,
+        "response_chars": args.response_chars,
+        "error_rate": args.error_rate,
+        "error_code": args.error_code
+    }
+    print(f"模拟服务已启动: http://{args.host}:{args.port}")
+    web.run_app(create_app(config), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+# coding: utf-8
+"""
+批量回放训练脚本
+按脚本离线完成训练（无需打开 Streamlit），用于提示词回归测试与演示数据生成：
+每个脚本创建一个会话，依次向红/蓝方发送脚本中的发言，会话与消息照常写入数据库，可选生成报告
+
+脚本格式:
+    Markdown：与 对话模拟数据.md 相同，每个文件为一个脚本
+    JSONL：每行一个脚本
+        {"name": "demo-1", "knowledge": ["汇报材料.txt"], "turns": [{"target": "red", "text": "..."}, ...]}
+        knowledge 为要上传到知识库的本地文件（可选），也可直接给出 file_ids
+
+用法:
+    python -m tools.replay scripts.jsonl 对话模拟数据.md [--concurrency 4] [--repeat 10] [--report --report-dir reports/]
+    python -m tools.replay scripts/ --mock --output results.jsonl
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from tools.common import enable_mock_env, start_offline_backend, load_markdown_script
+
+
+def _normalize_turns(turns, name):
+    steps = []
+    for i, turn in enumerate(turns):
+        target = turn.get("target", "red")
+        text = turn.get("text", turn.get("content"))
+        if target not in ("red", "blue") or not text:
+            raise ValueError(f"{name} 第 {i + 1} 条发言无效: {turn}")
+        steps.append({"target": target, "content": text})
+    return steps
+
+
+def load_scripts(paths):
+    """
+    读取训练脚本
+
+    Args:
+        paths: 脚本文件或目录（目录下的 .md/.jsonl 文件均会读取）
+
+    Returns:
+        [{"name", "turns": [{"target", "content"}], "knowledge": [本地文件], "file_ids": [...]}, ...]
+    """
+    files = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files.extend(sorted(p for p in path.iterdir() if p.suffix in (".md", ".jsonl")))
+        else:
+            files.append(path)
+
+    scripts = []
+    for path in files:
+        if path.suffix == ".jsonl":
+            with open(path, "r", encoding="utf-8") as f:
+                for lineno, line in enumerate(f, 1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    name = data.get("name") or data.get("id") or f"{path.stem}:{lineno}"
+                    knowledge = [
+                        str(Path(item) if Path(item).is_absolute() else path.parent / item)
+                        for item in data.get("knowledge", [])
+                    ]
+                    scripts.append({
+                        "name": name,
+                        "turns": _normalize_turns(data.get("turns", []), name),
+                        "knowledge": knowledge,
+                        "file_ids": list(data.get("file_ids", []))
+                    })
+        else:
+            scripts.append({
+                "name": path.stem,
+                "turns": load_markdown_script(path),
+                "knowledge": [],
+                "file_ids": []
+            })
+    return [script for script in scripts if script["turns"]]
+
+
+class KnowledgeUploader:
+    """按本地路径上传知识库文件，同一文件只上传一次"""
+
+    def __init__(self):
+        self._file_ids = {}
+        self._lock = threading.Lock()
+
+    def file_id(self, path):
+        from services.knowledge_service import get_knowledge_service
+
+        path = str(Path(path).resolve())
+        with self._lock:
+            if path not in self._file_ids:
+                result = get_knowledge_service().upload_document(path)
+                if not result["success"]:
+                    raise RuntimeError(f"上传知识库文件失败 {path}: {result.get('error')}")
+                self._file_ids[path] = result["file_id"]
+            return self._file_ids[path]
+
+
+def replay(script, run_index, uploader, args):
+    """
+    回放一个脚本
+
+    Returns:
+        dict: 本次回放的结果（会话ID、各轮耗时与错误、报告路径）
+    """
+    from services.training_engine import get_training_engine
+
+    engine = get_training_engine()
+    start = time.perf_counter()
+    record = {
+        "name": script["name"],
+        "run": run_index,
+        "session_id": None,
+        "turns": [],
+        "errors": 0,
+        "report": None,
+        "error": None
+    }
+
+    try:
+        file_ids = list(script["file_ids"])
+        for path in script["knowledge"] + list(args.knowledge or []):
+            file_ids.append(uploader.file_id(path))
+
+        snapshot = engine.start_session(file_ids or None, use_opening=args.opening)
+        session_id = record["session_id"] = snapshot["session_id"]
+
+        for step in script["turns"]:
+            turn_start = time.perf_counter()
+            turn = {"target": step["target"]}
+            try:
+                result = engine.send_turn(session_id, step["target"], step["content"])
+                turn["reply_chars"] = len(result["reply"]["content"]) if result["reply"] else 0
+                turn["kb_used"] = result["kb_used"]
+                if result["kb_error"]:
+                    turn["kb_error"] = result["kb_error"]
+            except Exception as e:
+                turn["error"] = str(e)
+                record["errors"] += 1
+            turn["elapsed"] = time.perf_counter() - turn_start
+            record["turns"].append(turn)
+
+        engine.end_session(session_id)
+
+        if args.report:
+            report = engine.get_report(session_id)["report"]
+            if args.report_dir:
+                report_dir = Path(args.report_dir)
+                report_dir.mkdir(parents=True, exist_ok=True)
+                report_path = report_dir / f"{session_id}.md"
+                report_path.write_text(report, encoding="utf-8")
+                record["report"] = str(report_path)
+            else:
+                record["report"] = f"{len(report)} 字"
+    except Exception as e:
+        record["error"] = str(e)
+
+    record["elapsed"] = time.perf_counter() - start
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PrePlay 批量回放训练脚本")
+    parser.add_argument("scripts", nargs="+", help="脚本文件（.md/.jsonl）或目录")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时进行的训练数")
+    parser.add_argument("--repeat", type=int, default=1, help="每个脚本回放的次数")
+    parser.add_argument("--knowledge", nargs="*", default=None, help="所有脚本共用的知识库文件")
+    parser.add_argument("--opening", action="store_true", help="带知识库时使用预生成的开场问题（需设置 OPENING_QUESTIONS_ENABLED=true）")
+    parser.add_argument("--report", action="store_true", help="每个训练结束后生成报告")
+    parser.add_argument("--report-dir", default=None, help="报告保存目录（按会话ID命名）")
+    parser.add_argument("--mock", action="store_true", help="使用本地模拟服务（默认使用 .env 中配置的真实接口）")
+    parser.add_argument("--mock-port", type=int, default=None)
+    parser.add_argument("--db", default=None, help="数据库路径（默认使用项目数据库）")
+    parser.add_argument("--output", default=None, help="逐个训练的结果（JSON Lines）")
+    args = parser.parse_args()
+
+    if args.mock:
+        enable_mock_env(args.mock_port)
+        db_path, mock_server = start_offline_backend(args.db)
+    else:
+        from services.session_service import get_session_service
+        get_session_service(*([args.db] if args.db else []))
+        mock_server = None
+
+    scripts = load_scripts(args.scripts)
+    if not scripts:
+        print("没有可回放的脚本")
+        return 1
+
+    jobs = [(script, run) for script in scripts for run in range(args.repeat)]
+    print(f"回放 {len(scripts)} 个脚本 × {args.repeat} 次，并发 {args.concurrency}")
+
+    uploader = KnowledgeUploader()
+    records = []
+    output = open(args.output, "a", encoding="utf-8") if args.output else None
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="preplay-replay") as executor:
+            futures = [executor.submit(replay, script, run, uploader, args) for script, run in jobs]
+            for future in as_completed(futures):
+                record = future.result()
+                records.append(record)
+                status = "失败: " + record["error"] if record["error"] else f"{len(record['turns'])} 轮，错误 {record['errors']}"
+                print(f"[{len(records)}/{len(jobs)}] {record['name']} #{record['run']} "
+                      f"{record['session_id'] or '-'} {record['elapsed']:.1f}s {status}")
+                if output is not None:
+                    record["finished_at"] = datetime.now().isoformat(timespec="seconds")
+                    output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    output.flush()
+    finally:
+        if output is not None:
+            output.close()
+        if mock_server is not None:
+            mock_server.stop()
+
+    failed = [r for r in records if r["error"] or r["errors"]]
+    turns = sum(len(r["turns"]) for r in records)
+    print(f"\n完成 {len(records)} 个训练、{turns} 轮对话，耗时 {time.perf_counter() - start:.1f}s，"
+          f"有错误的训练 {len(failed)} 个")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,12 +2,33 @@
 文件处理工具
 用于解析各种格式的上传文件
 """
-import PyPDF2
-from docx import Document
+import codecs
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from config import PARSE_CACHE_CONFIG, UPLOAD_CONFIG
+from utils.metrics import record_cache
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
 
 
 def extract_text_from_pdf(file):
     """从PDF文件中提取文本"""
+    # PyPDF2 与 python-docx 导入较慢，只在实际解析时导入
+    import PyPDF2
+
     text = ""
     reader = PyPDF2.PdfReader(file)
     for page in reader.pages:
@@ -17,6 +38,8 @@ def extract_text_from_pdf(file):
 
 def extract_text_from_docx(file):
     """从Word文件中提取文本"""
+    from docx import Document
+
     doc = Document(file)
     text = ""
     for para in doc.paragraphs:
@@ -29,10 +52,157 @@ def extract_text_from_txt(file):
     return file.getvalue().decode("utf-8")
 
 
-def parse_uploaded_file(file):
-    """解析上传的文件，返回文本内容"""
-    file_type = file.name.split(".")[-1].lower()
+# ============================================
+# 解析结果缓存
+# ============================================
+
+class ParsedDocumentCache:
+    """
+    文档解析结果磁盘缓存
+
+    以文件内容哈希为键，缓存提取出的文本和元数据。
+    每个条目一个 JSON 文件，按最近访问时间（mtime）做 LRU 淘汰，
+    总大小超过上限时删除最久未使用的条目。
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        """
+        读取缓存条目
+
+        Args:
+            key: 内容哈希
+
+        Returns:
+            {"text": ..., "metadata": {...}}，未命中返回None
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        # 刷新访问时间，作为 LRU 依据
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key, text, metadata):
+        """
+        写入缓存条目，并在超出容量时淘汰旧条目
+
+        Args:
+            key: 内容哈希
+            text: 提取出的文本
+            metadata: 元数据字典
+        """
+        entry = {"text": text, "metadata": metadata}
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+
+        with self._lock:
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(entry, f, ensure_ascii=False)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning("写入解析缓存失败: %s", e)
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return
+            self._evict()
+
+    def _evict(self):
+        """按最近访问时间淘汰条目，直到总大小不超过上限"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        if total <= self.max_bytes:
+            return
 
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".json"):
+                    try:
+                        os.remove(os.path.join(self.cache_dir, name))
+                    except OSError:
+                        pass
+
+
+# 全局实例
+_parse_cache = None
+
+
+def get_parse_cache():
+    """获取解析缓存实例（单例），未启用时返回None"""
+    global _parse_cache
+    if not PARSE_CACHE_CONFIG["enabled"]:
+        return None
+    if _parse_cache is None:
+        _parse_cache = ParsedDocumentCache(
+            PARSE_CACHE_CONFIG["cache_dir"],
+            PARSE_CACHE_CONFIG["max_bytes"]
+        )
+    return _parse_cache
+
+
+def compute_content_hash(file, chunk_size=1024 * 1024):
+    """
+    分块计算文件内容的 SHA-256 哈希
+
+    Args:
+        file: 文件对象（需支持 seek/read）
+        chunk_size: 每次读取的字节数
+
+    Returns:
+        十六进制哈希字符串
+    """
+    sha = hashlib.sha256()
+    file.seek(0)
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        sha.update(chunk)
+    file.seek(0)
+    return sha.hexdigest()
+
+
+def _extract_text(file, file_type):
+    """按文件类型提取文本"""
     if file_type == "pdf":
         return extract_text_from_pdf(file)
     elif file_type == "docx":
@@ -41,3 +211,199 @@ def parse_uploaded_file(file):
         return extract_text_from_txt(file)
     else:
         raise ValueError(f"不支持的文件类型: {file_type}")
+
+
+def _parse_with_cache(file, file_name, file_type, file_size):
+    """
+    按内容哈希读取/写入解析缓存
+
+    Args:
+        file: 文件对象（需支持 seek/read）
+        file_name: 文件名
+        file_type: 文件类型
+        file_size: 文件大小（字节）
+
+    Returns:
+        {"text": 文本内容, "metadata": 元数据, "cached": 是否命中缓存}
+    """
+    if file_type not in ["pdf", "docx", "txt", "md"]:
+        raise ValueError(f"不支持的文件类型: {file_type}")
+
+    cache = get_parse_cache()
+    if cache is None:
+        text = _extract_text(file, file_type)
+        return {"text": text, "metadata": {"file_name": file_name, "file_type": file_type}, "cached": False}
+
+    # 文件类型参与键计算，同样的字节按不同格式解析结果不同
+    key = f"{compute_content_hash(file)}_{file_type}"
+    entry = cache.get(key)
+    record_cache("parse", entry is not None)
+    if entry is not None:
+        # 缓存按内容命中，文件名与大小以本次文件为准
+        metadata = dict(entry["metadata"], file_name=file_name, file_size=file_size)
+        return {"text": entry["text"], "metadata": metadata, "cached": True}
+
+    text = _extract_text(file, file_type)
+    metadata = {
+        "file_name": file_name,
+        "file_type": file_type,
+        "file_size": file_size,
+        "content_hash": key,
+        "char_count": len(text),
+        "parsed_at": time.strftime("%Y-%m-%d %H:%M:%S")
+    }
+    cache.put(key, text, metadata)
+    return {"text": text, "metadata": metadata, "cached": False}
+
+
+def parse_uploaded_file_with_meta(file):
+    """
+    解析上传的文件，返回文本及元数据（优先读取缓存）
+
+    Args:
+        file: Streamlit 上传的文件对象
+
+    Returns:
+        {"text": 文本内容, "metadata": 元数据, "cached": 是否命中缓存}
+    """
+    file_type = file.name.split(".")[-1].lower()
+    return _parse_with_cache(file, file.name, file_type, getattr(file, "size", None))
+
+
+def parse_uploaded_file(file):
+    """解析上传的文件，返回文本内容"""
+    return parse_uploaded_file_with_meta(file)["text"]
+
+
+def extract_text_from_path(path):
+    """
+    提取本地文件的文本内容（与上传文件共用解析缓存）
+
+    Args:
+        path: 文件路径（pdf/docx/txt/md）
+
+    Returns:
+        文本内容
+    """
+    file_type = os.path.splitext(path)[1].lstrip(".").lower()
+    with open(path, "rb") as f:
+        data = f.read()
+    return _parse_with_cache(io.BytesIO(data), os.path.basename(path), file_type, len(data))["text"]
+
+
+# ============================================
+# 大文档分块读取
+# ============================================
+
+def _iter_txt_lines(file, block_size):
+    """以固定块大小流式读取文本文件，逐行产出（保留换行符）"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    file.seek(0)
+    while True:
+        block = file.read(block_size)
+        if not block:
+            break
+        pending += decoder.decode(block)
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + "\n"
+        # 没有换行的超长内容也要及时产出，避免缓冲区无限增长
+        if len(pending) > block_size:
+            yield pending
+            pending = ""
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def _iter_docx_lines(file):
+    """
+    逐段落产出 Word 文本
+
+    python-docx 不支持流式读取，会先把整个文档加载到内存，
+    因此大 docx 文件的内存占用与文件大小相关，只有产出的文本是逐段的。
+    """
+    from docx import Document
+
+    doc = Document(file)
+    for para in doc.paragraphs:
+        yield para.text + "\n"
+
+
+def _iter_pdf_lines(file):
+    """逐页产出 PDF 文本"""
+    import PyPDF2
+
+    reader = PyPDF2.PdfReader(file)
+    for page in reader.pages:
+        yield (page.extract_text() or "") + "\n"
+
+
+def _split_long_line(line, chunk_bytes):
+    """将超过分块大小的单行按字符切分"""
+    piece = []
+    size = 0
+    for ch in line:
+        ch_size = len(ch.encode("utf-8"))
+        if size + ch_size > chunk_bytes and piece:
+            yield "".join(piece)
+            piece = []
+            size = 0
+        piece.append(ch)
+        size += ch_size
+    if piece:
+        yield "".join(piece)
+
+
+def iter_text_chunks(file, chunk_bytes=None, block_size=None):
+    """
+    流式提取文件文本并按大小分块
+
+    每块按 UTF-8 编码后不超过 chunk_bytes，优先在行/段落边界切分。
+    txt 按块读取，内存占用与分块大小而非文件大小相关；docx 会先整体加载到内存，
+    pdf 逐页提取，产出的文本块同样逐块生成。
+
+    Args:
+        file: 文件对象（需有 name 属性并支持 seek/read）
+        chunk_bytes: 每块最大字节数，默认取 UPLOAD_CONFIG
+        block_size: txt 每次读取的字节数，默认取 UPLOAD_CONFIG
+
+    Yields:
+        文本块字符串
+    """
+    chunk_bytes = chunk_bytes or UPLOAD_CONFIG["chunk_bytes"]
+    block_size = block_size or UPLOAD_CONFIG["read_block_bytes"]
+    file_type = file.name.split(".")[-1].lower()
+
+    if file_type in ["txt", "md"]:
+        lines = _iter_txt_lines(file, block_size)
+    elif file_type == "docx":
+        lines = _iter_docx_lines(file)
+    elif file_type == "pdf":
+        lines = _iter_pdf_lines(file)
+    else:
+        raise ValueError(f"不支持的文件类型: {file_type}")
+
+    buffer = []
+    size = 0
+    for line in lines:
+        line_size = len(line.encode("utf-8"))
+        if line_size > chunk_bytes:
+            if buffer:
+                yield "".join(buffer)
+                buffer = []
+                size = 0
+            yield from _split_long_line(line, chunk_bytes)
+            continue
+
+        if size + line_size > chunk_bytes and buffer:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+        buffer.append(line)
+        size += line_size
+
+    if buffer:
+        yield "".join(buffer)
@@ -0,0 +1,166 @@
+# coding: utf-8
+"""
+日志
+基于标准库 logging 的分级日志：业务线程只把日志记录放入队列，
+由后台线程统一格式化并写入控制台/文件；支持 JSON 格式与按比例采样高频日志
+
+用法:
+    logger = get_logger(__name__)
+    logger.warning("红方调用未完成", extra={"session_id": session_id, "code": code})
+    logger.debug("收到内容帧", extra={"sample_rate": 0.01})    # 只保留 1%
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from config import LOG_CONFIG
+
+
+ROOT_LOGGER_NAME = "preplay"
+
+# LogRecord 自带的属性，格式化结构化字段时排除
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class SamplingFilter(logging.Filter):
+    """
+    按比例采样日志
+
+    记录的 extra 中带有 sample_rate 字段时按该比例保留；
+    否则 DEBUG 级别按默认比例保留，其他级别全部保留。
+    """
+
+    def __init__(self, debug_sample_rate=1.0):
+        super().__init__()
+        self.debug_sample_rate = debug_sample_rate
+        self._random = random.Random()
+
+    def filter(self, record):
+        rate = getattr(record, "sample_rate", None)
+        if rate is None:
+            if record.levelno > logging.DEBUG:
+                return True
+            rate = self.debug_sample_rate
+        return rate >= 1 or self._random.random() < rate
+
+
+def _extra_fields(record):
+    """通过 extra 传入的结构化字段"""
+    return {
+        key: value for key, value in vars(record).items()
+        if key not in _RESERVED_ATTRS and key != "sample_rate" and not key.startswith("_")
+    }
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON"""
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage()
+        }
+        entry.update(_extra_fields(record))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """文本格式，结构化字段以 key=value 追加在消息后"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s [%(threadName)s] %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = _extra_fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging(config=None):
+    """
+    配置 preplay 日志（每个进程只配置一次）
+
+    日志记录经 QueueHandler 放入队列，由 QueueListener 后台线程写出，
+    调用方线程不做格式化与 IO。
+
+    Args:
+        config: 日志配置，默认取 LOG_CONFIG
+    """
+    global _listener
+    config = config or LOG_CONFIG
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        formatter = JsonFormatter() if config["format"] == "json" else TextFormatter()
+        handlers = []
+
+        console = logging.StreamHandler(sys.stderr)
+        console.setFormatter(formatter)
+        handlers.append(console)
+
+        if config["file"]:
+            directory = os.path.dirname(config["file"])
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            file_handler = logging.handlers.RotatingFileHandler(
+                config["file"],
+                maxBytes=config["file_max_bytes"],
+                backupCount=config["file_backups"],
+                encoding="utf-8"
+            )
+            file_handler.setFormatter(formatter)
+            handlers.append(file_handler)
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.addFilter(SamplingFilter(config["debug_sample_rate"]))
+
+        root = logging.getLogger(ROOT_LOGGER_NAME)
+        root.setLevel(getattr(logging, config["level"], logging.INFO))
+        root.addHandler(queue_handler)
+        root.propagate = False
+
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def get_logger(name):
+    """
+    获取 preplay 下的日志记录器
+
+    Args:
+        name: 模块名（通常传 __name__）
+
+    Returns:
+        logging.Logger
+    """
+    setup_logging()
+    if name == "__main__" or not name:
+        name = "main"
+    return logging.getLogger(f"{ROOT_LOGGER_NAME}.{name}")
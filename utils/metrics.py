@@ -0,0 +1,347 @@
+# coding: utf-8
+"""
+运行指标
+服务层与数据库层上报计数器与直方图，并通过独立的 HTTP 端口以 Prometheus 文本格式暴露，
+与 Streamlit 服务（8501）并行运行，默认端口 8502
+
+用法:
+    start_metrics_server()            # 幂等，可在每次页面脚本运行时调用
+    curl http://localhost:8502/metrics
+"""
+import sys
+import threading
+import time
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from config import METRICS_CONFIG
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+# 直方图桶上界（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """带标签的计数器"""
+
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield self.name + _format_labels(self.labelnames, labels), value
+
+
+class Histogram:
+    """带标签的直方图"""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [各桶计数, 总和, 总数]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = {labels: (list(entry[0]), entry[1], entry[2]) for labels, entry in self._values.items()}
+        for labels, (counts, total, count) in sorted(values.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield self.name + "_bucket" + _format_labels(self.labelnames, labels, ("le", _format_value(bound))), bucket_count
+            yield self.name + "_bucket" + _format_labels(self.labelnames, labels, ("le", "+Inf")), count
+            yield self.name + "_sum" + _format_labels(self.labelnames, labels), total
+            yield self.name + "_count" + _format_labels(self.labelnames, labels), count
+
+    def label_values(self):
+        """已有观测值的标签组合"""
+        with self._lock:
+            return sorted(self._values)
+
+    def summary(self, *labels):
+        """
+        一组标签的统计
+
+        分位数按桶估算，取所在桶的上界。
+
+        Returns:
+            dict: count, mean, p50, p95, p99, buckets（各桶上界的累计计数）
+        """
+        with self._lock:
+            entry = self._values.get(labels)
+            counts, total, count = (list(entry[0]), entry[1], entry[2]) if entry else ([0] * len(self.buckets), 0.0, 0)
+
+        def quantile(q):
+            if count == 0:
+                return None
+            for bound, bucket_count in zip(self.buckets, counts):
+                if bucket_count >= q * count:
+                    return bound
+            return float("inf")
+
+        buckets = {_format_value(bound): bucket_count for bound, bucket_count in zip(self.buckets, counts)}
+        buckets["+Inf"] = count
+        return {
+            "count": count,
+            "mean": total / count if count else None,
+            "p50": quantile(0.5),
+            "p95": quantile(0.95),
+            "p99": quantile(0.99),
+            "buckets": buckets
+        }
+
+
+class Gauge:
+    """在采集时通过回调取值的仪表"""
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames, collect):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def samples(self):
+        for labels, value in self.collect():
+            yield self.name + _format_labels(self.labelnames, labels), value
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, labelnames, collect):
+        return self._register(Gauge(name, documentation, labelnames, collect))
+
+    def render(self):
+        """以 Prometheus 文本格式输出全部指标"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                lines.append(f"# {metric.name} 采集失败: {str(e)}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for sample, value in samples:
+                lines.append(f"{sample} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+UPSTREAM_REQUESTS = registry.counter(
+    "preplay_upstream_requests_total", "上游调用次数", ("service", "status")
+)
+UPSTREAM_DURATION = registry.histogram(
+    "preplay_upstream_duration_seconds", "上游调用耗时", ("service",)
+)
+UPSTREAM_TTFT = registry.histogram(
+    "preplay_upstream_ttft_seconds", "上游流式调用的首包延迟", ("service",)
+)
+CACHE_REQUESTS = registry.counter(
+    "preplay_cache_requests_total", "缓存查询次数", ("cache", "result")
+)
+DB_QUERY_DURATION = registry.histogram(
+    "preplay_db_query_duration_seconds", "数据库操作耗时（不含等待锁）", ("operation",)
+)
+DB_LOCK_WAIT = registry.histogram(
+    "preplay_db_lock_wait_seconds", "数据库锁等待时间", ()
+)
+TURNS = registry.counter(
+    "preplay_turns_total", "训练轮次数", ("target", "outcome")
+)
+
+# 最近活跃的会话：session_id -> 最后活跃时间
+_session_activity = {}
+_session_lock = threading.Lock()
+
+
+def record_upstream(service, status, elapsed, ttft=None):
+    """
+    记录一次上游调用
+
+    Args:
+        service: 服务名（red/blue/chatdoc/moonshot）
+        status: 结果状态（completed/timeout/cancelled/error 或 HTTP 状态码）
+        elapsed: 耗时（秒）
+        ttft: 首包延迟（秒，可选）
+    """
+    UPSTREAM_REQUESTS.inc(service, str(status))
+    UPSTREAM_DURATION.observe(elapsed, service)
+    if ttft is not None:
+        UPSTREAM_TTFT.observe(ttft, service)
+
+
+def record_cache(cache, hit):
+    """记录一次缓存查询"""
+    CACHE_REQUESTS.inc(cache, "hit" if hit else "miss")
+
+
+def record_db_query(operation, elapsed, lock_wait):
+    """记录一次数据库操作"""
+    DB_QUERY_DURATION.observe(elapsed, operation)
+    DB_LOCK_WAIT.observe(lock_wait)
+
+
+def mark_session_active(session_id):
+    """标记会话活跃"""
+    with _session_lock:
+        _session_activity[session_id] = time.monotonic()
+
+
+def _collect_active_sessions():
+    window = METRICS_CONFIG["active_session_window"]
+    cutoff = time.monotonic() - window
+    with _session_lock:
+        for session_id in [s for s, t in _session_activity.items() if t < cutoff]:
+            del _session_activity[session_id]
+        count = len(_session_activity)
+    yield (), count
+
+
+registry.gauge(
+    "preplay_active_sessions", "最近一段时间内有对话的会话数", (), _collect_active_sessions
+)
+
+
+# ============================================
+# HTTP 端点
+# ============================================
+
+def _make_handler():
+    """构造请求处理类（http.server 只在启动端点时导入，只上报指标的模块不必加载）"""
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # 不在控制台输出每次抓取
+            pass
+
+    return MetricsHandler
+
+
+_server = None
+_server_failed = False
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(host=None, port=None):
+    """
+    启动指标 HTTP 端点（每个进程只启动一次）
+
+    Args:
+        host: 监听地址，默认取配置
+        port: 监听端口，默认取配置
+
+    Returns:
+        是否处于运行状态
+    """
+    global _server, _server_failed
+    if not METRICS_CONFIG["enabled"]:
+        return False
+
+    with _server_lock:
+        if _server is not None:
+            return True
+        if _server_failed:
+            return False
+        from http.server import ThreadingHTTPServer
+        try:
+            _server = ThreadingHTTPServer(
+                (host or METRICS_CONFIG["host"], port or METRICS_CONFIG["port"]),
+                _make_handler()
+            )
+        except OSError as e:
+            # 端口被占用时不再重试，避免每次页面运行都报错
+            _server_failed = True
+            logger.warning("指标端口启动失败: %s", e)
+            return False
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name="preplay-metrics", daemon=True).start()
+        return True
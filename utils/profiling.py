@@ -0,0 +1,375 @@
+# coding: utf-8
+"""
+慢请求性能剖析
+训练轮次与报告生成在剖析下运行，耗时超过阈值时把剖析结果按会话ID保存到磁盘，
+未超过阈值的结果直接丢弃；默认关闭
+
+两种模式:
+    sampling：后台线程定时采样参与本次请求的各线程调用栈，输出折叠栈（flamegraph/speedscope 可直接打开）
+    cprofile：每个参与线程各自运行 cProfile，合并后输出 .prof（pstats/snakeviz 可直接打开）
+
+用法:
+    with profile_slow("turn", session_id=session_id, threshold=15):
+        ...
+
+    python -m utils.profiling <session_id>        # 列出会话的剖析结果
+    python -m utils.profiling <file.folded|.prof> # 打印热点
+"""
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from config import PROFILING_CONFIG
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+_active_profile = contextvars.ContextVar("preplay_profile", default=None)
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame):
+    """把调用栈折叠为 "外层;...;内层" 的字符串"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class Profile:
+    """一次请求的剖析"""
+
+    def __init__(self, name, session_id=None, mode="sampling", attrs=None):
+        self.name = name
+        self.session_id = session_id
+        self.mode = mode
+        self.attrs = dict(attrs or {})
+        self.stacks = Counter()
+        self.samples = 0
+        self._threads = {}
+        self._profilers = []
+        self._lock = threading.Lock()
+
+    def enter_thread(self):
+        """
+        当前线程开始参与本次剖析
+
+        Returns:
+            传给 exit_thread 的句柄
+        """
+        ident = threading.get_ident()
+        with self._lock:
+            self._threads[ident] = self._threads.get(ident, 0) + 1
+
+        profiler = None
+        if self.mode == "cprofile":
+            import cProfile
+
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # 当前线程已有其他剖析器在运行
+                profiler = None
+        return ident, profiler
+
+    def exit_thread(self, handle):
+        ident, profiler = handle
+        if profiler is not None:
+            profiler.disable()
+            with self._lock:
+                self._profilers.append(profiler)
+        with self._lock:
+            count = self._threads.get(ident, 0) - 1
+            if count > 0:
+                self._threads[ident] = count
+            else:
+                self._threads.pop(ident, None)
+
+    def sample(self, frames):
+        """记录一次采样（由采样线程调用）"""
+        with self._lock:
+            idents = list(self._threads)
+        for ident in idents:
+            frame = frames.get(ident)
+            if frame is not None:
+                stack = _collapse(frame)
+                with self._lock:
+                    self.stacks[stack] += 1
+        with self._lock:
+            self.samples += 1
+
+    def save(self, path_stem):
+        """
+        写出剖析结果
+
+        Args:
+            path_stem: 不带扩展名的文件路径
+
+        Returns:
+            结果文件路径，没有可保存的内容时返回None
+        """
+        with self._lock:
+            stacks = dict(self.stacks)
+            profilers = list(self._profilers)
+
+        if self.mode == "cprofile":
+            if not profilers:
+                return None
+            import pstats
+
+            stats = pstats.Stats(profilers[0])
+            for profiler in profilers[1:]:
+                stats.add(profiler)
+            path = path_stem + ".prof"
+            stats.dump_stats(path)
+            return path
+
+        if not stacks:
+            return None
+        path = path_stem + ".folded"
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(stacks.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+class _Sampler:
+    """所有采样模式剖析共用的后台采样线程，没有进行中的剖析时自动退出"""
+
+    def __init__(self):
+        self._profiles = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, profile, interval):
+        with self._lock:
+            self._profiles.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, args=(interval,), name="preplay-profiler", daemon=True
+                )
+                self._thread.start()
+
+    def remove(self, profile):
+        with self._lock:
+            self._profiles.discard(profile)
+
+    def _run(self, interval):
+        while True:
+            with self._lock:
+                profiles = list(self._profiles)
+                if not profiles:
+                    self._thread = None
+                    return
+            frames = sys._current_frames()
+            for profile in profiles:
+                profile.sample(frames)
+            del frames
+            time.sleep(interval)
+
+
+_sampler = _Sampler()
+
+
+def bind_profile(fn):
+    """
+    让在线程池中执行的任务归属到当前剖析
+
+    Args:
+        fn: 要提交到线程池的函数
+
+    Returns:
+        未处于剖析中时原样返回 fn
+    """
+    profile = _active_profile.get()
+    if profile is None:
+        return fn
+
+    def run(*args, **kwargs):
+        handle = profile.enter_thread()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.exit_thread(handle)
+
+    return run
+
+
+def _session_dir(session_id, config):
+    return os.path.join(config["output_dir"], session_id or "_nosession")
+
+
+def _prune(directory, keep):
+    """每个会话只保留最近的若干份结果"""
+    metas = sorted(f for f in os.listdir(directory) if f.endswith(".json"))
+    for meta in metas[:max(len(metas) - keep, 0)]:
+        stem = os.path.join(directory, meta[:-len(".json")])
+        for ext in (".json", ".folded", ".prof"):
+            if os.path.exists(stem + ext):
+                os.remove(stem + ext)
+
+
+def _save(profile, elapsed, threshold, config):
+    directory = _session_dir(profile.session_id, config)
+    os.makedirs(directory, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    stem = os.path.join(directory, f"{stamp}-{int(time.time() * 1000) % 1000:03d}_{profile.name}")
+
+    path = profile.save(stem)
+    if path is None:
+        return None
+
+    meta = {
+        "name": profile.name,
+        "session_id": profile.session_id,
+        "mode": profile.mode,
+        "elapsed": elapsed,
+        "threshold": threshold,
+        "samples": profile.samples,
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "file": os.path.basename(path),
+        "attrs": profile.attrs
+    }
+    with open(stem + ".json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2, default=str)
+
+    _prune(directory, config["max_per_session"])
+    return path
+
+
+@contextmanager
+def profile_slow(name, session_id=None, threshold=None, config=None, **attrs):
+    """
+    在剖析下执行一段代码，耗时超过阈值时保存剖析结果
+
+    未启用剖析、或已处于剖析中时不做任何事。
+
+    Args:
+        name: 剖析名称（如 turn、report）
+        session_id: 会话ID（可选）
+        threshold: 保存阈值（秒），默认取配置中 {name}_threshold，没有则为 0
+        config: 剖析配置，默认取 PROFILING_CONFIG
+        **attrs: 一并保存的属性
+
+    Yields:
+        Profile，未剖析时为None
+    """
+    config = config or PROFILING_CONFIG
+    if not config["enabled"] or _active_profile.get() is not None:
+        yield None
+        return
+
+    if threshold is None:
+        threshold = config.get(f"{name}_threshold", 0)
+
+    profile = Profile(name, session_id, config["mode"], attrs)
+    token = _active_profile.set(profile)
+    handle = profile.enter_thread()
+    if profile.mode != "cprofile":
+        _sampler.add(profile, config["sample_interval"])
+    start = time.perf_counter()
+    try:
+        yield profile
+    finally:
+        elapsed = time.perf_counter() - start
+        _sampler.remove(profile)
+        profile.exit_thread(handle)
+        _active_profile.reset(token)
+
+        if elapsed >= threshold:
+            try:
+                path = _save(profile, elapsed, threshold, config)
+                if path:
+                    logger.warning(
+                        "%s 耗时 %.1fs 超过阈值，已保存性能剖析: %s", name, elapsed, path,
+                        extra={"session_id": session_id}
+                    )
+            except Exception as e:
+                logger.warning("保存性能剖析失败: %s", e)
+
+
+def list_profiles(session_id, config=None):
+    """
+    列出会话保存的剖析结果（按时间先后）
+
+    Args:
+        session_id: 会话ID
+        config: 剖析配置，默认取 PROFILING_CONFIG
+
+    Returns:
+        [元数据dict（含结果文件完整路径 path）, ...]
+    """
+    config = config or PROFILING_CONFIG
+    directory = _session_dir(session_id, config)
+    if not os.path.isdir(directory):
+        return []
+
+    profiles = []
+    for meta_name in sorted(f for f in os.listdir(directory) if f.endswith(".json")):
+        with open(os.path.join(directory, meta_name), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        meta["path"] = os.path.join(directory, meta["file"])
+        profiles.append(meta)
+    return profiles
+
+
+def summarize_folded(path, limit=20):
+    """
+    汇总折叠栈文件中的热点
+
+    Args:
+        path: .folded 文件路径
+        limit: 返回的条数
+
+    Returns:
+        (按自身采样数排序的 [(函数, 采样数)], 总采样数)
+    """
+    own = Counter()
+    total = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            if not stack:
+                continue
+            count = int(count)
+            total += count
+            own[stack.rsplit(";", 1)[-1]] += count
+    return own.most_common(limit), total
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("用法: python -m utils.profiling <session_id | file.folded | file.prof>")
+        sys.exit(1)
+
+    target = sys.argv[1]
+    if target.endswith(".prof"):
+        import pstats
+
+        pstats.Stats(target).sort_stats("cumulative").print_stats(30)
+    elif target.endswith(".folded"):
+        hot, total = summarize_folded(target)
+        print(f"{'采样数':>8}{'占比':>8}  函数")
+        for label, count in hot:
+            print(f"{count:>8}{count / total:>8.1%}  {label}")
+    else:
+        for meta in list_profiles(target):
+            print(f"{meta['created_at']}  {meta['name']:<8}{meta['elapsed']:>8.1f}s  {meta['path']}")
@@ -0,0 +1,356 @@
+# coding: utf-8
+"""
+链路追踪
+记录一次训练轮次（或报告生成）中各阶段的耗时与属性（首包延迟、输出长度、请求/响应大小等），
+按会话保存在内存中，可导出为 JSON Lines，并按阶段汇总为延迟直方图
+
+用法:
+    with trace("turn", session_id=session_id):
+        with span("retrieval") as s:
+            ...
+            s.set(kb_used=True)
+
+    在线程池中执行的任务需要通过 submit_with_context 提交，才能归属到当前追踪。
+
+    python -m utils.tracing traces.jsonl   # 汇总导出文件中各阶段的耗时分布
+"""
+import atexit
+import contextvars
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from config import TRACING_CONFIG
+from utils.logger import get_logger
+from utils.metrics import Histogram
+from utils.profiling import bind_profile
+
+logger = get_logger(__name__)
+
+
+# 直方图桶上界（毫秒）
+HISTOGRAM_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+
+def _stage_histogram():
+    """按阶段名分组的耗时直方图（毫秒）"""
+    return Histogram("preplay_trace_stage_ms", "追踪各阶段耗时（毫秒）", ("stage",), HISTOGRAM_BUCKETS_MS)
+
+
+class Span:
+    """一个阶段"""
+
+    def __init__(self, name, parent_id=None, attrs=None):
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = dict(attrs or {})
+        self.thread = threading.current_thread().name
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self.duration = None
+        self.error = None
+
+    def set(self, **attrs):
+        """设置阶段属性"""
+        self.attrs.update(attrs)
+        return self
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._t0
+
+    def to_dict(self):
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": self.duration * 1000 if self.duration is not None else None,
+            "thread": self.thread,
+            "error": self.error,
+            "attrs": self.attrs
+        }
+
+
+class _NullSpan:
+    """未处于追踪中时返回的空阶段"""
+
+    span_id = None
+
+    def set(self, **attrs):
+        return self
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Trace:
+    """一次追踪（一轮对话或一次报告生成）"""
+
+    def __init__(self, name, session_id=None, attrs=None):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.session_id = session_id
+        self.root = Span(name, attrs=attrs)
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self):
+        with self._lock:
+            spans = [span.to_dict() for span in self.spans]
+        return {
+            "trace_id": self.trace_id,
+            "session_id": self.session_id,
+            "name": self.name,
+            "start": self.root.start,
+            "duration_ms": self.root.duration * 1000 if self.root.duration is not None else None,
+            "attrs": self.root.attrs,
+            "spans": spans
+        }
+
+
+_current_trace = contextvars.ContextVar("preplay_trace", default=None)
+_current_span = contextvars.ContextVar("preplay_span", default=None)
+
+
+class TraceExporter:
+    """
+    后台写入追踪记录的 JSON Lines 导出
+
+    请求线程只把已结束的追踪放入队列，由后台线程序列化并写入一直打开的文件，
+    队列暂时为空时刷新到磁盘，导出不占用请求的耗时。
+    """
+
+    _STOP = object()
+
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="preplay-trace-export", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, trace):
+        self._queue.put(trace)
+
+    def _run(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                item = self._queue.get()
+                if item is self._STOP:
+                    return
+                try:
+                    f.write(json.dumps(item.to_dict(), ensure_ascii=False) + "\n")
+                    if self._queue.empty():
+                        f.flush()
+                except Exception as e:
+                    logger.warning("导出追踪记录失败: %s", e)
+
+    def close(self, timeout=5):
+        """写完队列中的记录后关闭文件"""
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join(timeout)
+
+
+class TraceStore:
+    """追踪记录的保存、导出与聚合"""
+
+    def __init__(self, config=None):
+        self.config = config or TRACING_CONFIG
+        # 会话ID -> 最近的追踪记录，按最近使用淘汰
+        self._sessions = OrderedDict()
+        self._histogram = _stage_histogram()
+        self._lock = threading.Lock()
+        self._exporter = None
+
+    def record(self, trace):
+        """保存一次已结束的追踪"""
+        self._histogram.observe(trace.root.duration * 1000, trace.name)
+        for span in trace.spans:
+            if span.duration is not None:
+                self._histogram.observe(span.duration * 1000, f"{trace.name}.{span.name}")
+
+        if trace.session_id:
+            with self._lock:
+                traces = self._sessions.get(trace.session_id)
+                if traces is None:
+                    traces = deque(maxlen=self.config["max_traces_per_session"])
+                    self._sessions[trace.session_id] = traces
+                self._sessions.move_to_end(trace.session_id)
+                traces.append(trace)
+                while len(self._sessions) > self.config["max_sessions"]:
+                    self._sessions.popitem(last=False)
+
+        path = self.config["export_path"]
+        if path:
+            with self._lock:
+                if self._exporter is None:
+                    self._exporter = TraceExporter(path)
+            self._exporter.submit(trace)
+
+    def get_session_traces(self, session_id):
+        with self._lock:
+            traces = list(self._sessions.get(session_id, []))
+        return [trace.to_dict() for trace in traces]
+
+    def get_histograms(self):
+        return {name: self._histogram.summary(name) for (name,) in self._histogram.label_values()}
+
+
+# 全局实例
+_trace_store = None
+_trace_store_lock = threading.Lock()
+
+
+def get_trace_store():
+    """获取追踪记录存储实例（单例）"""
+    global _trace_store
+    with _trace_store_lock:
+        if _trace_store is None:
+            _trace_store = TraceStore()
+        return _trace_store
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    记录当前追踪中的一个阶段，未处于追踪中时不做任何记录
+
+    Args:
+        name: 阶段名称
+        **attrs: 阶段属性
+
+    Yields:
+        Span（可调用 set 补充属性）
+    """
+    trace_obj = _current_trace.get()
+    if trace_obj is None:
+        yield NULL_SPAN
+        return
+
+    parent = _current_span.get()
+    current = Span(name, parent.span_id if parent is not None else None, attrs)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = str(e) or type(e).__name__
+        raise
+    finally:
+        current.finish()
+        _current_span.reset(token)
+        trace_obj.add(current)
+
+
+@contextmanager
+def trace(name, session_id=None, **attrs):
+    """
+    开始一次追踪；已处于追踪中时等同于 span
+
+    Args:
+        name: 追踪名称（如 turn、report）
+        session_id: 会话ID（可选）
+        **attrs: 追踪属性
+
+    Yields:
+        根 Span（可调用 set 补充属性）
+    """
+    if not TRACING_CONFIG["enabled"]:
+        yield NULL_SPAN
+        return
+    if _current_trace.get() is not None:
+        with span(name, **attrs) as current:
+            yield current
+        return
+
+    trace_obj = Trace(name, session_id, attrs)
+    trace_token = _current_trace.set(trace_obj)
+    span_token = _current_span.set(trace_obj.root)
+    try:
+        yield trace_obj.root
+    except BaseException as e:
+        trace_obj.root.error = str(e) or type(e).__name__
+        raise
+    finally:
+        trace_obj.root.finish()
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        try:
+            get_trace_store().record(trace_obj)
+        except Exception as e:
+            logger.warning("保存追踪记录失败: %s", e)
+
+
+def submit_with_context(executor, fn, *args, **kwargs):
+    """在线程池中执行任务，并沿用当前的追踪上下文（及性能剖析）"""
+    ctx = contextvars.copy_context()
+    return executor.submit(ctx.run, bind_profile(fn), *args, **kwargs)
+
+
+def get_session_traces(session_id):
+    """获取会话最近的追踪记录"""
+    return get_trace_store().get_session_traces(session_id)
+
+
+def get_trace_histograms():
+    """获取各阶段的延迟直方图（毫秒）"""
+    return get_trace_store().get_histograms()
+
+
+def summarize_export(path):
+    """
+    汇总导出文件中各阶段的耗时
+
+    Args:
+        path: JSON Lines 文件路径
+
+    Returns:
+        {阶段名: 直方图统计}
+    """
+    histogram = _stage_histogram()
+
+    def observe(name, duration_ms):
+        if duration_ms is not None:
+            histogram.observe(duration_ms, name)
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            observe(record["name"], record["duration_ms"])
+            for item in record["spans"]:
+                observe(f"{record['name']}.{item['name']}", item["duration_ms"])
+
+    return {name: histogram.summary(name) for (name,) in histogram.label_values()}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("用法: python -m utils.tracing <traces.jsonl>")
+        sys.exit(1)
+    print(f"{'阶段':<36}{'次数':>6}{'平均':>10}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for stage, stats in summarize_export(sys.argv[1]).items():
+        cells = "".join(f"{stats[k]:>9g}" for k in ("p50", "p95", "p99"))
+        print(f"{stage:<36}{stats['count']:>6}{stats['mean']:>10.1f}{cells}")